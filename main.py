@@ -8,10 +8,11 @@ import asyncio
 from datetime import datetime
 import webbrowser
 
+from src.core.config import USE_UVLOOP
 from src.core.utils import logger, sanitize_filename, show_animation, print_progress
 from src.search.planned_topics import TopicPlanner
 from src.search.planned_searching import SearchQueryPlanner
-from src.search.scraping import run_search, scrape_top_ranked_results
+from src.search.scraping import run_search, scrape_top_ranked_results, close_search_engine
 from src.processing.ranking_search_result import SearchResultRanker
 from src.processing.summarizer import DocumentSummarizer
 from src.processing.ranking_summary import SummaryRanker
@@ -189,179 +190,190 @@ async def main():
     # Создаем менеджер кэша
     cache_manager = CacheManager()
     
-    while True:
-        try:
-            # Шаг 1: Получение запроса от пользователя
-            print_step(1, "Ввод запроса")
-            query = get_user_query()
-            
-            # Генерируем имя темы для кэширования
-            theme_name = cache_manager.generate_theme_name(query)
-            
-            # Шаг 2: Генерация подзапросов
-            print_step(2, "Генерация подзапросов")
-            topic_planner = TopicPlanner()
-            subtopics = topic_planner.generate_subtopics(query)
-            
-            # Шаг 3: Отображение и редактирование подзапросов
-            print_step(3, "Просмотр и редактирование подзапросов")
-            final_subtopics = display_subtopics(subtopics)
-            
-            if not final_subtopics:
-                print("Список подзапросов пуст. Поиск не будет выполнен.")
-                continue
-            
-            # Сохраняем подзапросы в файл
-            subtopics_file = topic_planner.save_subtopics_to_file(final_subtopics, query, theme_name)
-            
-            # Шаг 4: Генерация поисковых запросов для каждого подзапроса
-            print_step(4, "Генерация поисковых запросов")
-            search_query_planner = SearchQueryPlanner()
-            
-            print("Генерация поисковых запросов для каждого подзапроса...")
-            search_queries_dict = search_query_planner.generate_all_search_queries(final_subtopics)
-            
-            # Сохраняем поисковые запросы в файл
-            search_queries_file = search_query_planner.save_search_queries_to_file(search_queries_dict, theme_name)
-            
-            # Шаг 5: Выполнение поиска
-            print_step(5, "Выполнение поиска")
-            print(f"Выполняем поиск по {len(final_subtopics)} подзапросам...")
-            
-            # Информация о лимитах API
-            print("\nВажно: Поиск может занять некоторое время из-за ограничений API:")
-            print("- SearchXNG: до 10 запросов в минуту")
-            print("- r.jina.ai: до 5 запросов в секунду (для получения Markdown-представления страниц)")
-            print("- AITUNNEL: до 2 запросов в секунду (для рейтинга и саммаризации)\n")
-            
-            # Анимация поиска
-            show_animation()
-            
-            # Выполняем поиск асинхронно (на этом этапе только получаем результаты поиска без скрапинга)
-            search_results = await run_search(search_queries_dict, theme_name)
-            
-            if not search_results:
-                print("Не удалось выполнить поиск. Пожалуйста, проверьте подключение к интернету и попробуйте снова.")
-                continue
-            
-            # Шаг 6: Ранжирование результатов поиска с использованием LLM
-            print_step(6, "Ранжирование результатов поиска с помощью языковой модели")
-            search_result_ranker = SearchResultRanker()
-            
-            print("Оценка результатов поиска по 5 критериям с помощью языковой модели:")
-            print("1. Соответствие исходному запросу")
-            print("2. Соответствие направлению поиска (подзапросу)")
-            print("3. Полнота информации")
-            print("4. Точность данных")
-            print("5. Читабельность и структура")
-            
-            # Ранжируем результаты поиска
-            ranked_results = search_result_ranker.process_search_results(search_results, query)
-            
-            # Сохраняем отранжированные результаты
-            ranked_results_file = search_result_ranker.save_ranked_results_to_json(ranked_results, theme_name)
-            
-            # Шаг 7: Скрапинг содержимого топ-5 страниц
-            print_step(7, "Скрапинг содержимого топ-15 страниц")
-            print("Скрапинг содержимого только для 15 наиболее релевантных результатов...")
-            
-            # Выполняем скрапинг только для топ-5 отранжированных результатов
-            top_results_with_content = await scrape_top_ranked_results(ranked_results[:15], theme_name)
-            
-            if not top_results_with_content:
-                print("Не удалось получить содержимое страниц. Проверьте подключение к интернету и попробуйте снова.")
-                continue
-            
-            # Шаг 8: Саммаризация документов
-            print_step(8, "Саммаризация документов")
-            document_summarizer = DocumentSummarizer()
-            
-            summaries = []
-            
-            print(f"Создание саммари для {len(top_results_with_content)} документов...")
-            for i, result in enumerate(top_results_with_content, 1):
-                title = result.get("title", "")
-                content = result.get("content", "")
-                url = result.get("url", "")
+    try:
+        while True:
+            try:
+                # Шаг 1: Получение запроса от пользователя
+                print_step(1, "Ввод запроса")
+                query = get_user_query()
                 
-                print(f"[{i}/{len(top_results_with_content)}] Саммаризация: {title[:50]}...", end="\r")
+                # Генерируем имя темы для кэширования
+                theme_name = cache_manager.generate_theme_name(query)
                 
-                summary = document_summarizer.create_summary(content, title, url, query, theme_name)
-                if summary:
-                    summaries.append(summary)
-            
-            print(f"\nСоздано {len(summaries)} саммари.")
-            
-            # Шаг 9: Ранжирование саммари
-            print_step(9, "Ранжирование саммари")
-            summary_ranker = SummaryRanker()
-            
-            print("Оценка саммари по 5 критериям с помощью языковой модели:")
-            print("1. Соответствие исходному запросу")
-            print("2. Полнота информации")
-            print("3. Точность информации")
-            print("4. Информативность")
-            print("5. Читабельность и структура")
-            
-            # Ранжируем саммари
-            ranked_summaries = summary_ranker.rank_summaries(summaries, query, theme_name)
-            
-            # Шаг 10: Генерация итогового ответа
-            print_step(10, "Генерация итогового ответа")
-            answer_generator = AnswerGenerator()
-            
-            # Выбираем топ-5 наиболее релевантных саммари для определения источников
-            top_summaries = ranked_summaries[:5]
-            
-            # Получаем полные тексты документов, соответствующие топ-5 саммари
-            print(f"Подготовка полных текстов {len(top_summaries)} наиболее релевантных документов...")
-            
-            # Находим полные документы, соответствующие топ-саммари
-            full_documents = []
-            for summary in top_summaries:
-                # Находим соответствующий полный документ из top_results_with_content
-                document_url = summary.get("url", "")
-                for doc in top_results_with_content:
-                    if doc.get("url", "") == document_url:
-                        full_doc = {
-                            "title": doc.get("title", ""),
-                            "url": doc.get("url", ""),
-                            "content": doc.get("content", ""),  # Полный текст документа
-                            "rating": summary.get("rating", 0)  # Рейтинг из саммари
-                        }
-                        full_documents.append(full_doc)
-                        break
-            
-            print(f"Генерация ответа на основе полных текстов {len(full_documents)} наиболее релевантных документов...")
-            answer = answer_generator.generate_answer(query, full_documents, theme_name)
-            
-            # Выводим итоговый ответ
-            print("\n" + "=" * 80)
-            print("ИТОГОВЫЙ ОТВЕТ:".center(80))
-            print("=" * 80 + "\n")
-            
-            print(answer)
-            
-            # Спрашиваем пользователя о дальнейших действиях
-            print("\n" + "=" * 80)
-            print("\nСсылка на ответ: " + os.path.expanduser(f"~/mind-search/{theme_name}.html"))
-            print("\n" + "=" * 80)
-            input("\nНажмите Enter для продолжения...")
-            
-            # открываем файл в браузере
-            webbrowser.open(os.path.expanduser(f"~/mind-search/{theme_name}.html"))
+                # Шаг 2: Генерация подзапросов
+                print_step(2, "Генерация подзапросов")
+                topic_planner = TopicPlanner()
+                
+                # Синхронный запрос к LLM выполняется в отдельном потоке, чтобы не блокировать цикл событий
+                subtopics = await asyncio.to_thread(topic_planner.generate_subtopics, query)
+                
+                # Шаг 3: Отображение и редактирование подзапросов
+                print_step(3, "Просмотр и редактирование подзапросов")
+                final_subtopics = display_subtopics(subtopics)
+                
+                if not final_subtopics:
+                    print("Список подзапросов пуст. Поиск не будет выполнен.")
+                    continue
+                
+                # Сохраняем подзапросы в файл в отдельном потоке, не блокируя цикл событий
+                subtopics_file = await asyncio.to_thread(topic_planner.save_subtopics_to_file, final_subtopics, query, theme_name)
+                
+                # Шаг 4: Генерация поисковых запросов для каждого подзапроса
+                print_step(4, "Генерация поисковых запросов")
+                search_query_planner = SearchQueryPlanner()
+                
+                print("Генерация поисковых запросов для каждого подзапроса...")
+                search_queries_dict = await asyncio.to_thread(search_query_planner.generate_all_search_queries, final_subtopics)
+                
+                # Сохраняем поисковые запросы в файл
+                search_queries_file = await asyncio.to_thread(search_query_planner.save_search_queries_to_file, search_queries_dict, theme_name)
+                
+                # Шаг 5: Выполнение поиска
+                print_step(5, "Выполнение поиска")
+                print(f"Выполняем поиск по {len(final_subtopics)} подзапросам...")
+                
+                # Информация о лимитах API
+                print("\nВажно: Поиск может занять некоторое время из-за ограничений API:")
+                print("- SearchXNG: до 10 запросов в минуту")
+                print("- r.jina.ai: до 5 запросов в секунду (для получения Markdown-представления страниц)")
+                print("- AITUNNEL: до 2 запросов в секунду (для рейтинга и саммаризации)\n")
+                
+                # Анимация поиска
+                show_animation()
+                
+                # Выполняем поиск асинхронно (на этом этапе только получаем результаты поиска без скрапинга)
+                search_results = await run_search(search_queries_dict, theme_name)
+                
+                if not search_results:
+                    print("Не удалось выполнить поиск. Пожалуйста, проверьте подключение к интернету и попробуйте снова.")
+                    continue
+                
+                # Шаг 6: Ранжирование результатов поиска с использованием LLM
+                print_step(6, "Ранжирование результатов поиска с помощью языковой модели")
+                search_result_ranker = SearchResultRanker()
+                
+                print("Оценка результатов поиска по 5 критериям с помощью языковой модели:")
+                print("1. Соответствие исходному запросу")
+                print("2. Соответствие направлению поиска (подзапросу)")
+                print("3. Полнота информации")
+                print("4. Точность данных")
+                print("5. Читабельность и структура")
+                
+                # Ранжируем результаты поиска
+                ranked_results = search_result_ranker.process_search_results(search_results, query, theme_name=theme_name)
+                
+                # Сохраняем отранжированные результаты
+                ranked_results_file = search_result_ranker.save_ranked_results_to_json(ranked_results, theme_name)
+                
+                # Шаг 7: Скрапинг содержимого топ-5 страниц
+                print_step(7, "Скрапинг содержимого топ-15 страниц")
+                print("Скрапинг содержимого только для 15 наиболее релевантных результатов...")
+                
+                # Выполняем скрапинг только для топ-5 отранжированных результатов
+                top_results_with_content = await scrape_top_ranked_results(ranked_results[:15], theme_name)
+                
+                if not top_results_with_content:
+                    print("Не удалось получить содержимое страниц. Проверьте подключение к интернету и попробуйте снова.")
+                    continue
+                
+                # Шаг 8: Саммаризация документов
+                print_step(8, "Саммаризация документов")
+                document_summarizer = DocumentSummarizer()
+                
+                print(f"Создание саммари для {len(top_results_with_content)} документов...")
+                summaries = document_summarizer.create_summaries(top_results_with_content, query, theme_name)
+                
+                print(f"\nСоздано {len(summaries)} саммари.")
+                
+                # Шаг 9: Ранжирование саммари
+                print_step(9, "Ранжирование саммари")
+                summary_ranker = SummaryRanker()
+                
+                print("Оценка саммари по 5 критериям с помощью языковой модели:")
+                print("1. Соответствие исходному запросу")
+                print("2. Полнота информации")
+                print("3. Точность информации")
+                print("4. Информативность")
+                print("5. Читабельность и структура")
+                
+                # Ранжируем саммари
+                ranked_summaries = summary_ranker.rank_summaries(summaries, query, theme_name)
+                
+                # Шаг 10: Генерация итогового ответа
+                print_step(10, "Генерация итогового ответа")
+                answer_generator = AnswerGenerator()
+                
+                # Выбираем топ-5 наиболее релевантных саммари для определения источников
+                top_summaries = ranked_summaries[:5]
+                
+                # Получаем полные тексты документов, соответствующие топ-5 саммари
+                print(f"Подготовка полных текстов {len(top_summaries)} наиболее релевантных документов...")
+                
+                # Находим полные документы, соответствующие топ-саммари
+                full_documents = []
+                for summary in top_summaries:
+                    # Находим соответствующий полный документ из top_results_with_content
+                    document_url = summary.get("url", "")
+                    for doc in top_results_with_content:
+                        if doc.get("url", "") == document_url:
+                            full_doc = {
+                                "title": doc.get("title", ""),
+                                "url": doc.get("url", ""),
+                                "content": doc.get("content", ""),  # Полный текст документа
+                                "rating": summary.get("rating", 0)  # Рейтинг из саммари
+                            }
+                            full_documents.append(full_doc)
+                            break
+                
+                print(f"Генерация ответа на основе полных текстов {len(full_documents)} наиболее релевантных документов...")
+                answer = answer_generator.generate_answer(query, full_documents, theme_name)
+                
+                # Выводим итоговый ответ
+                print("\n" + "=" * 80)
+                print("ИТОГОВЫЙ ОТВЕТ:".center(80))
+                print("=" * 80 + "\n")
+                
+                print(answer)
+                
+                # Спрашиваем пользователя о дальнейших действиях
+                print("\n" + "=" * 80)
+                print("\nСсылка на ответ: " + os.path.expanduser(f"~/mind-search/{theme_name}.html"))
+                print("\n" + "=" * 80)
+                input("\nНажмите Enter для продолжения...")
+                
+                # открываем файл в браузере
+                webbrowser.open(os.path.expanduser(f"~/mind-search/{theme_name}.html"))
+
+            except KeyboardInterrupt:
+                print("\n\nРабота программы прервана пользователем.")
+                break
+            except Exception as e:
+                logger.error(f"Произошла ошибка: {e}")
+                print(f"\nПроизошла ошибка: {e}")
+                print("Пожалуйста, попробуйте снова или проверьте логи для получения дополнительной информации.")
+                input("\nНажмите Enter для продолжения...")
+    finally:
+        # Закрываем общую HTTP-сессию поисковика
+        await close_search_engine()
 
-        except KeyboardInterrupt:
-            print("\n\nРабота программы прервана пользователем.")
-            break
-        except Exception as e:
-            logger.error(f"Произошла ошибка: {e}")
-            print(f"\nПроизошла ошибка: {e}")
-            print("Пожалуйста, попробуйте снова или проверьте логи для получения дополнительной информации.")
-            input("\nНажмите Enter для продолжения...")
+def install_event_loop_policy():
+    """
+    Включает цикл событий uvloop, если он разрешен настройками и установлен.
+    В остальных случаях (в том числе на Windows) используется стандартный цикл asyncio
+    """
+    if not USE_UVLOOP:
+        return
+    
+    try:
+        import uvloop
+        uvloop.install()
+        logger.debug("Используется цикл событий uvloop")
+    except ImportError:
+        logger.debug("uvloop не установлен, используется стандартный цикл событий asyncio")
 
 if __name__ == "__main__":
     try:
+        install_event_loop_policy()
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\n\nРабота программы прервана пользователем.")
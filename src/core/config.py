@@ -13,18 +13,48 @@ SEARCHXNG_BASIC_AUTH_PASSWORD = os.getenv("SEARCHXNG_BASIC_AUTH_PASSWORD")
 # Настройки лимитов запросов
 SEARCHXNG_RPM = int(os.getenv("LIMIT_SEARCHXNG_RPM", "10"))  # Запросов в минуту
 SEARCHXNG_INTERVAL = 60.0 / SEARCHXNG_RPM  # Интервал между запросами в секундах
+SEARCHXNG_MAX_CONCURRENCY = int(os.getenv("LIMIT_SEARCHXNG_CONCURRENCY", "10"))  # Одновременных запросов
 JINA_RPS = float(os.getenv("LIMIT_JINA_RPS", "5"))  # Запросов в секунду
+JINA_MAX_CONCURRENCY = int(os.getenv("LIMIT_JINA_CONCURRENCY", "20"))  # Одновременных запросов
+HOST_RPS = float(os.getenv("LIMIT_HOST_RPS", "2"))  # Запросов в секунду к одному сайту при загрузке страниц
 AITUNNEL_RPS = float(os.getenv("LIMIT_AITUNNEL_RPS", "2"))  # Запросов в секунду
+AITUNNEL_MAX_CONCURRENCY = int(os.getenv("LIMIT_AITUNNEL_CONCURRENCY", "4"))  # Одновременных запросов
+AITUNNEL_BURST = int(os.getenv("LIMIT_AITUNNEL_BURST", "1"))  # Запросов подряд без ожидания после простоя
 
 # Настройки путей
 CACHE_DIR = os.path.join(os.getcwd(), os.getenv("CACHE_DIR", "cache"))
 DOCS_DIR = os.path.join(CACHE_DIR, os.getenv("DOCS_DIR", "docs"))
 SUMMARIES_DIR = os.path.join(CACHE_DIR, os.getenv("SUMMARIES_DIR", "summaries"))
 
+# Настройки кэша ответов LLM
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS")) if os.getenv("LLM_CACHE_TTL_SECONDS") else None  # None - без ограничения
+
+# Время жизни сохраненных результатов поиска темы в секундах (0 - всегда выполнять поиск заново)
+SEARCH_RESULTS_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_RESULTS_CACHE_TTL_SECONDS", "86400"))
+
+# Цикл событий uvloop вместо стандартного asyncio (если установлен, кроме Windows)
+USE_UVLOOP = os.getenv("USE_UVLOOP", "true").lower() in ("1", "true", "yes")
+
 # Настройки запросов
 MAX_RESULTS_PER_QUERY = os.getenv("MAX_RESULTS_PER_QUERY", "5")
 MAX_SUMMARIES_FOR_ANSWER = os.getenv("MAX_SUMMARIES_FOR_ANSWER", "5")
 
+# Настройки пакетного ранжирования результатов поиска
+RANKING_BATCH_SIZE = int(os.getenv("RANKING_BATCH_SIZE", "25"))  # Максимум результатов в одном пакете
+RANKING_BATCH_MAX_TOKENS = int(os.getenv("RANKING_BATCH_MAX_TOKENS", "6000"))  # Бюджет токенов на результаты в пакете
+RANKING_MIN_SCORE = float(os.getenv("RANKING_MIN_SCORE", "0"))  # Минимальный рейтинг результата (результаты с нулевым рейтингом отбрасываются всегда)
+
+# Настройки пакетного ранжирования саммари
+RANKING_SUMMARY_BATCH_SIZE = int(os.getenv("RANKING_SUMMARY_BATCH_SIZE", "5"))  # Максимум саммари в одном запросе к LLM
+
+# Настройки пакетной генерации поисковых запросов
+SEARCH_QUERIES_BATCH_SIZE = int(os.getenv("SEARCH_QUERIES_BATCH_SIZE", "8"))  # Максимум подзапросов в одном запросе к LLM
+
+# Настройки пакетной саммаризации документов
+SUMMARIZATION_BATCH_SIZE = int(os.getenv("SUMMARIZATION_BATCH_SIZE", "3"))  # Максимум документов в одном запросе к LLM
+SUMMARIZATION_BATCH_MAX_TOKENS = int(os.getenv("SUMMARIZATION_BATCH_MAX_TOKENS", "8000"))  # Бюджет токенов на тексты в пакете
+
 # URL для API
 AITUNNEL_API_URL = os.getenv("AITUNNEL_API_URL", "https://api.aitunnel.ru/v1/chat/completions") 
 SEARCHXNG_API_URL = os.getenv("SEARCHXNG_API_URL", "https://searchxng.ai/search")
@@ -63,6 +93,13 @@ SEARCH_QUERIES_PROMPT = """
 ЗАПРОС: Mixture of Tokens in machine learning – explanation and examples
 """
 
+SEARCH_QUERIES_BATCH_PROMPT = SEARCH_QUERIES_PROMPT + """
+Тебе будет передано несколько тем, каждая помечена строкой вида ###ТЕМА N###.
+Составь запросы для каждой темы отдельно по требованиям выше.
+Перед запросами каждой темы выведи строку с ее меткой ###ТЕМА N###, а затем запросы этой темы.
+
+Обязательно составь запросы для всех тем."""
+
 SUMMARIZATION_PROMPT = """
 Роль: Ты — интеллектуальный ассистент, специализирующийся на анализе и кратком изложении текстов. Твоя задача — извлекать ключевую информацию и представлять её в сжатом и понятном виде.
 
@@ -83,6 +120,20 @@ SUMMARIZATION_PROMPT = """
 Если текст сложный или запутанный, сначала разбери его на ключевые смысловые блоки, а затем составь summary.
 """ 
 
+SUMMARIZATION_BATCH_PROMPT = SUMMARIZATION_PROMPT + """
+Тебе будет передано несколько текстов, каждый помечен идентификатором вида [[N]].
+Составь отдельное summary для каждого текста по требованиям выше, не смешивая информацию из разных текстов.
+
+Возвращай ответ только в виде JSON, без блока кода и пояснений, указывая в поле "id" число N из идентификатора текста:
+{
+    "summaries": [
+        {"id": N, "summary": "summary текста N"},
+        ... остальные тексты ...
+    ]
+}
+
+Обязательно верни summary для всех текстов."""
+
 RANKING_SUMMARY_PROMPT = """
 Ты – профессиональный эксперт по оценке качества и релевантности саммари документов.
 Твоя задача – оценить релевантность саммари относительно исходного запроса по 5 критериям:
@@ -110,6 +161,40 @@ RANKING_SUMMARY_PROMPT = """
 
 Где N - оценка от 0 до 10. Используй только числа, без объяснений."""
 
+RANKING_SUMMARY_BATCH_PROMPT = """
+Ты – профессиональный эксперт по оценке качества и релевантности саммари документов.
+Твоя задача – оценить релевантность каждого из предоставленных саммари относительно исходного запроса по 5 критериям:
+
+1. Соответствие исходному запросу (0-10): насколько саммари отвечает на поставленный вопрос
+2. Полнота информации (0-10): охватывает ли саммари ключевые аспекты темы
+3. Точность информации (0-10): содержит ли саммари корректные и актуальные данные
+4. Информативность (0-10): сколько полезной информации содержится в саммари
+5. Читабельность и структура (0-10): насколько саммари логично организовано
+
+Каждое саммари в списке помечено идентификатором вида [[N]].
+Оцени каждое саммари по указанным критериям и дай оценку по шкале от 0 до 10 для каждого критерия.
+Для каждого саммари рассчитай общий рейтинг как среднее арифметическое по всем критериям.
+
+Возвращай ответ в следующем формате, указывая в поле "id" число N из идентификатора саммари:
+```json
+{
+    "results": [
+        {
+            "id": N,
+            "соответствие_запросу": N,
+            "полнота": N,
+            "точность": N,
+            "информативность": N,
+            "структура": N,
+            "итоговый_рейтинг": N
+        },
+        ... остальные саммари ...
+    ]
+}
+```
+
+Где N - оценка от 0 до 10. Используй только числа, без объяснений. Обязательно верни оценки для всех саммари."""
+
 
 
 RANKING_SEARCH_RESULT_PROMPT = """
@@ -26,4 +26,13 @@ HTTP_UNAUTHORIZED = 401
 TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
 
 # Максимальное количество токенов для запросов
-MAX_TOKENS = 8192 
\ No newline at end of file
+MAX_TOKENS = 8192
+
+# Стоп-слова, которые не учитываются при извлечении ключевых слов (можно расширить список).
+# Неизменяемое множество создается один раз и может использоваться в любых модулях
+STOPWORDS = frozenset({
+    'и', 'в', 'на', 'с', 'по', 'для', 'от', 'к', 'за', 'из', 'под', 'над', 'о', 'об', 'при',
+    'что', 'как', 'когда', 'где', 'который', 'это', 'этот', 'эта', 'эти', 'тот', 'та', 'те',
+    'the', 'a', 'an', 'of', 'in', 'on', 'at', 'to', 'for', 'with', 'by', 'about', 'as', 'into',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did'
+})
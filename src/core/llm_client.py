@@ -0,0 +1,107 @@
+"""
+Модуль с общим HTTP-клиентом для запросов к LLM API
+"""
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.core.config import AITUNNEL_API_KEY, AITUNNEL_API_URL, AITUNNEL_MAX_CONCURRENCY
+from src.core.utils import logger
+from src.core.rate_limiter import ThreadRateLimiter
+
+# Количество повторных попыток запроса к LLM API при 429/5xx и сетевых ошибках
+# с экспоненциальной задержкой (или по заголовку Retry-After, если он есть)
+LLM_MAX_RETRIES = 5
+
+# Таймауты запросов к LLM API: (подключение, чтение) в секундах
+LLM_REQUEST_TIMEOUT = (5, 60)
+
+# Таймауты длинной генерации (итоговый ответ, саммари): ответ по полным текстам
+# документов может генерироваться несколько минут
+LLM_GENERATION_TIMEOUT = (5, 600)
+
+LLM_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {AITUNNEL_API_KEY}"
+}
+
+# Размер пула соединений: не меньше числа одновременных запросов, чтобы каждый
+# поток переиспользовал keep-alive соединение, а не открывал новое
+LLM_POOL_SIZE = max(16, AITUNNEL_MAX_CONCURRENCY)
+
+def _create_session(retry_read):
+    """
+    Создает HTTP-сессию с пулом соединений и повторными попытками для запросов к LLM API
+    
+    Args:
+        retry_read (bool): Повторять ли запрос после ошибки чтения ответа (в том числе
+            таймаута чтения). Для длинной генерации повтор означает повторную оплату
+            запроса, который сервер, возможно, еще выполняет
+    
+    Returns:
+        requests.Session: Настроенная сессия
+    """
+    session = requests.Session()
+    session.headers.update(LLM_HEADERS)
+    adapter = HTTPAdapter(
+        pool_connections=LLM_POOL_SIZE,
+        pool_maxsize=LLM_POOL_SIZE,
+        max_retries=Retry(
+            total=LLM_MAX_RETRIES,
+            read=None if retry_read else 0,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True
+        )
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Общая HTTP-сессия с пулом соединений для запросов к LLM API,
+# чтобы не устанавливать TCP/TLS соединение заново для каждого запроса
+_SESSION = _create_session(retry_read=True)
+
+# Сессия для длинной генерации: без повтора запроса после таймаута чтения
+_GENERATION_SESSION = _create_session(retry_read=False)
+
+# Общий лимитер частоты запросов к LLM API для всех потоков
+_RATE_LIMITER = ThreadRateLimiter()
+
+def post_llm(payload, headers=None, timeout=None, generation=False):
+    """
+    Отправляет запрос к LLM API с учетом общего лимита частоты запросов.
+    Повторные попытки при 429/5xx и сетевых ошибках выполняет адаптер сессии;
+    исключение выбрасывается, только если все попытки исчерпаны.
+    Функцию можно вызывать одновременно из нескольких потоков.
+    
+    Args:
+        payload (dict): Тело запроса к LLM API
+        headers (dict, optional): Заголовки, дополняющие заголовки сессии
+            (например, Authorization с другим API ключом)
+        timeout (tuple, optional): Таймауты (подключение, чтение) в секундах; по умолчанию
+            LLM_GENERATION_TIMEOUT для генерации и LLM_REQUEST_TIMEOUT для остальных запросов
+        generation (bool): Длинная генерация (итоговый ответ, саммари): увеличенный таймаут
+            чтения и без повтора запроса после таймаута чтения
+    
+    Returns:
+        str: Текст ответа LLM или None в случае ошибки
+    """
+    # Ограничиваем частоту запросов к API (общий лимит для всех потоков)
+    _RATE_LIMITER.wait("aitunnel")
+    
+    if timeout is None:
+        timeout = LLM_GENERATION_TIMEOUT if generation else LLM_REQUEST_TIMEOUT
+    session = _GENERATION_SESSION if generation else _SESSION
+    
+    response = session.post(AITUNNEL_API_URL, data=orjson.dumps(payload), headers=headers, timeout=timeout)
+    
+    if response.status_code == 200:
+        # orjson разбирает тело ответа прямо из байтов, без промежуточного декодирования в str
+        response_data = orjson.loads(response.content)
+        return response_data["choices"][0]["message"]["content"]
+    
+    logger.error(f"Ошибка при запросе к LLM API: {response.status_code}, {response.text}")
+    return None
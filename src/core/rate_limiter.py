@@ -1,18 +1,58 @@
 import time
+import threading
 from datetime import datetime, timedelta
 import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
 
-from src.core.config import AITUNNEL_RPS, JINA_RPS, SEARCHXNG_INTERVAL
+from src.core.config import (
+    AITUNNEL_RPS,
+    AITUNNEL_BURST,
+    AITUNNEL_MAX_CONCURRENCY,
+    HOST_RPS,
+    JINA_RPS,
+    JINA_MAX_CONCURRENCY,
+    SEARCHXNG_INTERVAL,
+    SEARCHXNG_MAX_CONCURRENCY
+)
 from src.core.utils import logger
 
 
+def _reserve_slot(next_request_time, key, interval, burst):
+    """
+    Резервирует время следующего запроса по алгоритму "token bucket" (GCRA):
+    в среднем не чаще одного запроса за интервал, после простоя допускается
+    пачка до burst запросов без ожидания
+    
+    Args:
+        next_request_time (dict): Теоретическое время следующего запроса по ключам
+        key (str): Ключ (сервис или хост)
+        interval (float): Интервал между запросами в секундах
+        burst (int): Емкость "ведра"
+    
+    Returns:
+        float: Сколько секунд нужно подождать перед запросом
+    """
+    current_time = time.monotonic()
+    next_time = max(current_time, next_request_time.get(key, 0))
+    
+    # Запрос разрешен, если в "ведре" есть токен: теоретическое время отстает
+    # от текущего не больше чем на (burst - 1) интервалов
+    scheduled_time = max(current_time, next_time - (burst - 1) * interval)
+    next_request_time[key] = next_time + interval
+    
+    return scheduled_time - current_time
+
+
 class RateLimiter:
     """
-    Класс для ограничения скорости запросов
+    Класс для ограничения скорости запросов из асинхронного кода.
+    Работает как "token bucket" для каждого сервиса и для каждого
+    хоста загружаемых страниц
     """
     def __init__(self):
-        # Словарь с временем последнего запроса для каждого сервиса
-        self.last_request_time = {
+        # Теоретическое время следующего запроса для каждого сервиса
+        self.next_request_time = {
             "searchxng": 0,
             "jina": 0,
             "aitunnel": 0
@@ -24,24 +64,120 @@ class RateLimiter:
             "jina": 1.0 / JINA_RPS,  # Интервал для Jina (запросов в секунду)
             "aitunnel": 1.0 / AITUNNEL_RPS  # Интервал для Aitunnel (запросов в секунду)
         }
+        
+        # Емкость "ведра": сколько запросов можно отправить подряд после простоя
+        self.bursts = {
+            "searchxng": 1,
+            "jina": 1,
+            "aitunnel": max(1, AITUNNEL_BURST)
+        }
+        
+        # Теоретическое время следующего запроса к каждому хосту загружаемых страниц,
+        # чтобы один сайт не получал все запросы подряд
+        self.host_next_request_time = {}
+        self.host_interval = 1.0 / HOST_RPS
+        
+        # Ограничение количества одновременных запросов к каждому сервису
+        self.semaphores = {
+            "searchxng": asyncio.Semaphore(SEARCHXNG_MAX_CONCURRENCY),
+            "jina": asyncio.Semaphore(JINA_MAX_CONCURRENCY),
+            "aitunnel": asyncio.Semaphore(AITUNNEL_MAX_CONCURRENCY)
+        }
     
-    async def wait(self, service):
+    @asynccontextmanager
+    async def slot(self, service, url=None):
+        """
+        Занимает место среди одновременных запросов к сервису и ожидает
+        необходимое время перед запросом. Место освобождается при выходе из блока
+        
+        Args:
+            service (str): Название сервиса ("searchxng", "jina", "aitunnel")
+            url (str): URL загружаемой страницы для ограничения запросов к ее хосту
+        """
+        semaphore = self.semaphores.get(service)
+        if semaphore is None:
+            await self.wait(service, url)
+            yield
+            return
+        
+        async with semaphore:
+            await self.wait(service, url)
+            yield
+    
+    async def wait(self, service, url=None):
         """
         Ожидает необходимое время перед следующим запросом к сервису
         
         Args:
             service (str): Название сервиса ("searchxng", "jina", "aitunnel")
+            url (str): URL загружаемой страницы для ограничения запросов к ее хосту
         """
         if service not in self.intervals:
             logger.warning(f"Неизвестный сервис: {service}, лимитирование не применяется")
             return
-            
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time[service]
-        sleep_time = max(0, self.intervals[service] - time_since_last_request)
+        
+        # Резервируем слот до ожидания: между чтением и записью нет await,
+        # поэтому параллельные корутины получают последовательные слоты
+        sleep_time = _reserve_slot(self.next_request_time, service, self.intervals[service], self.bursts[service])
+        
+        if url:
+            host = urlparse(url).netloc
+            host_sleep_time = _reserve_slot(self.host_next_request_time, host, self.host_interval, 1)
+            sleep_time = max(sleep_time, host_sleep_time)
         
         if sleep_time > 0:
             logger.debug(f"Ожидание {sleep_time:.2f} сек перед запросом к {service}")
             await asyncio.sleep(sleep_time)
-            
-        self.last_request_time[service] = time.time()
+
+
+class ThreadRateLimiter:
+    """
+    Потокобезопасный класс для ограничения скорости запросов из синхронного кода,
+    выполняемого в нескольких потоках одновременно. Работает как общий для всех
+    потоков "token bucket": в среднем не чаще одного запроса за интервал, после
+    простоя допускается пачка до burst запросов без ожидания
+    """
+    def __init__(self):
+        # Теоретическое время следующего запроса для каждого сервиса
+        # (при равномерном потоке запросов ровно с заданным интервалом)
+        self.next_request_time = {
+            "searchxng": 0,
+            "jina": 0,
+            "aitunnel": 0
+        }
+        
+        # Интервалы между запросами в секундах для разных сервисов
+        self.intervals = {
+            "searchxng": SEARCHXNG_INTERVAL,
+            "jina": 1.0 / JINA_RPS,
+            "aitunnel": 1.0 / AITUNNEL_RPS
+        }
+        
+        # Емкость "ведра": сколько запросов можно отправить подряд после простоя
+        self.bursts = {
+            "searchxng": 1,
+            "jina": 1,
+            "aitunnel": max(1, AITUNNEL_BURST)
+        }
+        
+        self.lock = threading.Lock()
+    
+    def wait(self, service):
+        """
+        Блокирует текущий поток до момента, когда разрешен следующий запрос к сервису
+        
+        Args:
+            service (str): Название сервиса ("searchxng", "jina", "aitunnel")
+        """
+        if service not in self.intervals:
+            logger.warning(f"Неизвестный сервис: {service}, лимитирование не применяется")
+            return
+        
+        # Резервируем слот под блокировкой, а ждем уже без нее,
+        # чтобы другие потоки могли занять следующие слоты
+        with self.lock:
+            sleep_time = _reserve_slot(self.next_request_time, service, self.intervals[service], self.bursts[service])
+        
+        if sleep_time > 0:
+            logger.debug(f"Ожидание {sleep_time:.2f} сек перед запросом к {service}")
+            time.sleep(sleep_time)
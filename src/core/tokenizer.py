@@ -0,0 +1,103 @@
+"""
+Модуль для подсчета токенов и усечения текста по количеству токенов
+"""
+from functools import lru_cache
+
+from src.core.utils import logger
+
+# Кодировка токенизатора. Точный токенизатор используемой через API модели недоступен,
+# cl100k_base дает близкую оценку для современных моделей
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Запасная оценка, если токенизатор недоступен: примерно 1 токен = 4 символа
+CHARS_PER_TOKEN = 4
+
+# Перед токенизацией текст обрезается до max_tokens * MAX_CHARS_PER_TOKEN символов,
+# чтобы не токенизировать целиком большие страницы, от которых останется только начало
+MAX_CHARS_PER_TOKEN = 8
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """
+    Загружает кодировку токенизатора один раз
+    
+    Returns:
+        tiktoken.Encoding: Кодировка или None, если токенизатор недоступен
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"Токенизатор недоступен, используется оценка по символам: {e}")
+        return None
+
+def count_tokens(text):
+    """
+    Подсчитывает количество токенов в тексте
+    
+    Args:
+        text (str): Исходный текст
+    
+    Returns:
+        int: Количество токенов
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _decode_head(encoding, text, tokens, max_tokens):
+    """
+    Возвращает текст, усеченный до max_tokens токенов
+    
+    Args:
+        encoding (tiktoken.Encoding): Кодировка токенизатора
+        text (str): Исходный текст
+        tokens (list): Токены текста
+        max_tokens (int): Максимальное количество токенов
+    
+    Returns:
+        str: Усеченный текст
+    """
+    if len(tokens) <= max_tokens:
+        return text
+    # Граница может прийтись на середину многобайтового символа - отбрасываем его остаток
+    return encoding.decode(tokens[:max_tokens]).rstrip("�")
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Усекает текст до заданного количества токенов
+    
+    Args:
+        text (str): Исходный текст
+        max_tokens (int): Максимальное количество токенов
+    
+    Returns:
+        str: Усеченный текст
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    
+    text = text[:max_tokens * MAX_CHARS_PER_TOKEN]
+    return _decode_head(encoding, text, encoding.encode(text, disallowed_special=()), max_tokens)
+
+def truncate_batch(texts, max_tokens):
+    """
+    Усекает список текстов до заданного количества токенов. Тексты токенизируются
+    одним пакетным вызовом в нескольких потоках.
+    
+    Args:
+        texts (list): Список исходных текстов
+        max_tokens (int): Максимальное количество токенов для каждого текста
+    
+    Returns:
+        list: Список усеченных текстов в исходном порядке
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return [text[:max_tokens * CHARS_PER_TOKEN] for text in texts]
+    
+    texts = [text[:max_tokens * MAX_CHARS_PER_TOKEN] for text in texts]
+    all_tokens = encoding.encode_batch(texts, disallowed_special=())
+    return [_decode_head(encoding, text, tokens, max_tokens) for text, tokens in zip(texts, all_tokens)]
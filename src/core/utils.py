@@ -8,6 +8,8 @@ import logging
 import hashlib
 import re
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from src.core.constants import TIMESTAMP_FORMAT
 
@@ -23,9 +25,84 @@ logging.basicConfig(
 
 logger = logging.getLogger("mind-search")
 
+# Регулярные выражения компилируются один раз при импорте модуля
+_UNSAFE_FILENAME_CHARS_RE = re.compile(r'[^\w\s-]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\w+')
+
+# Пул потоков для фоновой записи файлов: запись на диск выполняется параллельно
+# со следующими запросами к API и не блокирует основной поток
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="io")
+
+def submit_io(function, *args, **kwargs):
+    """
+    Выполняет операцию записи в фоновом потоке. Незавершенные операции
+    дожидаются завершения при выходе из программы.
+    
+    Args:
+        function (callable): Функция записи (сама обрабатывает и логирует ошибки)
+        *args: Позиционные аргументы функции
+        **kwargs: Именованные аргументы функции
+        
+    Returns:
+        concurrent.futures.Future: Объект для ожидания результата записи
+    """
+    return _IO_POOL.submit(function, *args, **kwargs)
+
+@lru_cache(maxsize=64)
+def ensure_directory(directory_path):
+    """
+    Создает директорию, если она не существует. Результат кэшируется, поэтому
+    повторные вызовы для того же пути не обращаются к файловой системе.
+    После удаления директорий кэш нужно сбросить: ensure_directory.cache_clear()
+    
+    Args:
+        directory_path (str): Путь к директории
+        
+    Returns:
+        str: Путь к директории
+    """
+    os.makedirs(directory_path, exist_ok=True)
+    return directory_path
+
+def scandir_walk(directory):
+    """
+    Обходит дерево директорий сверху вниз, как os.walk, но возвращает объекты os.DirEntry:
+    тип записи известен без отдельного вызова stat, а результат stat() кэшируется в записи.
+    Как и в os.walk, изменение списка поддиректорий на месте (dirs[:] = ...) исключает их из обхода
+    
+    Args:
+        directory (str): Корневая директория
+        
+    Yields:
+        tuple: (путь к директории, список поддиректорий os.DirEntry, список файлов os.DirEntry)
+    """
+    dirs = []
+    files = []
+    
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry)
+                else:
+                    files.append(entry)
+    except OSError as e:
+        logger.error(f"Ошибка при чтении директории {directory}: {e}")
+        return
+    
+    yield directory, dirs, files
+    
+    # Поддиректории обходятся после закрытия текущей, чтобы не держать открытыми дескрипторы всего пути
+    for entry in dirs:
+        yield from scandir_walk(entry.path)
+
+@lru_cache(maxsize=4096)
 def generate_hash(text):
     """
-    Генерирует MD5 хеш от текста для использования в именах файлов
+    Генерирует MD5 хеш от текста для использования в именах файлов.
+    Результат кэшируется: один и тот же URL хешируется при загрузке,
+    сохранении документа и саммари
     
     Args:
         text (str): Исходный текст
@@ -47,9 +124,9 @@ def sanitize_filename(text, max_length=30):
         str: Безопасное имя файла
     """
     # Заменяем небезопасные символы на подчеркивание
-    sanitized = re.sub(r'[^\w\s-]', '_', text)
+    sanitized = _UNSAFE_FILENAME_CHARS_RE.sub('_', text)
     # Заменяем пробелы на подчеркивание
-    sanitized = re.sub(r'\s+', '_', sanitized)
+    sanitized = _WHITESPACE_RE.sub('_', sanitized)
     # Обрезаем до максимальной длины
     return sanitized[:max_length]
 
@@ -144,5 +221,5 @@ def count_words(text):
     Returns:
         int: Количество слов
     """
-    words = re.findall(r'\b\w+\b', text)
+    words = _WORD_RE.findall(text)
     return len(words) 
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Модуль для кэширования ответов LLM
+"""
+import os
+import time
+import hashlib
+import threading
+
+import orjson
+
+from src.core.config import CACHE_DIR, LLM_CACHE_ENABLED, LLM_CACHE_TTL_SECONDS
+from src.core.utils import logger, create_directory
+
+class LLMCache:
+    """
+    Класс для кэширования ответов LLM на диске по точному совпадению запроса.
+    Подходит для детерминированных запросов, когда один и тот же запрос
+    к одной и той же модели должен давать один и тот же ответ.
+    """
+    def __init__(self, namespace, cache_dir=None, enabled=LLM_CACHE_ENABLED, ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        """
+        Инициализирует кэш ответов LLM
+
+        Args:
+            namespace (str): Имя поддиректории кэша (например, "llm_ranking")
+            cache_dir (str, optional): Базовая директория кэша. По умолчанию CACHE_DIR из config.py
+            enabled (bool): Включен ли кэш
+            ttl_seconds (int, optional): Время жизни записи в секундах. None - без ограничения
+        """
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, namespace)
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+
+        if self.enabled:
+            create_directory(self.cache_dir)
+
+    def make_key(self, payload):
+        """
+        Формирует ключ кэша по модели и сообщениям запроса
+
+        Args:
+            payload (dict): Тело запроса к LLM API
+
+        Returns:
+            str: SHA-256 хеш запроса
+        """
+        key_data = orjson.dumps(
+            {"model": payload.get("model"), "messages": payload.get("messages")},
+            option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha256(key_data).hexdigest()
+
+    def make_parts_key(self, *parts):
+        """
+        Формирует ключ кэша по произвольному набору строк
+        (например, модель, хеш промпта, запрос и текст документа)
+
+        Args:
+            *parts (str): Части ключа
+
+        Returns:
+            str: SHA-256 хеш частей ключа
+        """
+        key_data = "\x00".join(str(part) for part in parts)
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Возвращает закэшированный ответ LLM
+
+        Args:
+            key (str): Ключ кэша
+
+        Returns:
+            Закэшированное значение или None, если записи нет или она устарела
+        """
+        if not self.enabled:
+            return None
+
+        file_path = os.path.join(self.cache_dir, f"{key}.json")
+
+        try:
+            with open(file_path, "rb") as f:
+                entry = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша LLM {file_path}: {e}")
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry.get("created", 0) > self.ttl_seconds:
+            return None
+
+        logger.debug(f"Ответ LLM загружен из кэша: {key}")
+        return entry.get("content")
+
+    def set(self, key, value):
+        """
+        Сохраняет ответ LLM в кэш
+
+        Args:
+            key (str): Ключ кэша
+            value: Текст ответа LLM или другое JSON-сериализуемое значение
+        """
+        if not self.enabled:
+            return
+
+        file_path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            # Пишем во временный файл и атомарно заменяем, чтобы параллельные потоки не видели частичную запись
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps({"created": time.time(), "content": value}))
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении кэша LLM {file_path}: {e}")
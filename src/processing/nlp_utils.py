@@ -2,15 +2,13 @@
 Модуль для генерации ответа на основе полных текстов документов
 """
 import os
-import requests
-import json
-import time
 import markdown
 from bs4 import BeautifulSoup
 
-from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, AITUNNEL_RPS
+from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL
 from src.core.constants import ANSWER_FILE
 from src.core.utils import logger, create_directory
+from src.core.llm_client import post_llm
 
 class AnswerGenerator:
     """
@@ -105,9 +103,6 @@ class AnswerGenerator:
             
             print("Генерация итогового ответа на основе полных текстов документов...")
             
-            # Ограничиваем частоту запросов к API
-            time.sleep(1.0 / AITUNNEL_RPS)
-            
             payload = {
                 "model": AITUNNEL_MODEL,
                 "messages": [
@@ -118,13 +113,11 @@ class AnswerGenerator:
                 ]
             }
             
-            # Выполняем запрос к LLM API
-            response = requests.post(AITUNNEL_API_URL, headers=self.headers, json=payload)
+            # Выполняем запрос к LLM API через общую сессию с пулом соединений
+            # (частоту запросов ограничивает общий лимитер)
+            answer = post_llm(payload, headers=self.headers, generation=True)
             
-            if response.status_code == 200:
-                llm_response = response.json()
-                answer = llm_response["choices"][0]["message"]["content"]
-                
+            if answer is not None:
                 # Добавляем список источников, если их нет в ответе
                 if "## Использованные источники" not in answer:
                     answer += "\n\n## Использованные источники\n"
@@ -152,9 +145,7 @@ class AnswerGenerator:
                 
                 return answer
             else:
-                logger.error(f"Ошибка при обращении к API: {response.status_code}")
-                logger.error(response.text)
-                return f"Не удалось сгенерировать ответ: {response.status_code}"
+                return "Не удалось сгенерировать ответ: ошибка при обращении к API"
                 
         except Exception as e:
             logger.error(f"Ошибка при генерации ответа: {e}")
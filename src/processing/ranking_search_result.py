@@ -3,21 +3,286 @@
 """
 import json
 import os
-from collections import Counter
+import re
+import hashlib
+import heapq
+from operator import itemgetter
+from urllib.parse import urlsplit
 
-from src.core.config import RANKING_SEARCH_RESULT_PROMPT, RANKING_SEARCH_RESULT_BATCH_PROMPT
-from src.core.utils import logger
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import orjson
+
+from src.core.config import (
+    RANKING_SEARCH_RESULT_PROMPT,
+    RANKING_SEARCH_RESULT_BATCH_PROMPT,
+    RANKING_BATCH_SIZE,
+    RANKING_BATCH_MAX_TOKENS,
+    RANKING_MIN_SCORE
+)
+from src.core.utils import logger, print_progress, ensure_directory
+from src.core.llm_client import post_llm
+from src.processing.llm_cache import LLMCache
+
+# Кэш ответов LLM по точному совпадению запроса
+_LLM_CACHE = LLMCache("llm_ranking")
+
+# Имя файла с отранжированными результатами в директории темы
+RANKED_RESULTS_FILENAME = "ranked_results.json"
+
+# Максимальная длина сниппета в запросе к LLM - для оценки релевантности больше не требуется
+MAX_SNIPPET_LENGTH = 400
+
+# Регулярные выражения для извлечения JSON из ответа LLM
+_JSON_OBJECT_BLOCK_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+_JSON_BLOCK_RE = re.compile(r'```json\s*([\s\S]*?)\s*```')
+
+# Запасное регулярное выражение для оценок без блока ```json (например, JSON после пояснительного текста)
+_LOOSE_RATING_RE = re.compile(r'\{[^{}]*"итоговый_рейтинг"[^{}]*\}')
+
+# Регулярное выражение для разбиения текста на слова
+_WORD_RE = re.compile(r"\w+")
+
+def extract_json_text(llm_text, pattern):
+    """
+    Извлекает текст JSON из ответа LLM
+    
+    Args:
+        llm_text (str): Текст ответа LLM
+        pattern (re.Pattern): Регулярное выражение для блока ```json
+        
+    Returns:
+        str: Текст JSON или None, если JSON не найден
+    """
+    # Многие модели возвращают JSON без обрамления - в этом случае регулярное выражение не нужно
+    if "```json" not in llm_text:
+        stripped_text = llm_text.strip()
+        if stripped_text.startswith(("{", "[")):
+            return stripped_text
+        return None
+    
+    json_match = pattern.search(llm_text)
+    if json_match:
+        return json_match.group(1)
+    return None
+
+def extract_loose_ratings_json(llm_text, as_array=False):
+    """
+    Извлекает объекты оценок из ответа LLM без блока ```json
+    
+    Args:
+        llm_text (str): Текст ответа LLM
+        as_array (bool): Вернуть все найденные объекты в виде JSON-массива
+        
+    Returns:
+        str: Текст JSON или None, если объекты оценок не найдены
+    """
+    matches = _LOOSE_RATING_RE.findall(llm_text)
+    if not matches:
+        return None
+    if as_array:
+        return "[" + ",".join(matches) + "]"
+    return matches[0]
+
+def estimate_tokens(text):
+    """
+    Грубо оценивает количество токенов в тексте (примерно 1 токен = 4 символа)
+    
+    Args:
+        text (str): Исходный текст
+        
+    Returns:
+        int: Оценочное количество токенов
+    """
+    return len(text) // 4
+
+def normalize_url(url):
+    """
+    Нормализует URL для поиска дубликатов: без схемы, фрагмента и завершающего слеша,
+    хост в нижнем регистре
+    
+    Args:
+        url (str): Исходный URL
+        
+    Returns:
+        str: Нормализованный URL
+    """
+    if not url:
+        return url
+    
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return url.strip().rstrip("/")
+    
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    
+    normalized = host + parts.path.rstrip("/")
+    if parts.query:
+        normalized += "?" + parts.query
+    return normalized
+
+def normalize_title(title):
+    """
+    Нормализует заголовок для сопоставления с заголовками из ответа LLM
+    
+    Args:
+        title (str): Исходный заголовок
+        
+    Returns:
+        str: Заголовок без крайних пробелов в нижнем регистре
+    """
+    return title.strip().lower()
+
+def to_rating(value, default=0.0):
+    """
+    Приводит оценку к числу: LLM может вернуть рейтинг строкой ("7", "7.5")
+    или не вернуть его вовсе
+    
+    Args:
+        value: Оценка из ответа LLM
+        default (float): Значение, если оценку нельзя привести к числу
+        
+    Returns:
+        float: Числовая оценка
+    """
+    if isinstance(value, bool):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def apply_rating(result, rating_item):
+    """
+    Записывает оценку LLM прямо в результат поиска (он уже является копией)
+    
+    Args:
+        result (dict): Результат поиска
+        rating_item (dict): Оценка результата из ответа LLM
+    """
+    ratings = {
+        criterion: to_rating(rating_item.get(criterion), 5.0)
+        for criterion in (
+            "соответствие_запросу",
+            "соответствие_направлению",
+            "полнота",
+            "точность",
+            "структура",
+            "итоговый_рейтинг"
+        )
+    }
+    result["rank"] = ratings["итоговый_рейтинг"]
+    result["ratings"] = ratings
+
+def write_json_array(file, items):
+    """
+    Записывает список в файл как JSON-массив, сериализуя элементы по одному,
+    чтобы не собирать в памяти строку со всем содержимым файла
+    
+    Args:
+        file: Файл, открытый в бинарном режиме для записи
+        items (iterable): Элементы для записи (список или генератор)
+    """
+    file.write(b"[")
+    for i, item in enumerate(items):
+        if i:
+            file.write(b",")
+        file.write(b"\n")
+        file.write(orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS))
+    file.write(b"\n]")
+
+class KeywordMatcher:
+    """
+    Сопоставитель ключевых слов запроса для запасного ранжирования.
+    Строится один раз на запрос: все слова запроса объединяются в одно
+    скомпилированное регулярное выражение, поэтому заголовок и сниппет
+    просматриваются за один проход вместо отдельной проверки каждого слова.
+    """
+    def __init__(self, query):
+        """
+        Инициализирует сопоставитель
+        
+        Args:
+            query (str): Исходный запрос пользователя
+        """
+        self.query_lower = query.lower()
+        
+        # Более длинные слова ставим первыми, чтобы альтернатива не обрывалась на префиксе
+        words = sorted(set(_WORD_RE.findall(self.query_lower)), key=len, reverse=True)
+        self.pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, words)) + r")\b") if words else None
+    
+    def count(self, text_lower):
+        """
+        Считает вхождения слов запроса в текст (по целым словам)
+        
+        Args:
+            text_lower (str): Текст в нижнем регистре
+            
+        Returns:
+            int: Количество вхождений
+        """
+        if self.pattern is None:
+            return 0
+        return sum(1 for _ in self.pattern.finditer(text_lower))
+    
+    def score(self, title, snippet):
+        """
+        Вычисляет запасной рейтинг результата по вхождениям слов запроса
+        
+        Args:
+            title (str): Заголовок результата
+            snippet (str): Сниппет результата
+            
+        Returns:
+            float: Рейтинг по шкале 0-10
+        """
+        title_lower = title.lower()
+        snippet_lower = snippet.lower()
+        
+        # Базовый рейтинг - сумма вхождений в заголовок и сниппет с разными весами
+        base_score = (self.count(title_lower) * 2) + self.count(snippet_lower)
+        
+        # Дополнительные факторы ранжирования
+        additional_score = 0
+        
+        # Бонус за точное соответствие запросу в заголовке
+        if self.query_lower in title_lower:
+            additional_score += 5
+        
+        # Бонус за точное соответствие запросу в сниппете
+        if self.query_lower in snippet_lower:
+            additional_score += 3
+        
+        # Общий рейтинг, нормализуем до шкалы 0-10
+        return min(10, (base_score + additional_score) / 2)
 
 class SearchResultRanker:
     """
     Класс для ранжирования результатов поиска
     """
     def __init__(self):
-        pass
+        self.keyword_matchers = {}
+    
+    def get_keyword_matcher(self, query):
+        """
+        Возвращает сопоставитель ключевых слов для запроса, создавая его один раз
+        
+        Args:
+            query (str): Исходный запрос пользователя
+            
+        Returns:
+            KeywordMatcher: Сопоставитель ключевых слов запроса
+        """
+        matcher = self.keyword_matchers.get(query)
+        if matcher is None:
+            matcher = self.keyword_matchers.setdefault(query, KeywordMatcher(query))
+        return matcher
     
     def filter_duplicates(self, search_results):
         """
-        Фильтрует дубликаты результатов поиска по URL
+        Фильтрует дубликаты результатов поиска по нормализованному URL
         
         Args:
             search_results (dict): Словарь с результатами поиска
@@ -25,49 +290,116 @@ class SearchResultRanker:
         Returns:
             dict: Отфильтрованный словарь с результатами
         """
-        filtered_results = {}
+        filtered_results = {subtopic: [] for subtopic in search_results}
         seen_urls = set()
         
-        for subtopic, results in search_results.items():
-            filtered_subtopic_results = []
+        for subtopic, result in ((subtopic, result) for subtopic, results in search_results.items() for result in results):
+            url = normalize_url(result.get("url"))
             
-            for result in results:
-                url = result.get("url")
-                
-                # Если URL уже был обработан, пропускаем результат
-                if url in seen_urls:
-                    continue
-                    
-                seen_urls.add(url)
-                filtered_subtopic_results.append(result)
+            # Если URL уже был обработан, пропускаем результат
+            if url in seen_urls:
+                continue
             
-            filtered_results[subtopic] = filtered_subtopic_results
+            seen_urls.add(url)
+            filtered_results[subtopic].append(result)
         
         return filtered_results
     
-    def rank_by_relevance(self, search_results, original_query):
+    def flatten_results(self, search_results):
+        """
+        Формирует плоский список результатов поиска с указанием подзапроса.
+        Каждый результат копируется один раз, дальше рейтинг записывается прямо в копию.
+        
+        Args:
+            search_results (dict): Словарь с результатами поиска
+            
+        Returns:
+            list: Плоский список копий результатов с полем "subtopic"
+        """
+        flat_results = []
+        for subtopic, results in search_results.items():
+            for result in results:
+                result_copy = result.copy()
+                result_copy["subtopic"] = subtopic
+                flat_results.append(result_copy)
+        
+        return flat_results
+    
+    def group_by_content(self, flat_results):
+        """
+        Группирует результаты с одинаковыми заголовком, сниппетом и подзапросом,
+        чтобы оценивать каждый уникальный результат с помощью LLM только один раз
+        
+        Args:
+            flat_results (list): Плоский список результатов поиска
+            
+        Returns:
+            tuple: (список уникальных результатов, список пар (дубликат, уникальный результат))
+        """
+        unique = {}
+        duplicates = []
+        
+        for result in flat_results:
+            content = "\x00".join((result.get("title", ""), result.get("snippet", ""), result.get("subtopic", "")))
+            key = hashlib.sha1(content.encode("utf-8")).digest()
+            
+            representative = unique.get(key)
+            if representative is None:
+                unique[key] = result
+            else:
+                duplicates.append((result, representative))
+        
+        if duplicates:
+            logger.info(f"Найдено {len(duplicates)} результатов с одинаковым содержимым, они будут оценены один раз")
+        
+        return list(unique.values()), duplicates
+    
+    def apply_duplicate_ranks(self, duplicates):
+        """
+        Переносит рейтинг уникальных результатов на их дубликаты
+        
+        Args:
+            duplicates (list): Список пар (дубликат, уникальный результат)
+            
+        Returns:
+            list: Список дубликатов с рейтингом
+        """
+        ranked_duplicates = []
+        
+        for duplicate, representative in duplicates:
+            duplicate["rank"] = representative.get("rank", 5.0)
+            if "ratings" in representative:
+                duplicate["ratings"] = representative["ratings"]
+            ranked_duplicates.append(duplicate)
+        
+        return ranked_duplicates
+    
+    def rank_by_relevance(self, search_results, original_query, flat_results=None, min_score=RANKING_MIN_SCORE):
         """
         Ранжирует результаты поиска по релевантности к исходному запросу, используя LLM
         
         Args:
             search_results (dict): Словарь с результатами поиска
             original_query (str): Исходный запрос пользователя
+            flat_results (list, optional): Готовый плоский список результатов из flatten_results
+            min_score (float): Минимальный рейтинг результата; результаты с нулевым рейтингом отбрасываются всегда
             
         Returns:
-            list: Список отсортированных результатов с рейтингом
+            list: Список результатов с рейтингом (без сортировки)
         """
-        import requests
-        import time
-        from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, AITUNNEL_RPS
+        from src.core.config import AITUNNEL_MODEL
         
         all_results = []
-        total_results = sum(len(results) for results in search_results.values())
+        if flat_results is None:
+            flat_results = self.flatten_results(search_results)
+        total_results = len(flat_results)
         processed_results = 0
-                
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {AITUNNEL_API_KEY}"
-        }
+        
+        # Одинаковые результаты оцениваем один раз
+        unique_results, duplicates = self.group_by_content(flat_results)
+        
+        # Сопоставитель слов запроса для запасного ранжирования строим один раз
+        keyword_matcher = self.get_keyword_matcher(original_query)
         
         print(f"\nНачинаю ранжирование {total_results} результатов поиска с использованием LLM...")
         print("Оценка будет проводиться по 5 критериям от 0 до 10:")
@@ -77,167 +409,141 @@ class SearchResultRanker:
         print("4. Точность данных")
         print("5. Читабельность и структура")
         
-        # Обрабатываем результаты для каждого подзапроса
-        for subtopic, results in search_results.items():
-            logger.info(f"Ранжирование результатов для подзапроса: {subtopic}")
-            print(f"\nРанжирование результатов для подзапроса: {subtopic}")
+        # Обрабатываем каждый результат; рейтинг записывается прямо в копию результата
+        for result in unique_results:
+            title = result.get("title", "")
+            snippet = result.get("snippet", "")
+            url = result.get("url", "")
+            subtopic = result["subtopic"]
             
-            for result in results:
-                title = result.get("title", "")
-                snippet = result.get("snippet", "")
-                url = result.get("url", "")
-                
-                processed_results += 1
-                progress = (processed_results / total_results) * 100
-                print(f"[{processed_results}/{total_results}] ({progress:.1f}%) Оценка: {title[:50]}...", end="\r")
-                
-                # Формируем запрос для LLM
-                user_message = f"""
-                Исходный запрос пользователя: {original_query}
-                Подзапрос: {subtopic}
-                
-                Результат поиска:
-                Заголовок: {title}
-                Сниппет: {snippet}
-                URL: {url}
-                """
-                
-                payload = {
-                    "model": AITUNNEL_MODEL,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": RANKING_SEARCH_RESULT_PROMPT
-                        },
-                        {
-                            "role": "user",
-                            "content": user_message
-                        }
-                    ]
-                }
+            # Формируем запрос для LLM
+            user_message = (f"Исходный запрос пользователя: {original_query}\n"
+                            f"Подзапрос: {subtopic}\n\n"
+                            f"Результат поиска:\n"
+                            f"Заголовок: {title}\n"
+                            f"Сниппет: {snippet[:MAX_SNIPPET_LENGTH]}\n"
+                            f"URL: {url}\n")
+            
+            payload = {
+                "model": AITUNNEL_MODEL,
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": RANKING_SEARCH_RESULT_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": user_message
+                    }
+                ]
+            }
+            
+            try:
+                # Проверяем, есть ли ответ на такой же запрос в кэше
+                cache_key = _LLM_CACHE.make_key(payload)
+                llm_text = _LLM_CACHE.get(cache_key)
+                from_cache = llm_text is not None
                 
-                # Ограничиваем частоту запросов к API
-                time.sleep(1.0 / AITUNNEL_RPS)
+                if not from_cache:
+                    llm_text = post_llm(payload)
                 
-                try:
-                    response = requests.post(AITUNNEL_API_URL, headers=headers, json=payload)
-                    
-                    if response.status_code == 200:
-                        llm_response = response.json()
-                        llm_text = llm_response["choices"][0]["message"]["content"]
+                if llm_text is not None:
+                    try:
+                        # Извлекаем JSON из ответа
+                        ratings_json = extract_json_text(llm_text, _JSON_OBJECT_BLOCK_RE) or extract_loose_ratings_json(llm_text)
                         
-                        try:
-                            # Извлекаем JSON из ответа
-                            import json
-                            import re
+                        if ratings_json is not None:
+                            ratings = orjson.loads(ratings_json)
                             
-                            # Ищем JSON в ответе с помощью регулярного выражения
-                            json_match = re.search(r'```json\s*(\{.*?\})\s*```', llm_text, re.DOTALL)
+                            # Получаем итоговый рейтинг
+                            total_score = to_rating(ratings.get("итоговый_рейтинг"))
                             
-                            if json_match:
-                                ratings_json = json_match.group(1)
-                                ratings = json.loads(ratings_json)
-                                
-                                # Получаем итоговый рейтинг
-                                total_score = ratings.get("итоговый_рейтинг", 0)
-                                
-                                # Копируем результат и добавляем поле с рейтингом и оценками
-                                ranked_result = result.copy()
-                                ranked_result["rank"] = total_score
-                                ranked_result["ratings"] = ratings
-                                ranked_result["subtopic"] = subtopic
-                                
-                                all_results.append(ranked_result)
-                                
-                                logger.info(f"Рейтинг для {title}: {total_score}")
-                            else:
-                                logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
-                                
-                                # Если не удалось получить JSON, используем базовый рейтинг
-                                ranked_result = result.copy()
-                                ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                                ranked_result["subtopic"] = subtopic
-                                
-                                all_results.append(ranked_result)
-                        except json.JSONDecodeError as json_error:
-                            logger.error(f"Ошибка при разборе JSON из ответа LLM: {json_error}")
+                            # Добавляем поле с рейтингом и оценками
+                            result["rank"] = total_score
+                            result["ratings"] = ratings
                             
-                            # Если не удалось разобрать JSON, используем базовый рейтинг
-                            ranked_result = result.copy()
-                            ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                            ranked_result["subtopic"] = subtopic
+                            # Сохраняем успешно разобранный ответ в кэш, если он получен от LLM
+                            if not from_cache:
+                                _LLM_CACHE.set(cache_key, llm_text)
                             
-                            all_results.append(ranked_result)
-                    else:
-                        logger.error(f"Ошибка при запросе к LLM API: {response.status_code}, {response.text}")
-                        
-                        # Если запрос не удался, используем базовый рейтинг
-                        ranked_result = result.copy()
-                        ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                        ranked_result["subtopic"] = subtopic
-                        
-                        all_results.append(ranked_result)
+                            logger.info(f"Рейтинг для {title}: {total_score}")
+                        else:
+                            logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
+                            
+                            # Если не удалось получить JSON, ранжируем по ключевым словам
+                            result["rank"] = keyword_matcher.score(title, snippet)
+                    except json.JSONDecodeError as json_error:
+                        logger.error(f"Ошибка при разборе JSON из ответа LLM: {json_error}")
                         
-                except Exception as e:
-                    logger.error(f"Ошибка при ранжировании с помощью LLM: {e}")
-                    
-                    # Если возникла ошибка, используем базовый алгоритм ранжирования
-                    # Расчет рейтинга на основе текста сниппета и заголовка
-                    query_words = set(original_query.lower().split())
-                    title_lower = title.lower()
-                    snippet_lower = snippet.lower()
-                    
-                    # Считаем вхождения ключевых слов из запроса
-                    title_score = sum(1 for word in query_words if word in title_lower)
-                    snippet_score = sum(1 for word in query_words if word in snippet_lower)
-                    
-                    # Базовый рейтинг - сумма вхождений в заголовок и сниппет с разными весами
-                    base_score = (title_score * 2) + snippet_score
-                    
-                    # Дополнительные факторы ранжирования
-                    additional_score = 0
-                    
-                    # Бонус за точное соответствие запросу в заголовке
-                    if original_query.lower() in title_lower:
-                        additional_score += 5
-                    
-                    # Бонус за точное соответствие запросу в сниппете
-                    if original_query.lower() in snippet_lower:
-                        additional_score += 3
-                    
-                    # Общий рейтинг, нормализуем до шкалы 0-10
-                    total_score = min(10, (base_score + additional_score) / 2)
-                    
-                    # Копируем результат и добавляем поле с рейтингом
-                    ranked_result = result.copy()
-                    ranked_result["rank"] = total_score
-                    ranked_result["subtopic"] = subtopic
+                        # Если не удалось разобрать JSON, ранжируем по ключевым словам
+                        result["rank"] = keyword_matcher.score(title, snippet)
+                else:
+                    # Если запрос не удался (после всех повторных попыток), ранжируем по ключевым словам
+                    result["rank"] = keyword_matcher.score(title, snippet)
                     
-                    all_results.append(ranked_result)
+            except Exception as e:
+                logger.error(f"Ошибка при ранжировании с помощью LLM: {e}")
+                
+                # Если возникла ошибка, используем базовый алгоритм ранжирования
+                # Расчет рейтинга на основе текста сниппета и заголовка
+                result["rank"] = keyword_matcher.score(title, snippet)
+            
+            all_results.append(result)
+            
+            # Обновляем прогресс-бар после оценки результата
+            processed_results += 1
+            print_progress(processed_results, len(unique_results), prefix="Ранжирование:")
         
-        # Сортируем результаты по рейтингу (от большего к меньшему)
-        sorted_results = sorted(all_results, key=lambda x: x["rank"], reverse=True)
+        # Переносим рейтинг на дубликаты
+        all_results.extend(self.apply_duplicate_ranks(duplicates))
         
-        print("\n\nРанжирование результатов завершено.")
+        print("\nРанжирование результатов завершено.")
         print(f"Из {total_results} результатов поиска были оценены все.")
         
-        return sorted_results
+        return self.filter_low_scores(all_results, min_score)
+    
+    def filter_low_scores(self, ranked_results, min_score=RANKING_MIN_SCORE):
+        """
+        Отбрасывает результаты с нулевым рейтингом или рейтингом ниже порога,
+        чтобы они не участвовали в выборе топа и не сохранялись в кэш
+        
+        Args:
+            ranked_results (list): Список результатов с рейтингом
+            min_score (float): Минимальный рейтинг результата
+            
+        Returns:
+            list: Отфильтрованный список результатов; если под порог не попал ни один
+                  результат, возвращается исходный список
+        """
+        filtered_results = [
+            result for result in ranked_results
+            if to_rating(result.get("rank")) > 0 and to_rating(result.get("rank")) >= min_score
+        ]
+        
+        if not filtered_results:
+            return ranked_results
+        
+        if len(filtered_results) < len(ranked_results):
+            logger.info(f"Отброшено {len(ranked_results) - len(filtered_results)} результатов с рейтингом ниже {min_score}")
+        
+        return filtered_results
     
     def select_top_results(self, ranked_results, top_n=5):
         """
         Выбирает top_n наиболее релевантных результатов
         
         Args:
-            ranked_results (list): Список отсортированных результатов с рейтингом
+            ranked_results (list): Список результатов с рейтингом
             top_n (int): Количество результатов для выбора
             
         Returns:
-            list: Список top_n наиболее релевантных результатов
+            list: Список top_n наиболее релевантных результатов, отсортированный по рейтингу
         """
         # Выводим информацию о выбранных результатах
         print(f"\nВыбраны топ-{top_n} наиболее релевантных результатов для дальнейшей обработки:")
         
-        top_results = ranked_results[:top_n]
+        # Полная сортировка не нужна - достаточно выбрать top_n результатов через кучу
+        top_results = heapq.nlargest(top_n, ranked_results, key=itemgetter("rank"))
         
         for i, result in enumerate(top_results, 1):
             title = result.get("title", "")
@@ -248,246 +554,296 @@ class SearchResultRanker:
         
         return top_results
     
-    def rank_by_relevance_batch(self, search_results, original_query):
+    def split_into_batches(self, flat_results, max_batch_size=RANKING_BATCH_SIZE, max_batch_tokens=RANKING_BATCH_MAX_TOKENS):
         """
-        Ранжирует результаты поиска группами по 10 результатов, используя пагинацию.
-        Это значительно ускоряет процесс ранжирования и сокращает количество API запросов.
+        Разбивает результаты на пакеты с учетом бюджета токенов.
+        Пакет закрывается, когда достигнут максимальный размер или бюджет токенов,
+        поэтому при коротких сниппетах пакеты получаются крупнее.
         
         Args:
-            search_results (dict): Словарь с результатами поиска
-            original_query (str): Исходный запрос пользователя
+            flat_results (list): Плоский список результатов поиска
+            max_batch_size (int): Максимальное количество результатов в пакете
+            max_batch_tokens (int): Бюджет токенов на результаты в пакете
             
         Returns:
-            list: Список отсортированных результатов с рейтингом
+            list: Список пакетов (списков результатов)
         """
-        import requests
-        import time
-        import math
-        from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, AITUNNEL_RPS
+        batches = []
+        current_batch = []
+        current_tokens = 0
         
-        all_results = []
-        batch_size = 10  # Размер пакета для одновременной оценки
-        total_results = sum(len(results) for results in search_results.values())
-        processed_results = 0
+        for result in flat_results:
+            result_tokens = estimate_tokens(result.get("title", "")) + estimate_tokens(result.get("snippet", "")[:MAX_SNIPPET_LENGTH])
+            
+            if current_batch and (len(current_batch) >= max_batch_size or current_tokens + result_tokens > max_batch_tokens):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            
+            current_batch.append(result)
+            current_tokens += result_tokens
         
-        # Формируем плоский список всех результатов поиска
-        flat_results = []
-        for subtopic, results in search_results.items():
-            for result in results:
-                result_copy = result.copy()
-                result_copy["subtopic"] = subtopic
-                flat_results.append(result_copy)
+        if current_batch:
+            batches.append(current_batch)
         
-        # Рассчитываем количество пакетов
-        total_batches = math.ceil(len(flat_results) / batch_size)
+        return batches
+    
+    def _rank_batch(self, current_batch, batch_index, original_query, system_prompt_tokens):
+        """
+        Ранжирует один пакет результатов поиска с помощью LLM
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {AITUNNEL_API_KEY}"
-        }
+        Args:
+            current_batch (list): Список результатов пакета
+            batch_index (int): Порядковый номер пакета
+            original_query (str): Исходный запрос пользователя
+            system_prompt_tokens (int): Оценочное количество токенов системного промпта
+            
+        Returns:
+            list: Список результатов пакета с рейтингом
+        """
+        from src.core.config import AITUNNEL_MODEL
         
-        print(f"\nНачинаю ранжирование {total_results} результатов поиска с использованием LLM (пакетами по {batch_size})...")
-        print(f"Всего будет обработано {total_batches} пакетов результатов.")
-        print("Оценка будет проводиться по 5 критериям от 0 до 10:")
-        print("1. Соответствие исходному запросу")
-        print("2. Соответствие направлению поиска (подзапросу)")
-        print("3. Полнота информации")
-        print("4. Точность данных")
-        print("5. Читабельность и структура")
+        batch_results = []
         
-        # Обрабатываем результаты пакетами
-        for batch_index in range(total_batches):
-            batch_start = batch_index * batch_size
-            batch_end = min(batch_start + batch_size, len(flat_results))
-            current_batch = flat_results[batch_start:batch_end]
-            
-            print(f"\nОбработка пакета {batch_index + 1}/{total_batches} ({batch_end - batch_start} результатов)")
-            
-            # Формируем запрос для LLM
-            batch_content = ""
-            for i, result in enumerate(current_batch, 1):
-                title = result.get("title", "")
-                snippet = result.get("snippet", "")
-                url = result.get("url", "")
-                subtopic = result.get("subtopic", "")
-                
-                batch_content += f"""
-                ### Результат #{i}:
-                Подзапрос: {subtopic}
-                Заголовок: {title}
-                Сниппет: {snippet}
-                URL: {url}
-                
-                """
-            
-            user_message = f"""
-            Исходный запрос пользователя: {original_query}
-            
-            Оцени следующие результаты поиска по указанным критериям:
-            
-            {batch_content}
-            """
+        # Сопоставитель слов запроса для запасного ранжирования строится один раз на запрос
+        # и общий для всех пакетов
+        keyword_matcher = self.get_keyword_matcher(original_query)
+        
+        logger.info(f"Обработка пакета {batch_index + 1} ({len(current_batch)} результатов)")
+        
+        # Формируем запрос для LLM
+        parts = []
+        for i, result in enumerate(current_batch, 1):
+            title = result.get("title", "")
+            snippet = result.get("snippet", "")
+            url = result.get("url", "")
+            subtopic = result.get("subtopic", "")
             
-            payload = {
-                "model": AITUNNEL_MODEL,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": RANKING_SEARCH_RESULT_BATCH_PROMPT
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ]
-            }
+            parts.append(f"\n### Результат #{i}:\nПодзапрос: {subtopic}\nЗаголовок: {title}\nСниппет: {snippet[:MAX_SNIPPET_LENGTH]}\nURL: {url}\n")
+        batch_content = "".join(parts)
+        
+        user_message = (f"Исходный запрос пользователя: {original_query}\n\n"
+                        f"Оцени следующие результаты поиска по указанным критериям:\n"
+                        f"{batch_content}")
+        
+        # Доля токенов пакета в запросе: η = b / (K + b), где K - токены системного промпта
+        batch_tokens = estimate_tokens(user_message)
+        token_efficiency = batch_tokens / (system_prompt_tokens + batch_tokens)
+        logger.info(f"Пакет {batch_index + 1}: ~{batch_tokens} токенов, эффективность η = {token_efficiency:.2f}")
+        
+        payload = {
+            "model": AITUNNEL_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": RANKING_SEARCH_RESULT_BATCH_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": user_message
+                }
+            ]
+        }
+        
+        try:
+            # Проверяем, есть ли ответ на такой же запрос в кэше
+            cache_key = _LLM_CACHE.make_key(payload)
+            llm_text = _LLM_CACHE.get(cache_key)
+            from_cache = llm_text is not None
             
-            # Ограничиваем частоту запросов к API
-            time.sleep(1.0 / AITUNNEL_RPS)
+            if not from_cache:
+                llm_text = post_llm(payload)
             
-            try:
-                response = requests.post(AITUNNEL_API_URL, json=payload, headers=headers)
+            if llm_text is not None:
+                # Извлекаем JSON из ответа LLM
+                ratings_json = extract_json_text(llm_text, _JSON_BLOCK_RE) or extract_loose_ratings_json(llm_text, as_array=True)
                 
-                if response.status_code == 200:
-                    response_data = response.json()
-                    llm_text = response_data["choices"][0]["message"]["content"]
-                    
-                    # Извлекаем JSON из ответа LLM
-                    import re
-                    json_pattern = r'```json\s*([\s\S]*?)\s*```'
-                    json_match = re.search(json_pattern, llm_text)
-                    
-                    if json_match:
-                        ratings_json = json_match.group(1)
-                        try:
-                            ratings_array = json.loads(ratings_json)
+                if ratings_json is not None:
+                    try:
+                        ratings_array = orjson.loads(ratings_json)
+                        
+                        if isinstance(ratings_array, list):
+                            # Сохраняем успешно разобранный ответ в кэш, если он получен от LLM
+                            if not from_cache:
+                                _LLM_CACHE.set(cache_key, llm_text)
                             
-                            if isinstance(ratings_array, list):
-                                # Обрабатываем каждый результат из массива оценок
-                                for rating_item in ratings_array:
-                                    result_title = rating_item.get("заголовок", "")
-                                    
-                                    # Ищем результат по заголовку
-                                    matching_results = [r for r in current_batch if r.get("title", "") == result_title]
-                                    
-                                    if matching_results:
-                                        original_result = matching_results[0]
-                                        
-                                        # Копируем результат и добавляем рейтинг
-                                        ranked_result = original_result.copy()
-                                        ranked_result["rank"] = rating_item.get("итоговый_рейтинг", 5.0)
-                                        ranked_result["ratings"] = {
-                                            "соответствие_запросу": rating_item.get("соответствие_запросу", 5.0),
-                                            "соответствие_направлению": rating_item.get("соответствие_направлению", 5.0),
-                                            "полнота": rating_item.get("полнота", 5.0),
-                                            "точность": rating_item.get("точность", 5.0),
-                                            "структура": rating_item.get("структура", 5.0),
-                                            "итоговый_рейтинг": rating_item.get("итоговый_рейтинг", 5.0)
-                                        }
-                                        
-                                        all_results.append(ranked_result)
-                                        
-                                        logger.info(f"Рейтинг для {result_title}: {ranked_result['rank']}")
-                                    else:
-                                        logger.error(f"Ошибка: не найден результат с заголовком {result_title}")
+                            # Индекс результатов пакета по нормализованному заголовку. Одинаковый
+                            # заголовок может быть у нескольких результатов (одна страница из разных
+                            # подзапросов, типовые заголовки), поэтому для заголовка хранится список
+                            by_title = {}
+                            for result in current_batch:
+                                by_title.setdefault(normalize_title(result.get("title", "")), []).append(result)
+                            
+                            # Оцененные результаты (по id) и последняя оценка для каждого заголовка
+                            processed = set()
+                            rating_by_title = {}
+                            
+                            # Обрабатываем каждый результат из массива оценок
+                            for rating_item in ratings_array:
+                                result_title = rating_item.get("заголовок", "")
+                                title_key = normalize_title(result_title)
                                 
-                                # Проверяем, все ли результаты из пакета были оценены
-                                processed_titles = [r.get("заголовок", "") for r in ratings_array]
-                                for result in current_batch:
-                                    title = result.get("title", "")
-                                    if title not in processed_titles:
-                                        logger.warning(f"Результат с заголовком '{title}' не был оценен, использую значение по умолчанию")
-                                        
-                                        # Для неоцененных результатов используем средний рейтинг
-                                        ranked_result = result.copy()
-                                        ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                                        all_results.append(ranked_result)
-                            else:
-                                logger.error(f"Ошибка: ответ LLM не содержит массив оценок")
+                                # Ищем результат по заголовку: каждая оценка достается следующему
+                                # еще не оцененному результату с этим заголовком
+                                candidates = by_title.get(title_key)
+                                if candidates is None:
+                                    logger.error(f"Ошибка: не найден результат с заголовком {result_title}")
+                                    continue
+                                
+                                rating_by_title[title_key] = rating_item
+                                if not candidates:
+                                    continue
+                                
+                                original_result = candidates.pop(0)
+                                apply_rating(original_result, rating_item)
+                                processed.add(id(original_result))
+                                batch_results.append(original_result)
                                 
-                                # Применяем базовое ранжирование к текущему пакету
-                                for result in current_batch:
-                                    ranked_result = result.copy()
-                                    ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                                    all_results.append(ranked_result)
-                        except json.JSONDecodeError as json_error:
-                            logger.error(f"Ошибка при разборе JSON из ответа LLM: {json_error}")
+                                logger.info(f"Рейтинг для {result_title}: {original_result['rank']}")
+                            
+                            # Если оценок с таким заголовком меньше, чем результатов (LLM объединила
+                            # одинаковые заголовки), остальные результаты получают ту же оценку
+                            for title_key, rating_item in rating_by_title.items():
+                                for result in by_title[title_key]:
+                                    apply_rating(result, rating_item)
+                                    processed.add(id(result))
+                                    batch_results.append(result)
+                            
+                            # Проверяем, все ли результаты из пакета были оценены
+                            for result in current_batch:
+                                if id(result) not in processed:
+                                    title = result.get("title", "")
+                                    logger.warning(f"Результат с заголовком '{title}' не был оценен, использую ранжирование по ключевым словам")
+                                    
+                                    # Неоцененные результаты ранжируем по ключевым словам, а не средним рейтингом
+                                    result["rank"] = keyword_matcher.score(title, result.get("snippet", ""))
+                                    batch_results.append(result)
+                        else:
+                            logger.error(f"Ошибка: ответ LLM не содержит массив оценок")
                             
                             # Применяем базовое ранжирование к текущему пакету
                             for result in current_batch:
-                                ranked_result = result.copy()
-                                ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                                all_results.append(ranked_result)
-                    else:
-                        logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
+                                result["rank"] = keyword_matcher.score(result.get("title", ""), result.get("snippet", ""))
+                                batch_results.append(result)
+                    except json.JSONDecodeError as json_error:
+                        logger.error(f"Ошибка при разборе JSON из ответа LLM: {json_error}")
                         
                         # Применяем базовое ранжирование к текущему пакету
                         for result in current_batch:
-                            ranked_result = result.copy()
-                            ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                            all_results.append(ranked_result)
+                            result["rank"] = keyword_matcher.score(result.get("title", ""), result.get("snippet", ""))
+                            batch_results.append(result)
                 else:
-                    logger.error(f"Ошибка при запросе к LLM API: {response.status_code}, {response.text}")
+                    logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
                     
                     # Применяем базовое ранжирование к текущему пакету
                     for result in current_batch:
-                        ranked_result = result.copy()
-                        ranked_result["rank"] = 5.0  # Средний рейтинг по умолчанию
-                        all_results.append(ranked_result)
-            except Exception as e:
-                logger.error(f"Ошибка при ранжировании пакета с помощью LLM: {e}")
-                
-                # Применяем базовое ранжирование к текущему пакету в случае ошибки
+                        result["rank"] = keyword_matcher.score(result.get("title", ""), result.get("snippet", ""))
+                        batch_results.append(result)
+            else:
+                # Применяем базовое ранжирование к текущему пакету
                 for result in current_batch:
-                    # Базовое ранжирование на основе ключевых слов
-                    query_words = set(original_query.lower().split())
-                    title_lower = result.get("title", "").lower()
-                    snippet_lower = result.get("snippet", "").lower()
-                    
-                    # Считаем вхождения ключевых слов из запроса
-                    title_score = sum(1 for word in query_words if word in title_lower)
-                    snippet_score = sum(1 for word in query_words if word in snippet_lower)
-                    
-                    # Базовый рейтинг
-                    base_score = (title_score * 2) + snippet_score
-                    
-                    # Дополнительные факторы ранжирования
-                    additional_score = 0
-                    if original_query.lower() in title_lower:
-                        additional_score += 5
-                    if original_query.lower() in snippet_lower:
-                        additional_score += 3
-                    
-                    # Общий рейтинг, нормализуем до шкалы 0-10
-                    total_score = min(10, (base_score + additional_score) / 2)
-                    
-                    # Копируем результат и добавляем поле с рейтингом
-                    ranked_result = result.copy()
-                    ranked_result["rank"] = total_score
-                    
-                    all_results.append(ranked_result)
+                    result["rank"] = keyword_matcher.score(result.get("title", ""), result.get("snippet", ""))
+                    batch_results.append(result)
+        except Exception as e:
+            logger.error(f"Ошибка при ранжировании пакета с помощью LLM: {e}")
             
-            # Обновляем счетчик обработанных результатов
-            processed_results += len(current_batch)
-            progress = (processed_results / total_results) * 100
-            print(f"Обработано {processed_results}/{total_results} результатов ({progress:.1f}%)")
+            # Применяем базовое ранжирование к текущему пакету в случае ошибки
+            for result in current_batch:
+                # Базовое ранжирование на основе ключевых слов
+                result["rank"] = keyword_matcher.score(result.get("title", ""), result.get("snippet", ""))
+                batch_results.append(result)
         
-        # Сортируем результаты по рейтингу (от большего к меньшему)
-        sorted_results = sorted(all_results, key=lambda x: x["rank"], reverse=True)
+        return batch_results
+    
+    def rank_by_relevance_batch(self, search_results, original_query, flat_results=None, min_score=RANKING_MIN_SCORE):
+        """
+        Ранжирует результаты поиска пакетами (размер задается RANKING_BATCH_SIZE и RANKING_BATCH_MAX_TOKENS).
+        Это значительно ускоряет процесс ранжирования и сокращает количество API запросов.
         
-        print("\n\nРанжирование результатов завершено.")
+        Args:
+            search_results (dict): Словарь с результатами поиска
+            original_query (str): Исходный запрос пользователя
+            flat_results (list, optional): Готовый плоский список результатов из flatten_results
+            min_score (float): Минимальный рейтинг результата; результаты с нулевым рейтингом отбрасываются всегда
+            
+        Returns:
+            list: Список результатов с рейтингом (без сортировки)
+        """
+        from src.core.config import AITUNNEL_MAX_CONCURRENCY
+        
+        all_results = []
+        if flat_results is None:
+            flat_results = self.flatten_results(search_results)
+        total_results = len(flat_results)
+        processed_results = 0
+        
+        # Одинаковые результаты оцениваем один раз
+        unique_results, duplicates = self.group_by_content(flat_results)
+        
+        # Разбиваем результаты на пакеты
+        batches = self.split_into_batches(unique_results)
+        total_batches = len(batches)
+        system_prompt_tokens = estimate_tokens(RANKING_SEARCH_RESULT_BATCH_PROMPT)
+        
+        print(f"\nНачинаю ранжирование {total_results} результатов поиска с использованием LLM (пакетами до {RANKING_BATCH_SIZE})...")
+        print(f"Всего будет обработано {total_batches} пакетов результатов.")
+        print("Оценка будет проводиться по 5 критериям от 0 до 10:")
+        print("1. Соответствие исходному запросу")
+        print("2. Соответствие направлению поиска (подзапросу)")
+        print("3. Полнота информации")
+        print("4. Точность данных")
+        print("5. Читабельность и структура")
+        
+        # Отправляем пакеты в LLM параллельно; частоту запросов ограничивает общий лимитер
+        max_workers = max(1, min(AITUNNEL_MAX_CONCURRENCY, total_batches))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._rank_batch, current_batch, batch_index, original_query, system_prompt_tokens)
+                for batch_index, current_batch in enumerate(batches)
+            ]
+            
+            for future in as_completed(futures):
+                batch_results = future.result()
+                all_results.extend(batch_results)
+                
+                # Обновляем прогресс-бар после завершения пакета
+                processed_results += len(batch_results)
+                print_progress(processed_results, len(unique_results), prefix="Ранжирование:")
+        
+        # Переносим рейтинг на дубликаты
+        all_results.extend(self.apply_duplicate_ranks(duplicates))
+        
+        print("\nРанжирование результатов завершено.")
         print(f"Из {total_results} результатов поиска были оценены все.")
         
-        return sorted_results
+        return self.filter_low_scores(all_results, min_score)
+    
+    def get_ranking_signature(self, flat_results, original_query):
+        """
+        Вычисляет сигнатуру набора результатов поиска для кэширования ранжирования
+        
+        Args:
+            flat_results (list): Плоский список результатов поиска
+            original_query (str): Исходный запрос пользователя
+            
+        Returns:
+            str: SHA-256 хеш запроса и отсортированного списка URL
+        """
+        urls = sorted(result.get("url", "") for result in flat_results)
+        return hashlib.sha256(orjson.dumps({"q": original_query, "urls": urls})).hexdigest()
     
-    def process_search_results(self, search_results, original_query, top_n=25):
+    def process_search_results(self, search_results, original_query, top_n=25, theme_name=None, cache_dir="cache"):
         """
-        Обрабатывает результаты поиска: фильтрует дубликаты, ранжирует и выбирает топ
+        Обрабатывает результаты поиска: фильтрует дубликаты, ранжирует и выбирает топ.
+        Если указано имя темы и для того же набора результатов уже есть сохраненное
+        ранжирование, оно загружается из кэша без обращения к LLM.
         
         Args:
             search_results (dict): Словарь с результатами поиска
             original_query (str): Исходный запрос пользователя
             top_n (int): Количество результатов для выбора
+            theme_name (str, optional): Название темы для кэширования ранжирования
+            cache_dir (str): Директория кэша
             
         Returns:
             list: Список top_n наиболее релевантных результатов
@@ -495,16 +851,45 @@ class SearchResultRanker:
         # Фильтруем дубликаты
         filtered_results = self.filter_duplicates(search_results)
         
+        # Плоский список результатов строим один раз и передаем в методы ранжирования
+        flat_results = self.flatten_results(filtered_results)
+        total_results = len(flat_results)
+        
+        # Проверяем, было ли уже ранжирование для такого же набора результатов
+        cached_ranking_path = None
+        if theme_name:
+            signature = self.get_ranking_signature(flat_results, original_query)
+            cached_ranking_path = os.path.join(cache_dir, theme_name, f"ranked_{signature}.json")
+            
+            if os.path.exists(cached_ranking_path):
+                try:
+                    with open(cached_ranking_path, "rb") as file:
+                        ranked_results = orjson.loads(file.read())
+                    
+                    print("Найдено сохраненное ранжирование для этих результатов, повторная оценка не требуется")
+                    logger.info(f"Ранжирование загружено из кэша: {cached_ranking_path}")
+                    return self.select_top_results(ranked_results, top_n)
+                except Exception as e:
+                    logger.error(f"Ошибка при загрузке сохраненного ранжирования: {e}")
+        
         # Определяем, какой метод ранжирования использовать
-        total_results = sum(len(results) for results in filtered_results.values())
         if total_results > 10:
             # Используем пакетное ранжирование для большого количества результатов
             print(f"Обнаружено {total_results} результатов, использую пакетное ранжирование")
-            ranked_results = self.rank_by_relevance_batch(filtered_results, original_query)
+            ranked_results = self.rank_by_relevance_batch(filtered_results, original_query, flat_results)
         else:
             # Используем обычное ранжирование для небольшого количества результатов
             print(f"Обнаружено {total_results} результатов, использую стандартное ранжирование")
-            ranked_results = self.rank_by_relevance(filtered_results, original_query)
+            ranked_results = self.rank_by_relevance(filtered_results, original_query, flat_results)
+        
+        # Сохраняем полное ранжирование для повторных запусков
+        if cached_ranking_path:
+            try:
+                ensure_directory(os.path.dirname(cached_ranking_path))
+                with open(cached_ranking_path, "wb") as file:
+                    write_json_array(file, ranked_results)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении ранжирования в кэш: {e}")
         
         # Выбираем топ N результатов
         top_results = self.select_top_results(ranked_results, top_n)
@@ -525,15 +910,14 @@ class SearchResultRanker:
         """
         try:
             # Создаем директорию для результатов поиска
-            ranked_results_dir = os.path.join(cache_dir, theme_name)
-            os.makedirs(ranked_results_dir, exist_ok=True)
+            ranked_results_dir = ensure_directory(os.path.join(cache_dir, theme_name))
             
             # Формируем имя файла
-            file_path = os.path.join(ranked_results_dir, f"ranked_results.json")
+            file_path = os.path.join(ranked_results_dir, RANKED_RESULTS_FILENAME)
             
-            # Сохраняем данные в JSON формате с красивым форматированием
-            with open(file_path, "w", encoding="utf-8") as file:
-                json.dump(ranked_results, file, ensure_ascii=False, indent=4)
+            # Сохраняем данные в JSON формате потоково, по одному результату
+            with open(file_path, "wb") as file:
+                write_json_array(file, ranked_results)
             
             logger.info(f"Отранжированные результаты сохранены в {file_path}")
             return file_path
@@ -4,10 +4,69 @@
 import os
 import json
 import re
-from collections import Counter
+import hashlib
+import heapq
+from collections import Counter, defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from src.core.utils import logger
-from src.core.config import RANKING_SUMMARY_PROMPT
+import orjson
+
+from src.core.utils import logger, print_progress, ensure_directory, submit_io
+from src.core.constants import STOPWORDS
+from src.core.config import RANKING_SUMMARY_BATCH_PROMPT, RANKING_SUMMARY_BATCH_SIZE
+from src.core.llm_client import post_llm
+from src.core.tokenizer import truncate_batch
+from src.processing.ranking_search_result import extract_json_text, extract_loose_ratings_json, write_json_array
+from src.processing.llm_cache import LLMCache
+
+# Имя файла с отранжированными саммари в директории темы
+RANKED_SUMMARIES_FILENAME = "ranked_summaries.json"
+
+# Максимальная длина саммари в запросе к LLM в токенах
+MAX_SUMMARY_TOKENS = 1000
+
+# Кэш оценок саммари по запросу и тексту саммари
+_RATINGS_CACHE = LLMCache("llm_summary_ranking")
+
+# Хеш промпта входит в ключ кэша, чтобы после правки промпта не использовать старые оценки
+_PROMPT_HASH = hashlib.sha256(RANKING_SUMMARY_BATCH_PROMPT.encode("utf-8")).hexdigest()
+
+# Регулярное выражение для извлечения JSON из ответа LLM
+_JSON_BLOCK_RE = re.compile(r'```json\s*([\s\S]*?)\s*```')
+
+# Регулярное выражение для разбиения текста на слова (специальные символы служат разделителями)
+_WORD_RE = re.compile(r'\w+')
+
+@lru_cache(maxsize=4096)
+def _extract_keywords_cached(text):
+    """
+    Извлекает ключевые слова из текста с кэшированием результата по тексту
+    
+    Args:
+        text (str): Исходный текст
+        
+    Returns:
+        tuple: Кортеж ключевых слов
+    """
+    # Разбиваем текст в нижнем регистре на слова за один проход и фильтруем стоп-слова
+    return tuple(word for word in _WORD_RE.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS)
+
+@lru_cache(maxsize=1024)
+def _keyword_profile(text):
+    """
+    Строит индекс ключевых слов текста: частоты слов и множество пар соседних слов.
+    Индекс строится один раз на текст и переиспользуется для любых запросов.
+    
+    Args:
+        text (str): Исходный текст
+        
+    Returns:
+        tuple: (Counter частот ключевых слов, количество ключевых слов, frozenset пар соседних слов)
+    """
+    keywords = _extract_keywords_cached(text)
+    return Counter(keywords), len(keywords), frozenset(zip(keywords, keywords[1:]))
 
 class SummaryRanker:
     """
@@ -24,196 +83,274 @@ class SummaryRanker:
             text (str): Исходный текст
             
         Returns:
-            list: Список ключевых слов
+            tuple: Кортеж ключевых слов (результат кэшируется для повторяющихся текстов)
+        """
+        return _extract_keywords_cached(text)
+    
+    def keyword_score(self, summary_text, query_keyword_set, query_bigrams):
+        """
+        Вычисляет запасной рейтинг саммари на основе ключевых слов запроса
+        
+        Args:
+            summary_text (str): Текст саммари
+            query_keyword_set (frozenset): Множество ключевых слов запроса
+            query_bigrams (frozenset): Пары соседних ключевых слов запроса
+            
+        Returns:
+            float: Рейтинг по шкале 0-10
         """
-        # Удаляем специальные символы и приводим к нижнему регистру
-        text = re.sub(r'[^\w\s]', ' ', text.lower())
+        # Индекс ключевых слов саммари строится один раз и переиспользуется между запросами
+        keyword_counts, keyword_total, summary_bigrams = _keyword_profile(summary_text)
         
-        # Разбиваем на слова
-        words = text.split()
+        # Подсчитываем вхождения ключевых слов из запроса в саммари: пересечение множеств
+        # выполняется на уровне C, частоты берутся только для совпавших слов
+        keyword_count = sum(keyword_counts[word] for word in keyword_counts.keys() & query_keyword_set)
         
-        # Фильтруем стоп-слова (можно расширить список)
-        stop_words = {'и', 'в', 'на', 'с', 'по', 'для', 'от', 'к', 'за', 'из', 'под', 'над', 'о', 'об', 'при', 
-                     'что', 'как', 'когда', 'где', 'который', 'это', 'этот', 'эта', 'эти', 'тот', 'та', 'те',
-                     'the', 'a', 'an', 'of', 'in', 'on', 'at', 'to', 'for', 'with', 'by', 'about', 'as', 'into',
-                     'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did'}
+        # Нормализуем на длину текста для предотвращения перекоса в сторону длинных текстов
+        normalized_score = keyword_count / (keyword_total + 1) * 100
         
-        filtered_words = [word for word in words if word not in stop_words and len(word) > 2]
+        # Добавляем бонус за точные фразы (пары соседних слов) из запроса: пересечение множеств пар
+        exact_phrase_bonus = 5 * len(query_bigrams & summary_bigrams)
         
-        return filtered_words
+        # Итоговый рейтинг, нормализуем до шкалы 0-10
+        return min(10, (normalized_score + exact_phrase_bonus) / 20)
     
-    def rank_by_keywords(self, summaries, original_query):
+    def get_ratings_cache_key(self, original_query, summary_head):
         """
-        Ранжирует саммари по релевантности к исходному запросу с использованием LLM
+        Формирует ключ кэша оценки саммари
         
         Args:
-            summaries (list): Список саммари
             original_query (str): Исходный запрос пользователя
+            summary_head (str): Усеченный текст саммари, который отправляется в LLM
             
         Returns:
-            list: Список отсортированных саммари с рейтингом
+            str: Ключ кэша по модели, промпту, запросу и тексту саммари
         """
-        import requests
-        import time
-        from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, AITUNNEL_RPS
+        from src.core.config import AITUNNEL_MODEL
         
-        ranked_summaries = []
-        total_summaries = len(summaries)
-        processed_summaries = 0
+        return _RATINGS_CACHE.make_parts_key(AITUNNEL_MODEL, _PROMPT_HASH, original_query, summary_head)
+    
+    def _rank_batch(self, batch, original_query, query_keyword_set, query_bigrams):
+        """
+        Ранжирует пакет саммари одним запросом к LLM (выполняется в пуле потоков).
+        Саммари, для которых LLM не вернула оценку, ранжируются по ключевым словам.
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {AITUNNEL_API_KEY}"
+        Args:
+            batch (list): Список кортежей (документ с саммари, усеченный текст саммари, ключ кэша)
+            original_query (str): Исходный запрос пользователя
+            query_keyword_set (frozenset): Множество ключевых слов запроса
+            query_bigrams (frozenset): Пары соседних ключевых слов запроса
+            
+        Returns:
+            list: Документы пакета с рейтингом (рейтинг записывается прямо в документы)
+        """
+        from src.core.config import AITUNNEL_MODEL
+        
+        # Формируем запрос для LLM: каждое саммари помечается идентификатором [[N]]
+        parts = []
+        for doc_id, (summary_doc, summary_head, _) in enumerate(batch, 1):
+            parts.append(f"\n[[{doc_id}]]\nЗаголовок: {summary_doc.get('title', '')}\nURL: {summary_doc.get('url', '')}\nТекст саммари:\n{summary_head}\n")
+        
+        user_message = (f"Исходный запрос пользователя: {original_query}\n\n"
+                        f"Оцени следующие саммари документов по указанным критериям:\n"
+                        f"{''.join(parts)}")
+        
+        payload = {
+            "model": AITUNNEL_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": RANKING_SUMMARY_BATCH_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": user_message
+                }
+            ]
         }
         
-        logger.info(f"Ранжирование {total_summaries} саммари для запроса: {original_query}")
-        print(f"Ранжирование {total_summaries} саммари...")
+        # Оценки LLM по идентификатору саммари в пакете
+        ratings_by_id = {}
         
-        for summary_doc in summaries:
-            summary_text = summary_doc.get("summary", "")
-            title = summary_doc.get("title", "")
-            url = summary_doc.get("url", "")
-            
-            processed_summaries += 1
-            progress = (processed_summaries / total_summaries) * 100
-            print(f"[{processed_summaries}/{total_summaries}] ({progress:.1f}%) Оценка: {title[:50]}...", end="\r")
-            
-            # Если саммари нет, пропускаем документ
-            if not summary_text:
-                continue
-            
-            # Ограничиваем длину саммари для запроса (примерно 1 токен = 4 символа)
-            truncated_summary = summary_text[:4000]
-            
-            # Формируем запрос для LLM
-            user_message = f"""
-            Исходный запрос пользователя: {original_query}
-            
-            Саммари документа:
-            Заголовок: {title}
-            URL: {url}
-            
-            Текст саммари:
-            {truncated_summary}
-            """
-            
-            payload = {
-                "model": AITUNNEL_MODEL,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": RANKING_SUMMARY_PROMPT
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ]
-            }
-            
-            # Ограничиваем частоту запросов к API
-            time.sleep(1.0 / AITUNNEL_RPS)
+        try:
+            llm_text = post_llm(payload)
             
-            try:
-                response = requests.post(AITUNNEL_API_URL, headers=headers, json=payload)
+            if llm_text is not None:
+                ratings_json = extract_json_text(llm_text, _JSON_BLOCK_RE) or extract_loose_ratings_json(llm_text, as_array=True)
                 
-                if response.status_code == 200:
-                    llm_response = response.json()
-                    llm_text = llm_response["choices"][0]["message"]["content"]
-                    
+                if ratings_json is not None:
                     try:
-                        # Извлекаем JSON из ответа
-                        import json
-                        import re
+                        ratings_data = orjson.loads(ratings_json)
                         
-                        # Ищем JSON в ответе с помощью регулярного выражения
-                        json_match = re.search(r'```json\s*(\{.*?\})\s*```', llm_text, re.DOTALL)
+                        # Модель может вернуть как объект с полем "results", так и просто массив
+                        if isinstance(ratings_data, dict):
+                            ratings_data = ratings_data.get("results", [])
                         
-                        if json_match:
-                            ratings_json = json_match.group(1)
-                            ratings = json.loads(ratings_json)
-                            
-                            # Получаем итоговый рейтинг
-                            total_score = ratings.get("итоговый_рейтинг", 0)
-                            
-                            # Копируем документ с саммари и добавляем поле с рейтингом и оценками
-                            ranked_summary = summary_doc.copy()
-                            ranked_summary["rank"] = total_score
-                            ranked_summary["ratings"] = ratings
-                            
-                            ranked_summaries.append(ranked_summary)
-                            
-                            logger.info(f"Рейтинг для саммари '{title}': {total_score}")
-                        else:
-                            logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
-                            
-                            # Если не удалось получить JSON, используем базовый рейтинг
-                            ranked_summary = summary_doc.copy()
-                            ranked_summary["rank"] = 5.0  # Средний рейтинг по умолчанию
-                            
-                            ranked_summaries.append(ranked_summary)
+                        for rating_item in ratings_data:
+                            try:
+                                doc_id = int(rating_item.pop("id"))
+                            except (KeyError, TypeError, ValueError, AttributeError):
+                                continue
+                            ratings_by_id[doc_id] = rating_item
                     except json.JSONDecodeError as json_error:
                         logger.error(f"Ошибка при разборе JSON из ответа LLM: {json_error}")
-                        
-                        # Если не удалось разобрать JSON, используем базовый рейтинг
-                        ranked_summary = summary_doc.copy()
-                        ranked_summary["rank"] = 5.0  # Средний рейтинг по умолчанию
-                        
-                        ranked_summaries.append(ranked_summary)
                 else:
-                    logger.error(f"Ошибка при запросе к LLM API: {response.status_code}, {response.text}")
-                    
-                    # Если запрос не удался, используем базовый рейтинг
-                    ranked_summary = summary_doc.copy()
-                    ranked_summary["rank"] = 5.0  # Средний рейтинг по умолчанию
-                    
-                    ranked_summaries.append(ranked_summary)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при ранжировании саммари с помощью LLM: {e}")
-                
-                # Если возникла ошибка, используем базовый алгоритм ранжирования на основе ключевых слов
-                # Извлекаем ключевые слова из запроса
-                query_keywords = self.extract_keywords(original_query)
-                
-                # Извлекаем ключевые слова из саммари
-                summary_keywords = self.extract_keywords(summary_text)
-                
-                # Подсчитываем вхождения ключевых слов из запроса в саммари
-                keyword_count = sum(1 for word in summary_keywords if word in query_keywords)
-                
-                # Нормализуем на длину текста для предотвращения перекоса в сторону длинных текстов
-                normalized_score = keyword_count / (len(summary_keywords) + 1) * 100
-                
-                # Добавляем бонус за точные фразы из запроса
-                exact_phrase_bonus = 0
-                for i in range(len(query_keywords) - 1):
-                    phrase = f"{query_keywords[i]} {query_keywords[i+1]}"
-                    if phrase in " ".join(summary_keywords):
-                        exact_phrase_bonus += 5
+                    logger.error(f"Не удалось извлечь JSON из ответа LLM: {llm_text}")
+        except Exception as e:
+            logger.error(f"Ошибка при ранжировании саммари с помощью LLM: {e}")
+        
+        ranked_batch = []
+        
+        for doc_id, (summary_doc, _, cache_key) in enumerate(batch, 1):
+            ratings = ratings_by_id.get(doc_id)
+            
+            if ratings is not None:
+                # Добавляем поле с рейтингом и оценками
+                summary_doc["rank"] = ratings.get("итоговый_рейтинг", 0)
+                summary_doc["ratings"] = ratings
                 
-                # Итоговый рейтинг, нормализуем до шкалы 0-10
-                total_score = min(10, (normalized_score + exact_phrase_bonus) / 20)
+                # Сохраняем оценку в кэш для повторных запусков
+                _RATINGS_CACHE.set(cache_key, ratings)
                 
-                # Создаем копию документа с рейтингом
-                ranked_summary = summary_doc.copy()
-                ranked_summary["rank"] = total_score
+                logger.info(f"Рейтинг для саммари '{summary_doc.get('title', '')}': {summary_doc['rank']}")
+            else:
+                # Если LLM не вернула оценку, используем базовый алгоритм ранжирования на основе ключевых слов
+                logger.warning(f"Саммари '{summary_doc.get('title', '')}' не было оценено LLM, использую ранжирование по ключевым словам")
+                summary_doc["rank"] = self.keyword_score(summary_doc["summary"], query_keyword_set, query_bigrams)
+            
+            ranked_batch.append(summary_doc)
+        
+        return ranked_batch
+    
+    def rank_by_keywords(self, summaries, original_query):
+        """
+        Ранжирует саммари по релевантности к исходному запросу с использованием LLM.
+        Саммари отправляются пакетами (размер задается RANKING_SUMMARY_BATCH_SIZE),
+        пакеты обрабатываются параллельно в пуле потоков, частоту запросов
+        ограничивает общий лимитер. Поля "rank" и "ratings" записываются прямо
+        в переданные документы, без копирования.
+        
+        Args:
+            summaries (list): Список саммари
+            original_query (str): Исходный запрос пользователя
+            
+        Returns:
+            list: Список саммари с рейтингом (без сортировки)
+        """
+        from src.core.config import AITUNNEL_MAX_CONCURRENCY
+        
+        ranked_summaries = []
+        
+        # Документы без саммари не ранжируются
+        summaries = [summary_doc for summary_doc in summaries if summary_doc.get("summary")]
+        total_summaries = len(summaries)
+        
+        # Ключевые слова запроса для запасного ранжирования извлекаем один раз
+        query_keywords = self.extract_keywords(original_query)
+        query_keyword_set = frozenset(query_keywords)
+        query_bigrams = frozenset(zip(query_keywords, query_keywords[1:]))
+        
+        logger.info(f"Ранжирование {total_summaries} саммари для запроса: {original_query}")
+        print(f"Ранжирование {total_summaries} саммари...")
+        
+        if not summaries:
+            return ranked_summaries
+        
+        # Группируем саммари с одинаковым текстом (например, с зеркал одной страницы),
+        # чтобы оценивать каждый уникальный текст только один раз
+        summary_groups = defaultdict(list)
+        summary_heads = {}
+        
+        # Усекаем саммари по токенам один раз и одним пакетным вызовом токенизатора:
+        # тот же текст идет и в ключ кэша, и в запрос к LLM
+        all_summary_heads = truncate_batch([summary_doc["summary"] for summary_doc in summaries], MAX_SUMMARY_TOKENS)
+        
+        for summary_doc, summary_head in zip(summaries, all_summary_heads):
+            digest = hashlib.blake2b(summary_head.encode("utf-8")).digest()
+            summary_groups[digest].append(summary_doc)
+            summary_heads[digest] = summary_head
+        
+        total_unique = len(summary_groups)
+        if total_unique < total_summaries:
+            logger.info(f"Найдено {total_summaries - total_unique} саммари с повторяющимся текстом, они получат оценку оригинала")
+        
+        # Саммари с сохраненной оценкой не отправляем в LLM повторно
+        uncached_summaries = []
+        for digest, group in summary_groups.items():
+            summary_doc = group[0]
+            summary_head = summary_heads[digest]
+            cache_key = self.get_ratings_cache_key(original_query, summary_head)
+            ratings = _RATINGS_CACHE.get(cache_key)
+            
+            if ratings is not None:
+                summary_doc["rank"] = ratings.get("итоговый_рейтинг", 0)
+                summary_doc["ratings"] = ratings
+                ranked_summaries.append(summary_doc)
+            else:
+                uncached_summaries.append((summary_doc, summary_head, cache_key))
+        
+        processed_summaries = len(ranked_summaries)
+        if processed_summaries:
+            logger.info(f"Оценки {processed_summaries} саммари загружены из кэша")
+            print_progress(processed_summaries, total_unique, prefix="Ранжирование саммари:")
+        
+        # Разбиваем саммари на пакеты
+        batch_size = max(1, RANKING_SUMMARY_BATCH_SIZE)
+        batches = [uncached_summaries[i:i + batch_size] for i in range(0, len(uncached_summaries), batch_size)]
+        
+        max_workers = max(1, min(AITUNNEL_MAX_CONCURRENCY, len(batches)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._rank_batch, batch, original_query, query_keyword_set, query_bigrams)
+                for batch in batches
+            ]
+            
+            for future in as_completed(futures):
+                ranked_batch = future.result()
+                ranked_summaries.extend(ranked_batch)
                 
-                ranked_summaries.append(ranked_summary)
+                # Обновляем прогресс-бар после оценки пакета
+                processed_summaries += len(ranked_batch)
+                print_progress(processed_summaries, total_unique, prefix="Ранжирование саммари:")
         
-        # Сортируем саммари по рейтингу (от большего к меньшему)
-        sorted_summaries = sorted(ranked_summaries, key=lambda x: x["rank"], reverse=True)
+        # Переносим оценку оригинала на саммари с тем же текстом
+        for group in summary_groups.values():
+            original_doc = group[0]
+            for duplicate_doc in group[1:]:
+                duplicate_doc["rank"] = original_doc["rank"]
+                if "ratings" in original_doc:
+                    duplicate_doc["ratings"] = original_doc["ratings"]
+                ranked_summaries.append(duplicate_doc)
+        
+        print("\nРанжирование саммари завершено.")
+        
+        return ranked_summaries
+    
+    def rank_by_keywords_sorted(self, summaries, original_query):
+        """
+        Ранжирует саммари и возвращает полный список, отсортированный по рейтингу.
+        Используется там, где нужен весь упорядоченный список, а не только топ.
+        
+        Args:
+            summaries (list): Список саммари
+            original_query (str): Исходный запрос пользователя
+            
+        Returns:
+            list: Список отсортированных саммари с рейтингом
+        """
+        ranked_summaries = self.rank_by_keywords(summaries, original_query)
         
-        print("\n\nРанжирование саммари завершено.")
+        # Сортируем саммари по рейтингу (от большего к меньшему)
+        ranked_summaries.sort(key=itemgetter("rank"), reverse=True)
         
-        return sorted_summaries
+        return ranked_summaries
     
     def select_top_summaries(self, ranked_summaries, top_n=5):
         """
         Выбирает top_n наиболее релевантных саммари
         
         Args:
-            ranked_summaries (list): Список отсортированных саммари с рейтингом
+            ranked_summaries (list): Список саммари с рейтингом
             top_n (int): Количество саммари для выбора
             
         Returns:
@@ -222,7 +359,8 @@ class SummaryRanker:
         # Выводим информацию о выбранных саммари
         print(f"\nВыбраны топ-{top_n} наиболее релевантных саммари для генерации ответа:")
         
-        top_summaries = ranked_summaries[:top_n]
+        # Полная сортировка не нужна - достаточно выбрать top_n саммари через кучу
+        top_summaries = heapq.nlargest(top_n, ranked_summaries, key=itemgetter("rank"))
         
         for i, summary in enumerate(top_summaries, 1):
             title = summary.get("title", "")
@@ -247,7 +385,7 @@ class SummaryRanker:
         # Фильтруем документы без саммари
         valid_summaries = [doc for doc in documents_with_summaries if "summary" in doc and doc["summary"]]
         
-        # Ранжируем саммари
+        # Ранжируем саммари без полной сортировки - топ N выбирается через кучу
         ranked_summaries = self.rank_by_keywords(valid_summaries, original_query)
         
         # Выбираем топ N саммари
@@ -275,17 +413,39 @@ class SummaryRanker:
             print("Нет действительных саммари для ранжирования.")
             return []
         
-        # Ранжируем саммари
-        ranked_summaries = self.rank_by_keywords(valid_summaries, original_query)
+        # Ранжируем саммари (возвращаемый и сохраняемый список должен быть упорядочен)
+        ranked_summaries = self.rank_by_keywords_sorted(valid_summaries, original_query)
         
         # Выбираем топ N саммари
         top_summaries = self.select_top_summaries(ranked_summaries, top_n)
         
-        # Сохраняем отранжированные саммари
-        self.save_ranked_summaries_to_json(ranked_summaries, theme_name)
+        # Сохраняем отранжированные саммари в фоновом потоке, пока генерируется итоговый ответ
+        # (передаем копию списка, чтобы запись не зависела от дальнейших изменений)
+        submit_io(self.save_ranked_summaries_to_json, list(ranked_summaries), theme_name)
         
         return ranked_summaries
     
+    def make_summary_preview(self, summary):
+        """
+        Создает копию саммари для сохранения в JSON без больших полей
+        
+        Args:
+            summary (dict): Документ с саммари
+            
+        Returns:
+            dict: Копия документа, в которой поля summary и content заменены превью
+        """
+        serializable_summary = {}
+        for key, value in summary.items():
+            # Ограничиваем размер полей summary и content для сохранения в JSON
+            if key == "summary" or key == "content":
+                # Сохраняем только первые 500 символов
+                serializable_summary[f"{key}_preview"] = value[:500] if value else ""
+            else:
+                serializable_summary[key] = value
+        
+        return serializable_summary
+    
     def save_ranked_summaries_to_json(self, ranked_summaries, theme_name, cache_dir="cache"):
         """
         Сохраняет отранжированные саммари в JSON файл
@@ -300,31 +460,15 @@ class SummaryRanker:
         """
         try:
             # Создаем директорию для результатов ранжирования
-            ranked_summaries_dir = os.path.join(cache_dir, theme_name)
-            os.makedirs(ranked_summaries_dir, exist_ok=True)
+            ranked_summaries_dir = ensure_directory(os.path.join(cache_dir, theme_name))
             
             # Формируем имя файла
-            file_path = os.path.join(ranked_summaries_dir, f"ranked_summaries.json")
-            
-            # Подготавливаем данные для сохранения
-            serializable_summaries = []
-            
-            for summary in ranked_summaries:
-                # Создаем копию саммари без больших полей
-                serializable_summary = {}
-                for key, value in summary.items():
-                    # Ограничиваем размер полей summary и content для сохранения в JSON
-                    if key == "summary" or key == "content":
-                        # Сохраняем только первые 500 символов
-                        serializable_summary[f"{key}_preview"] = value[:500] if value else ""
-                    else:
-                        serializable_summary[key] = value
-                
-                serializable_summaries.append(serializable_summary)
+            file_path = os.path.join(ranked_summaries_dir, RANKED_SUMMARIES_FILENAME)
             
-            # Сохраняем данные в JSON формате
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(serializable_summaries, f, ensure_ascii=False, indent=4)
+            # Сохраняем данные в JSON формате: саммари сериализуются по одному,
+            # без промежуточного списка копий и без строки со всем содержимым файла
+            with open(file_path, "wb") as f:
+                write_json_array(f, (self.make_summary_preview(summary) for summary in ranked_summaries))
             
             logger.info(f"Отранжированные саммари сохранены в файл: {file_path}")
             return file_path
@@ -2,14 +2,41 @@
 Модуль для саммаризации документов
 """
 import os
-import requests
 import json
+import hashlib
 from bs4 import BeautifulSoup
+import orjson
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, AITUNNEL_RPS, SUMMARIZATION_PROMPT, SUMMARIES_DIR
-from src.core.utils import logger, generate_hash, create_directory, count_words
+from src.core.config import (
+    AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_MAX_CONCURRENCY, SUMMARIZATION_PROMPT, SUMMARIZATION_BATCH_PROMPT,
+    SUMMARIZATION_BATCH_SIZE, SUMMARIZATION_BATCH_MAX_TOKENS, SUMMARIES_DIR
+)
+from src.core.utils import logger, generate_hash, create_directory, count_words, print_progress, submit_io
+from src.core.llm_client import post_llm
+from src.core.tokenizer import truncate_to_tokens
+from src.processing.ranking_search_result import extract_json_text, estimate_tokens
+from src.processing.llm_cache import LLMCache
+
+# Кэш саммари по содержимому текста: одинаковые тексты (повторные запуски, зеркала страниц,
+# другие темы) не отправляются в LLM повторно
+_SUMMARY_CACHE = LLMCache("llm_summaries")
+
+# Хеш промпта саммаризации - при изменении промпта старые записи кэша не используются
+_PROMPT_HASH = hashlib.sha256(SUMMARIZATION_PROMPT.encode("utf-8")).hexdigest()
+
+# Максимальная длина текста документа в запросе к LLM в токенах
+MAX_TEXT_TOKENS = 8000
+
+# Пробелы вокруг переносов строк и последовательности из 2+ пробелов - границы блоков текста
+_BLOCK_BREAK_RE = re.compile(r'\s*\n\s*| {2,}\s*')
+
+# Раздел с саммари в сохраненном файле саммари
+_SUMMARY_SECTION_RE = re.compile(r"## Саммари\n\n(.*)", re.DOTALL)
+
+# Регулярное выражение для извлечения JSON с пакетом саммари из ответа LLM
+_JSON_OBJECT_BLOCK_RE = re.compile(r'```json\s*(\{.*\})\s*```', re.DOTALL)
 
 class DocumentSummarizer:
     """
@@ -30,7 +57,7 @@ class DocumentSummarizer:
     
     def extract_text_from_html(self, html_content):
         """
-        Извлекает текст из HTML-документа
+        Извлекает текст из HTML-документа (или из Markdown, если разметки в нем нет)
         
         Args:
             html_content (str): HTML-содержимое документа
@@ -39,26 +66,40 @@ class DocumentSummarizer:
             str: Извлеченный текст
         """
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Удаляем скрипты и стили
-            for script_or_style in soup(["script", "style"]):
-                script_or_style.extract()
-            
-            # Получаем текст
-            text = soup.get_text()
-            
-            # Удаляем лишние пробелы и переносы строк
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
+            if "<" not in html_content and "&" not in html_content:
+                # Страницы приходят от r.jina.ai уже в виде Markdown: без тегов и HTML-сущностей
+                # разбирать DOM не нужно, текст совпадет с результатом парсера
+                text = html_content
+            else:
+                # Парсер lxml (libxml2) разбирает HTML в разы быстрее встроенного html.parser
+                soup = BeautifulSoup(html_content, 'lxml')
+                
+                # Удаляем скрипты и стили
+                for script_or_style in soup(["script", "style"]):
+                    script_or_style.decompose()
+                
+                # Получаем текст
+                text = soup.get_text()
             
-            return text
+            # Удаляем лишние пробелы и переносы строк: каждый блок текста - на отдельной строке
+            return _BLOCK_BREAK_RE.sub('\n', text).strip()
         except Exception as e:
             logger.error(f"Ошибка при извлечении текста из HTML: {e}")
             return ""
     
-    def summarize_text(self, text, max_tokens=8000):
+    def get_summary_cache_key(self, text):
+        """
+        Формирует ключ кэша саммари по модели, промпту и тексту
+        
+        Args:
+            text (str): Текст, отправляемый в LLM (уже усеченный)
+            
+        Returns:
+            str: Ключ кэша саммари
+        """
+        return _SUMMARY_CACHE.make_parts_key(AITUNNEL_MODEL, _PROMPT_HASH, text)
+    
+    def summarize_text(self, text, max_tokens=MAX_TEXT_TOKENS):
         """
         Генерирует саммари для текста
         
@@ -70,11 +111,15 @@ class DocumentSummarizer:
             str: Саммари текста или None в случае ошибки
         """
         try:
-            # Ограничиваем размер текста для API (примерно 1 токен = 4 символа)
-            text = text[:max_tokens * 4]
-            
-            # Ограничиваем частоту запросов к API
-            time.sleep(1.0 / AITUNNEL_RPS)
+            # Ограничиваем размер текста для API по количеству токенов
+            text = truncate_to_tokens(text, max_tokens)
+            
+            # Саммари для такого же текста уже было сгенерировано
+            cache_key = self.get_summary_cache_key(text)
+            summary = _SUMMARY_CACHE.get(cache_key)
+            if summary is not None:
+                logger.info(f"Саммари загружено из кэша, длина: {len(summary)}")
+                return summary
             
             payload = {
                 "model": AITUNNEL_MODEL,
@@ -91,22 +136,244 @@ class DocumentSummarizer:
                 ]
             }
             
-            response = requests.post(AITUNNEL_API_URL, headers=self.headers, json=payload)
+            # Запрос идет через общую сессию и общий лимитер частоты запросов,
+            # поэтому метод можно вызывать одновременно из нескольких потоков
+            summary = post_llm(payload, headers=self.headers, generation=True)
             
-            if response.status_code == 200:
-                result = response.json()
-                summary = result["choices"][0]["message"]["content"]
+            if summary:
+                _SUMMARY_CACHE.set(cache_key, summary)
                 logger.info(f"Саммари успешно сгенерировано, длина: {len(summary)}")
-                return summary
-            else:
-                logger.error(f"Ошибка при обращении к API: {response.status_code}")
-                logger.error(response.text)
-                return None
+            return summary
                 
         except Exception as e:
             logger.error(f"Произошла ошибка при генерации саммари: {e}")
             return None
     
+    def split_into_batches(self, texts):
+        """
+        Разбивает тексты на пакеты для саммаризации с учетом ограничения на размер пакета
+        и бюджета токенов. Текст, превышающий бюджет, отправляется отдельным пакетом.
+        Пакет выдается сразу, как только он заполнен, поэтому тексты могут поступать
+        из генератора постепенно.
+        
+        Args:
+            texts (iterable): Тексты (список или генератор)
+            
+        Yields:
+            list: Пакет - список текстов
+        """
+        batch_size = max(1, SUMMARIZATION_BATCH_SIZE)
+        current_batch = []
+        current_tokens = 0
+        
+        for text in texts:
+            text_tokens = estimate_tokens(text)
+            
+            if current_batch and (len(current_batch) >= batch_size or current_tokens + text_tokens > SUMMARIZATION_BATCH_MAX_TOKENS):
+                yield current_batch
+                current_batch = []
+                current_tokens = 0
+            
+            current_batch.append(text)
+            current_tokens += text_tokens
+        
+        if current_batch:
+            yield current_batch
+    
+    def summarize_batch(self, texts, max_tokens=MAX_TEXT_TOKENS):
+        """
+        Генерирует саммари для нескольких текстов одним запросом к LLM.
+        Тексты, для которых LLM не вернула саммари, саммаризируются отдельными запросами.
+        
+        Args:
+            texts (list): Список исходных текстов, уже усеченных до max_tokens токенов
+            max_tokens (int): Максимальное количество токенов для ответа
+            
+        Returns:
+            list: Список саммари в порядке текстов (None для неудачных)
+        """
+        if len(texts) == 1:
+            return [self.summarize_text(texts[0], max_tokens)]
+        
+        # Формируем запрос для LLM: каждый текст помечается идентификатором [[N]]
+        parts = []
+        for text_id, text in enumerate(texts, 1):
+            parts.append(f"\n[[{text_id}]]\n{text}\n")
+        
+        payload = {
+            "model": AITUNNEL_MODEL,
+            "max_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SUMMARIZATION_BATCH_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": f"Пожалуйста, сделай summary каждого из следующих текстов:\n{''.join(parts)}"
+                }
+            ]
+        }
+        
+        # Саммари по идентификатору текста в пакете
+        summaries_by_id = {}
+        
+        try:
+            llm_text = post_llm(payload, headers=self.headers, generation=True)
+            
+            if llm_text is not None:
+                summaries_json = extract_json_text(llm_text, _JSON_OBJECT_BLOCK_RE)
+                
+                if summaries_json is not None:
+                    try:
+                        for summary_item in orjson.loads(summaries_json).get("summaries", []):
+                            try:
+                                text_id = int(summary_item["id"])
+                                summary = summary_item["summary"]
+                            except (KeyError, TypeError, ValueError):
+                                continue
+                            if isinstance(summary, str) and summary.strip():
+                                summaries_by_id[text_id] = summary.strip()
+                    except (json.JSONDecodeError, AttributeError) as json_error:
+                        logger.error(f"Ошибка при разборе JSON с пакетом саммари: {json_error}")
+                else:
+                    logger.error("Не удалось извлечь JSON с пакетом саммари из ответа LLM")
+        except Exception as e:
+            logger.error(f"Произошла ошибка при пакетной генерации саммари: {e}")
+        
+        summaries = []
+        for text_id, text in enumerate(texts, 1):
+            summary = summaries_by_id.get(text_id)
+            
+            if summary is None:
+                # Если LLM не вернула саммари для текста, саммаризируем его отдельным запросом
+                logger.warning(f"Саммари для текста [[{text_id}]] отсутствует в ответе на пакет, выполняется отдельный запрос")
+                summary = self.summarize_text(text, max_tokens)
+            else:
+                _SUMMARY_CACHE.set(self.get_summary_cache_key(text), summary)
+                logger.info(f"Саммари успешно сгенерировано в пакете, длина: {len(summary)}")
+            
+            summaries.append(summary)
+        
+        return summaries
+    
+    def _iter_new_texts(self, texts, summaries, uncached_groups):
+        """
+        Перебирает тексты по мере поступления: усекает их по токенам, подставляет
+        саммари из кэша и объединяет одинаковые тексты (зеркала страниц, перепечатки статей)
+        
+        Args:
+            texts (iterable): Исходные тексты (список или генератор)
+            summaries (list): Список саммари, который заполняется саммари из кэша
+            uncached_groups (dict): Текст -> индексы документов с этим текстом, заполняется по ходу
+            
+        Yields:
+            str: Усеченный текст, для которого нужно сгенерировать саммари
+        """
+        for index, text in enumerate(texts):
+            # Пустые тексты не отправляем в LLM
+            if not text:
+                continue
+            
+            text = truncate_to_tokens(text, MAX_TEXT_TOKENS)
+            
+            group = uncached_groups.get(text)
+            if group is not None:
+                group.append(index)
+                continue
+            
+            summary = _SUMMARY_CACHE.get(self.get_summary_cache_key(text))
+            if summary is not None:
+                summaries[index] = summary
+                continue
+            
+            uncached_groups[text] = [index]
+            yield text
+    
+    def summarize_texts(self, texts, total_texts=None):
+        """
+        Генерирует саммари для списка текстов: саммари из кэша возвращаются сразу,
+        одинаковые тексты отправляются в LLM один раз, остальные небольшие тексты
+        объединяются в пакеты (см. SUMMARIZATION_BATCH_SIZE и SUMMARIZATION_BATCH_MAX_TOKENS).
+        
+        Работает как конвейер "производитель-потребитель": тексты из генератора
+        (например, извлекаемые из HTML) готовятся в текущем потоке, и каждый заполненный
+        пакет сразу отправляется в пул потоков, поэтому подготовка следующих текстов
+        идет параллельно с запросами к LLM.
+        
+        Args:
+            texts (iterable): Исходные тексты (список или генератор)
+            total_texts (int, optional): Количество текстов, если texts - генератор
+            
+        Returns:
+            list: Список саммари в порядке текстов (None для неудачных)
+        """
+        if total_texts is None:
+            texts = list(texts)
+            total_texts = len(texts)
+        
+        summaries = [None] * total_texts
+        if not total_texts:
+            return summaries
+        
+        uncached_groups = {}
+        
+        max_workers = max(1, min(AITUNNEL_MAX_CONCURRENCY, total_texts))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.summarize_batch, batch): batch
+                for batch in self.split_into_batches(self._iter_new_texts(texts, summaries, uncached_groups))
+            }
+            
+            processed_texts = sum(1 for summary in summaries if summary is not None)
+            if processed_texts:
+                logger.info(f"Саммари для {processed_texts} текстов загружены из кэша")
+                print_progress(processed_texts, total_texts, prefix="Саммаризация:")
+            
+            duplicate_texts = sum(len(group) - 1 for group in uncached_groups.values())
+            if duplicate_texts:
+                logger.info(f"Найдено {duplicate_texts} документов с повторяющимся текстом, они получат саммари оригинала")
+            
+            for future in as_completed(futures):
+                for text, summary in zip(futures[future], future.result()):
+                    # Саммари текста получают все документы с этим текстом
+                    for text_index in uncached_groups[text]:
+                        summaries[text_index] = summary
+                    processed_texts += len(uncached_groups[text])
+                
+                print_progress(processed_texts, total_texts, prefix="Саммаризация:")
+        
+        return summaries
+    
+    def load_cached_summary(self, url, theme_name):
+        """
+        Загружает сохраненное саммари документа из файла
+        
+        Args:
+            url (str): URL документа
+            theme_name (str): Название темы
+            
+        Returns:
+            str: Текст саммари или None, если саммари не сохранено
+        """
+        url_hash = generate_hash(url)
+        summary_path = os.path.join(SUMMARIES_DIR, theme_name, f"{url_hash}.md")
+        
+        if not os.path.exists(summary_path):
+            return None
+        
+        logger.info(f"Загрузка существующего саммари для: {url}")
+        with open(summary_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        
+        # Извлекаем саммари из файла
+        summary_match = _SUMMARY_SECTION_RE.search(content)
+        if summary_match:
+            return summary_match.group(1)
+        
+        logger.warning(f"Не удалось извлечь саммари из файла: {summary_path}")
+        return None
+    
     def create_summary(self, content, title, url, original_query, theme_name):
         """
         Создает и сохраняет саммари для документа
@@ -122,25 +389,15 @@ class DocumentSummarizer:
             dict: Документ с саммари или None в случае ошибки
         """
         try:
-            # Проверяем, есть ли у нас уже саммари для этого URL
-            url_hash = generate_hash(url)
-            summary_path = os.path.join(SUMMARIES_DIR, theme_name, f"{url_hash}.md")
-            
-            # Если саммари уже существует, загружаем его
-            if os.path.exists(summary_path):
-                logger.info(f"Загрузка существующего саммари для: {url}")
-                with open(summary_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    # Извлекаем саммари из файла
-                    summary_match = re.search(r"## Саммари\n\n(.*)", content, re.DOTALL)
-                    if summary_match:
-                        summary = summary_match.group(1)
-                        return {
-                            "title": title,
-                            "url": url,
-                            "summary": summary,
-                            "query": original_query
-                        }
+            # Если саммари для этого URL уже существует, загружаем его
+            summary = self.load_cached_summary(url, theme_name)
+            if summary:
+                return {
+                    "title": title,
+                    "url": url,
+                    "summary": summary,
+                    "query": original_query
+                }
             
             # Иначе создаем новое саммари
             logger.info(f"Создание нового саммари для: {title}")
@@ -255,9 +512,84 @@ class DocumentSummarizer:
             logger.error(f"Ошибка при сохранении саммари: {e}")
             return None
     
+    def create_summaries(self, documents, original_query, theme_name):
+        """
+        Создает саммари для списка документов. Сохраненные саммари загружаются из файлов,
+        для остальных документов саммари генерируются пакетами параллельно (см. summarize_texts).
+        
+        Args:
+            documents (list): Список документов с полями title, url и content
+            original_query (str): Исходный запрос пользователя
+            theme_name (str): Название темы для кэширования
+            
+        Returns:
+            list: Список документов с саммари в исходном порядке (без неудачных)
+        """
+        summaries = [None] * len(documents)
+        new_indexes = []
+        
+        for index, document in enumerate(documents):
+            url = document.get("url", "")
+            summary = self.load_cached_summary(url, theme_name)
+            
+            if summary:
+                summaries[index] = {
+                    "title": document.get("title", ""),
+                    "url": url,
+                    "summary": summary,
+                    "query": original_query
+                }
+            else:
+                new_indexes.append(index)
+        
+        new_summaries = self.summarize_texts([documents[index].get("content", "") for index in new_indexes])
+        
+        for index, summary in zip(new_indexes, new_summaries):
+            url = documents[index].get("url", "")
+            
+            if not summary:
+                logger.error(f"Не удалось создать саммари для: {url}")
+                continue
+            
+            document = {
+                "title": documents[index].get("title", ""),
+                "url": url,
+                "summary": summary,
+                "query": original_query
+            }
+            
+            # Сохраняем саммари в файл в фоновом потоке
+            submit_io(self.save_summary_to_file, document, theme_name)
+            
+            summaries[index] = document
+        
+        return [summary for summary in summaries if summary]
+    
+    def _iter_document_texts(self, documents, indexes):
+        """
+        Извлекает текст из HTML документов по одному, по мере запроса следующего текста
+        
+        Args:
+            documents (list): Список документов
+            indexes (list): Индексы документов, для которых нужен текст
+            
+        Yields:
+            str: Извлеченный текст (пустая строка, если текст извлечь не удалось)
+        """
+        for index in indexes:
+            document = documents[index]
+            extracted_text = self.extract_text_from_html(document.get("content"))
+            
+            if not extracted_text:
+                logger.warning(f"Не удалось извлечь текст из документа: {document.get('url')}")
+            
+            yield extracted_text
+    
     def process_documents(self, documents, theme_name):
         """
-        Обрабатывает список документов: генерирует и сохраняет саммари
+        Обрабатывает список документов: генерирует и сохраняет саммари.
+        Сохраненные саммари загружаются сразу, для новых документов текст извлекается
+        из HTML по ходу конвейера, параллельно с генерацией саммари предыдущих пакетов.
         
         Args:
             documents (list): Список документов для обработки
@@ -266,36 +598,44 @@ class DocumentSummarizer:
         Returns:
             list: Список документов с саммари
         """
-        documents_with_summaries = []
+        documents_with_summaries = list(documents)
+        new_indexes = []
         
-        for document in documents:
-            # Проверяем, был ли документ уже обработан
+        for index, document in enumerate(documents):
             url = document.get("url")
-            url_hash = generate_hash(url)
-            file_path = os.path.join(SUMMARIES_DIR, theme_name, f"{url_hash}.md")
-            
-            if os.path.exists(file_path):
-                logger.info(f"Саммари для документа уже существует: {url}")
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    # Извлекаем саммари из файла
-                    summary_match = re.search(r"## Саммари\n\n(.*)", content, re.DOTALL)
-                    if summary_match:
-                        summary = summary_match.group(1)
-                        document_with_summary = document.copy()
-                        document_with_summary["summary"] = summary
-                        documents_with_summaries.append(document_with_summary)
-                    else:
-                        logger.warning(f"Не удалось извлечь саммари из файла: {file_path}")
-                        documents_with_summaries.append(document)
-            else:
-                # Саммаризируем документ
-                document_with_summary = self.summarize_document(document)
-                
-                # Сохраняем саммари
-                subtopic = document.get("subtopic")
-                self.save_summary_to_file(document_with_summary, theme_name, subtopic)
-                
-                documents_with_summaries.append(document_with_summary)
+            
+            # Проверяем, был ли документ уже обработан
+            summary = self.load_cached_summary(url, theme_name)
+            if summary:
+                document_with_summary = document.copy()
+                document_with_summary["summary"] = summary
+                documents_with_summaries[index] = document_with_summary
+                continue
+            
+            if not document.get("content"):
+                logger.warning(f"Документ не содержит контента для саммаризации: {url}")
+                continue
+            
+            new_indexes.append(index)
+        
+        # Саммаризируем новые документы пакетами параллельно: текст следующих документов
+        # извлекается, пока предыдущие пакеты обрабатываются LLM
+        new_texts = self._iter_document_texts(documents, new_indexes)
+        new_summaries = self.summarize_texts(new_texts, total_texts=len(new_indexes))
+        
+        for index, summary in zip(new_indexes, new_summaries):
+            document = documents[index]
+            
+            if not summary:
+                logger.warning(f"Не удалось сгенерировать саммари для документа: {document.get('url')}")
+                continue
+            
+            document_with_summary = document.copy()
+            document_with_summary["summary"] = summary
+            
+            # Сохраняем саммари в фоновом потоке
+            submit_io(self.save_summary_to_file, document_with_summary, theme_name, document.get("subtopic"))
+            
+            documents_with_summaries[index] = document_with_summary
         
         return documents_with_summaries 
\ No newline at end of file
@@ -1,13 +1,30 @@
 """
 Модуль для планирования поисковых запросов
 """
-import requests
-import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, SEARCH_QUERIES_PROMPT
+import orjson
+
+from src.core.config import (
+    AITUNNEL_API_KEY,
+    AITUNNEL_MODEL,
+    AITUNNEL_MAX_CONCURRENCY,
+    SEARCH_QUERIES_PROMPT,
+    SEARCH_QUERIES_BATCH_PROMPT,
+    SEARCH_QUERIES_BATCH_SIZE
+)
 from src.core.constants import QUERY_PREFIX
 from src.core.utils import logger, extract_text_between_prefix
+from src.core.llm_client import post_llm
+from src.processing.llm_cache import LLMCache
+
+# Кэш ответов LLM при планировании: повторный запрос с той же темой не отправляется в API
+_LLM_CACHE = LLMCache("llm_planning")
+
+# Метка темы в пакетном запросе и ответе: ###ТЕМА N###
+_TOPIC_MARKER_RE = re.compile(r'###\s*ТЕМА\s*(\d+)\s*###')
 
 class SearchQueryPlanner:
     """
@@ -49,26 +66,99 @@ class SearchQueryPlanner:
                 ]
             }
             
-            response = requests.post(AITUNNEL_API_URL, headers=self.headers, json=payload)
+            cache_key = _LLM_CACHE.make_key(payload)
+            cached_content = _LLM_CACHE.get(cache_key)
             
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                
+            if cached_content is not None:
+                content = cached_content
+            else:
+                # Запрос идет через общую сессию с пулом соединений
+                content = post_llm(payload, headers=self.headers)
+            
+            if content is not None:
                 # Извлекаем поисковые запросы из ответа
                 search_queries = extract_text_between_prefix(content, QUERY_PREFIX)
                 
+                # Кэшируем только ответы, из которых удалось что-то извлечь
+                if search_queries and cached_content is None:
+                    _LLM_CACHE.set(cache_key, content)
+                
                 logger.info(f"Сгенерировано {len(search_queries)} поисковых запросов для подзапроса: {subtopic}")
                 return search_queries
             else:
-                logger.error(f"Ошибка при обращении к API: {response.status_code}")
-                logger.error(response.text)
                 return []
                 
         except Exception as e:
             logger.error(f"Произошла ошибка при генерации поисковых запросов: {e}")
             return []
 
+    def generate_search_queries_batch(self, subtopics, max_tokens=8000):
+        """
+        Генерирует поисковые запросы для нескольких подзапросов одним запросом к LLM.
+        Подзапросы, для которых в ответе не нашлось запросов, обрабатываются по отдельности.
+        
+        Args:
+            subtopics (list): Список подзапросов
+            
+        Returns:
+            list: Списки поисковых запросов в порядке подзапросов
+        """
+        if len(subtopics) == 1:
+            return [self.generate_search_queries(subtopics[0], max_tokens)]
+        
+        results = [None] * len(subtopics)
+        
+        try:
+            topics_text = "\n\n".join(
+                f"###ТЕМА {topic_id}###\n{subtopic}" for topic_id, subtopic in enumerate(subtopics, 1)
+            )
+            
+            payload = {
+                "model": AITUNNEL_MODEL,
+                "max_tokens": max_tokens,
+                "messages": [
+                    {
+                        "role": "system",
+                        "content": SEARCH_QUERIES_BATCH_PROMPT
+                    },
+                    {
+                        "role": "user",
+                        "content": topics_text
+                    }
+                ]
+            }
+            
+            cache_key = _LLM_CACHE.make_key(payload)
+            cached_content = _LLM_CACHE.get(cache_key)
+            
+            if cached_content is not None:
+                content = cached_content
+            else:
+                content = post_llm(payload, headers=self.headers)
+            
+            if content is not None:
+                # Ответ разбивается метками тем: [текст до первой метки, N, запросы темы N, ...]
+                parts = _TOPIC_MARKER_RE.split(content)
+                for topic_id, topic_text in zip(parts[1::2], parts[2::2]):
+                    index = int(topic_id) - 1
+                    if 0 <= index < len(subtopics) and not results[index]:
+                        results[index] = extract_text_between_prefix(topic_text, QUERY_PREFIX)
+                
+                # Кэшируем только полные ответы
+                if cached_content is None and all(results):
+                    _LLM_CACHE.set(cache_key, content)
+        except Exception as e:
+            logger.error(f"Произошла ошибка при пакетной генерации поисковых запросов: {e}")
+        
+        for index, subtopic in enumerate(subtopics):
+            if results[index]:
+                logger.info(f"Сгенерировано {len(results[index])} поисковых запросов для подзапроса: {subtopic}")
+            else:
+                logger.warning(f"Поисковые запросы для подзапроса не получены в пакете, повторная генерация: {subtopic}")
+                results[index] = self.generate_search_queries(subtopic, max_tokens)
+        
+        return results
+
     def save_search_queries_to_file(self, subtopics_with_queries, theme_name, cache_dir="cache"):
         """
         Сохраняет поисковые запросы в файл
@@ -89,8 +179,8 @@ class SearchQueryPlanner:
             # Генерируем имя файла
             file_path = os.path.join(search_queries_dir, f"search_queries.json")
             
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(subtopics_with_queries, f, ensure_ascii=False, indent=2)
+            with open(file_path, "wb") as f:
+                f.write(orjson.dumps(subtopics_with_queries, option=orjson.OPT_INDENT_2))
             
             logger.info(f"Поисковые запросы сохранены в файл: {file_path}")
             return file_path
@@ -100,7 +190,9 @@ class SearchQueryPlanner:
 
     def generate_all_search_queries(self, subtopics):
         """
-        Генерирует поисковые запросы для всех подзапросов
+        Генерирует поисковые запросы для всех подзапросов. Подзапросы объединяются в пакеты
+        по SEARCH_QUERIES_BATCH_SIZE, запросы к LLM для разных пакетов выполняются
+        параллельно в пуле потоков.
         
         Args:
             subtopics (list): Список подзапросов
@@ -110,8 +202,22 @@ class SearchQueryPlanner:
         """
         result = {}
         
-        for subtopic in subtopics:
-            search_queries = self.generate_search_queries(subtopic)
+        if not subtopics:
+            return result
+        
+        batch_size = max(1, SEARCH_QUERIES_BATCH_SIZE)
+        batches = [subtopics[i:i + batch_size] for i in range(0, len(subtopics), batch_size)]
+        
+        max_workers = max(1, min(AITUNNEL_MAX_CONCURRENCY, len(batches)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map сохраняет порядок пакетов, а пакеты - порядок подзапросов
+            all_search_queries = [
+                search_queries
+                for batch_results in executor.map(self.generate_search_queries_batch, batches)
+                for search_queries in batch_results
+            ]
+        
+        for subtopic, search_queries in zip(subtopics, all_search_queries):
             if search_queries:
                 result[subtopic] = search_queries
         
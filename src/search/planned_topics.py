@@ -1,13 +1,39 @@
 """
 Модуль для планирования подзапросов
 """
-import requests
-import json
 import os
+import re
+import hashlib
 
-from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, AITUNNEL_API_URL, SUBTOPICS_PROMPT
+from src.core.config import AITUNNEL_API_KEY, AITUNNEL_MODEL, SUBTOPICS_PROMPT
 from src.core.constants import SUBTOPIC_PREFIX
 from src.core.utils import logger, extract_text_between_prefix
+from src.core.llm_client import post_llm
+from src.processing.llm_cache import LLMCache
+
+# Кэш ответов LLM при планировании: повторный запрос с той же темой не отправляется в API
+_LLM_CACHE = LLMCache("llm_planning")
+
+# Хеш промпта входит в ключ кэша по нормализованному запросу,
+# чтобы изменение промпта не возвращало устаревшие подзапросы
+_PROMPT_HASH = hashlib.sha256(SUBTOPICS_PROMPT.encode("utf-8")).hexdigest()
+
+# Слова запроса без пунктуации и пробелов
+_WORD_RE = re.compile(r"\w+")
+
+def normalize_query(query):
+    """
+    Приводит запрос к каноническому виду: слова в нижнем регистре без пунктуации
+    и лишних пробелов. Порядок слов, предлоги и вопросительные слова сохраняются,
+    чтобы разные вопросы ("как лечить" и "когда лечить") не давали один ключ.
+    
+    Args:
+        query (str): Запрос пользователя
+        
+    Returns:
+        str: Нормализованный запрос
+    """
+    return " ".join(_WORD_RE.findall(query.lower()))
 
 class TopicPlanner:
     """
@@ -49,20 +75,38 @@ class TopicPlanner:
                 ]
             }
             
-            response = requests.post(AITUNNEL_API_URL, headers=self.headers, json=payload)
+            cache_key = _LLM_CACHE.make_key(payload)
+            cached_content = _LLM_CACHE.get(cache_key)
             
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                
+            # Если точного совпадения нет, ищем ответ на близкий по формулировке запрос
+            normalized_query = normalize_query(query)
+            normalized_cache_key = None
+            if normalized_query:
+                normalized_cache_key = _LLM_CACHE.make_parts_key(AITUNNEL_MODEL, _PROMPT_HASH, normalized_query)
+                if cached_content is None:
+                    cached_content = _LLM_CACHE.get(normalized_cache_key)
+                    if cached_content is not None:
+                        logger.info(f"Подзапросы загружены из кэша похожего запроса: {normalized_query}")
+            
+            if cached_content is not None:
+                content = cached_content
+            else:
+                # Запрос идет через общую сессию с пулом соединений
+                content = post_llm(payload, headers=self.headers)
+            
+            if content is not None:
                 # Извлекаем подзапросы из ответа
                 subtopics = extract_text_between_prefix(content, SUBTOPIC_PREFIX)
                 
+                # Кэшируем только ответы, из которых удалось что-то извлечь
+                if subtopics and cached_content is None:
+                    _LLM_CACHE.set(cache_key, content)
+                    if normalized_cache_key:
+                        _LLM_CACHE.set(normalized_cache_key, content)
+                
                 logger.info(f"Сгенерировано {len(subtopics)} подзапросов")
                 return subtopics
             else:
-                logger.error(f"Ошибка при обращении к API: {response.status_code}")
-                logger.error(response.text)
                 return []
                 
         except Exception as e:
@@ -2,15 +2,24 @@
 Модуль для скрапинга и поиска в интернете
 """
 import os
-import json
 import asyncio
 import aiohttp
-import requests
 import time
 import hashlib
+import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import suppress
 from pathlib import Path
 from urllib.parse import quote, urlencode
 
+import orjson
+
+try:
+    import zstandard
+except ImportError:  # Без zstandard страницы кэшируются без сжатия
+    zstandard = None
+
 from src.core.config import (
     SEARCHXNG_BASIC_AUTH_LOGIN, 
     SEARCHXNG_BASIC_AUTH_PASSWORD,
@@ -18,17 +27,335 @@ from src.core.config import (
     JINA_RPS,
     AITUNNEL_RPS,
     CACHE_DIR,
-    DOCS_DIR
+    DOCS_DIR,
+    SEARCH_RESULTS_CACHE_TTL_SECONDS
 )
 from src.core.constants import HTTP_OK
 from src.core.utils import logger, generate_hash, create_directory
 from src.core.rate_limiter import RateLimiter
+from src.processing.ranking_search_result import write_json_array
 from src.core.config import SEARCHXNG_API_URL
 
+# Ограничения пула соединений HTTP-сессии
+HTTP_CONNECTION_LIMIT = 200
+HTTP_CONNECTION_LIMIT_PER_HOST = 10
+HTTP_DNS_CACHE_TTL = 300  # секунды
+HTTP_TIMEOUT = 30  # секунды
+
+# Размер части при потоковой записи страницы в кэш
+STREAM_CHUNK_SIZE = 64 * 1024
+# Минимальная длина валидного контента страницы
+MIN_PAGE_CONTENT_SIZE = 100
+# Максимальный размер сохраняемого контента страницы, остаток огромных страниц не загружается
+MAX_PAGE_CONTENT_SIZE = 5 * 1024 * 1024
+
+# Страницы в кэше хранятся сжатыми zstd, если библиотека доступна.
+# Ранее сохраненные несжатые файлы (.md) продолжают читаться
+PAGE_CACHE_COMPRESSION_LEVEL = 3
+COMPRESSED_PAGE_SUFFIX = ".zst"
+PAGE_CACHE_EXTENSION = ".md" + COMPRESSED_PAGE_SUFFIX if zstandard else ".md"
+
+# Хранилище страниц по хешу содержимого: файл кэша URL - жесткая ссылка на файл хранилища,
+# поэтому одинаковые страницы с разных URL (зеркала, агрегаторы) хранятся на диске один раз
+PAGE_BLOBS_DIR = os.path.join(DOCS_DIR, ".blobs")
+
+# Через сколько секунд ожидания ответа r.jina.ai параллельно запускается прямое скачивание страницы.
+# r.jina.ai дает более качественный Markdown, поэтому прямое скачивание не запускается сразу
+PAGE_FALLBACK_HEDGE_DELAY = 5  # секунды
+
+# Количество страниц, которые хранятся в памяти для повторных обращений без чтения с диска
+PAGE_MEMORY_CACHE_SIZE = 128
+
+# Элементы HTML, которые переносятся в Markdown при прямом скачивании страницы
+_MARKDOWN_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "p", "li"]
+
+# Записи о неудачных загрузках страниц, чтобы не загружать их повторно при каждом запуске
+FAILED_PAGES_DIR = os.path.join(DOCS_DIR, ".neg")
+FAILED_PAGE_TTL_CLIENT_ERROR = 24 * 60 * 60  # секунды, для ошибок 4xx
+FAILED_PAGE_TTL_OTHER = 60 * 60  # секунды, для ошибок 5xx, таймаутов и пустого контента
+
+# Общий экземпляр поисковика: сессия с пулом соединений и кэшем DNS,
+# а также ограничители скорости переиспользуются между вызовами
+_search_engine = None
+
+def read_cached_page(cache_path):
+    """
+    Читает страницу из кэша. Для сжатого файла, которого еще нет,
+    читается несжатый файл в прежнем формате
+    
+    Args:
+        cache_path (str): Путь к файлу кэша
+        
+    Returns:
+        str: Содержимое страницы или None, если страницы нет в кэше
+    """
+    if cache_path.endswith(COMPRESSED_PAGE_SUFFIX):
+        try:
+            with open(cache_path, "rb") as f:
+                data = zstandard.ZstdDecompressor().decompressobj().decompress(f.read())
+            return data.decode("utf-8", errors="ignore")
+        except FileNotFoundError:
+            cache_path = cache_path[:-len(COMPRESSED_PAGE_SUFFIX)]
+    
+    try:
+        with open(cache_path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def hash_page_content(data):
+    """
+    Создает объект хеширования содержимого страницы для хранилища по хешу
+    
+    Args:
+        data (bytes): Начальные данные
+        
+    Returns:
+        hashlib.blake2b: Объект хеширования, дополняемый через update()
+    """
+    return hashlib.blake2b(data, digest_size=16)
+
+def hash_search_queries(search_queries_dict):
+    """
+    Вычисляет хеш подзапросов и их поисковых запросов. Хеш сохраняется рядом
+    с результатами поиска, чтобы не переиспользовать их для других запросов
+    
+    Args:
+        search_queries_dict (dict): Словарь с подзапросами и поисковыми запросами
+        
+    Returns:
+        str: Хеш в виде шестнадцатеричной строки
+    """
+    queries = sorted((str(subtopic), [str(query) for query in search_queries]) for subtopic, search_queries in search_queries_dict.items())
+    return hashlib.sha256(orjson.dumps(queries)).hexdigest()
+
+def store_page_blob(tmp_path, cache_path, content_hash):
+    """
+    Переносит записанный файл страницы в хранилище по хешу содержимого и делает
+    файл кэша URL жесткой ссылкой на него. Если такое содержимое уже сохранено,
+    новый файл отбрасывается. Если файловая система не поддерживает жесткие ссылки,
+    файл кэша сохраняется обычной копией
+    
+    Args:
+        tmp_path (str): Путь к записанному временному файлу страницы
+        cache_path (str): Путь к файлу кэша URL
+        content_hash (str): Хеш несжатого содержимого страницы
+    """
+    blob_path = os.path.join(PAGE_BLOBS_DIR, f"{content_hash}{PAGE_CACHE_EXTENSION}")
+    os.makedirs(PAGE_BLOBS_DIR, exist_ok=True)
+    
+    if os.path.exists(blob_path):
+        # Обновляем время изменения, чтобы очистка кэша не считала содержимое устаревшим
+        os.utime(blob_path)
+    else:
+        os.replace(tmp_path, blob_path)
+    
+    with suppress(FileNotFoundError):
+        os.remove(cache_path)
+    
+    try:
+        os.link(blob_path, cache_path)
+    except OSError as e:
+        logger.debug(f"Не удалось создать жесткую ссылку {cache_path}: {e}")
+        shutil.copyfile(blob_path, cache_path)
+
+def write_cached_page(cache_path, content):
+    """
+    Сохраняет страницу в кэш
+    
+    Args:
+        cache_path (str): Путь к файлу кэша
+        content (str): Содержимое страницы
+    """
+    data = content.encode("utf-8", errors="ignore")
+    content_hash = hash_page_content(data).hexdigest()
+    if cache_path.endswith(COMPRESSED_PAGE_SUFFIX):
+        data = zstandard.ZstdCompressor(level=PAGE_CACHE_COMPRESSION_LEVEL).compress(data)
+    
+    fd, tmp_path = create_page_temp_file()
+    try:
+        with open(fd, "wb") as f:
+            f.write(data)
+        store_page_blob(tmp_path, cache_path, content_hash)
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+def create_page_temp_file():
+    """
+    Создает уникальный временный файл для записи страницы в директории кэша
+    (на той же файловой системе, что и хранилище, чтобы перенос был атомарным).
+    У каждой загрузки свой файл, поэтому одновременные загрузки одной страницы
+    не перезаписывают данные друг друга
+    
+    Returns:
+        tuple: (дескриптор открытого файла, путь к файлу)
+    """
+    return tempfile.mkstemp(dir=DOCS_DIR, prefix=".part-", suffix=PAGE_CACHE_EXTENSION)
+
+def publish_page(cache_path, page):
+    """
+    Сохраняет в кэш страницу, полученную победившей загрузкой
+    
+    Args:
+        cache_path (str): Путь к файлу кэша
+        page (tuple): (содержимое, HTTP-статус, путь к временному файлу или None, хеш содержимого)
+    """
+    content, _, tmp_path, content_hash = page
+    if tmp_path is None:
+        write_cached_page(cache_path, content)
+        return
+    
+    try:
+        store_page_blob(tmp_path, cache_path, content_hash)
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+def discard_page(page):
+    """
+    Удаляет временный файл страницы, полученной проигравшей загрузкой
+    
+    Args:
+        page (tuple): (содержимое, HTTP-статус, путь к временному файлу или None, хеш содержимого)
+    """
+    tmp_path = page[2]
+    if tmp_path is not None:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+def write_document(file_path, metadata, content):
+    """
+    Сохраняет документ с метаданными в файл, не склеивая их в одну строку
+    
+    Args:
+        file_path (str): Путь к файлу
+        metadata (str): Метаданные в начале документа
+        content (str): Содержимое документа
+    """
+    with open(file_path, "w", encoding="utf-8", errors="ignore") as f:
+        f.write(metadata)
+        f.write(content)
+
+def html_to_markdown(html_content):
+    """
+    Извлекает из HTML заголовки, параграфы и пункты списков и форматирует их как простой Markdown.
+    Элементы обходятся за один проход в порядке следования в документе
+    
+    Args:
+        html_content (str): HTML-содержимое страницы
+        
+    Returns:
+        str: Содержимое страницы в формате Markdown
+    """
+    from bs4 import BeautifulSoup
+    
+    # Парсер lxml (libxml2) разбирает HTML в разы быстрее встроенного html.parser
+    soup = BeautifulSoup(html_content, 'lxml')
+    
+    # Удаляем скрипты и стили
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    
+    paragraphs = []
+    in_list = False
+    
+    for element in soup.find_all(_MARKDOWN_TAGS):
+        name = element.name
+        
+        # Пункты маркированных списков
+        if name == "li":
+            if element.parent is not None and element.parent.name == "ul":
+                paragraphs.append(f"* {element.get_text().strip()}\n")
+                in_list = True
+            continue
+        
+        # После списка - пустая строка
+        if in_list:
+            paragraphs.append("\n")
+            in_list = False
+        
+        if name == "p":
+            paragraphs.append(f"{element.get_text().strip()}\n\n")
+        else:
+            # Заголовки h1-h6
+            paragraphs.append(f"{'#' * int(name[1])} {element.get_text().strip()}\n")
+    
+    if in_list:
+        paragraphs.append("\n")
+    
+    return "".join(paragraphs)
+
+def get_failure_path(url_hash):
+    """
+    Возвращает путь к записи о неудачной загрузке страницы
+    
+    Args:
+        url_hash (str): Хеш URL страницы
+        
+    Returns:
+        str: Путь к файлу записи
+    """
+    return os.path.join(FAILED_PAGES_DIR, f"{url_hash}.json")
+
+def has_recent_failure(url_hash):
+    """
+    Проверяет, завершалась ли загрузка страницы ошибкой в течение срока хранения записи
+    
+    Args:
+        url_hash (str): Хеш URL страницы
+        
+    Returns:
+        bool: True, если есть действующая запись о неудачной загрузке
+    """
+    try:
+        with open(get_failure_path(url_hash), "rb") as f:
+            entry = orjson.loads(f.read())
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error(f"Ошибка при чтении записи о неудачной загрузке {url_hash}: {e}")
+        return False
+    
+    return time.time() - entry.get("created", 0) < entry.get("ttl", 0)
+
+def record_failure(url_hash, status):
+    """
+    Сохраняет запись о неудачной загрузке страницы. Ошибки клиента (4xx) обычно
+    постоянны и хранятся дольше, ошибки сервера и сети - меньше
+    
+    Args:
+        url_hash (str): Хеш URL страницы
+        status (int): HTTP-статус ответа или None, если ответ не получен
+    """
+    if status is not None and 400 <= status < 500:
+        ttl = FAILED_PAGE_TTL_CLIENT_ERROR
+    else:
+        ttl = FAILED_PAGE_TTL_OTHER
+    
+    try:
+        # Директория могла быть удалена при очистке кэша как пустая
+        os.makedirs(FAILED_PAGES_DIR, exist_ok=True)
+        with open(get_failure_path(url_hash), "wb") as f:
+            f.write(orjson.dumps({"status": status, "created": time.time(), "ttl": ttl}))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении записи о неудачной загрузке {url_hash}: {e}")
+
 class SearchEngine:
     """
     Класс для поиска в интернете и скрапинга страниц
     """
+    # Адрес сервиса r.jina.ai, к которому добавляется URL страницы
+    _JINA_READER_URL = "https://r.jina.ai/"
+    
+    # Заголовки и таймаут загрузки страниц одинаковы для всех запросов,
+    # поэтому создаются один раз при определении класса
+    _PAGE_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml"
+    }
+    _PAGE_TIMEOUT = aiohttp.ClientTimeout(total=30)
+    
     def __init__(self):
         # URL для поискового сервиса
         self.search_url = SEARCHXNG_API_URL
@@ -36,27 +363,67 @@ class SearchEngine:
         # Создаем объект для ограничения скорости запросов
         self.rate_limiter = RateLimiter()
         
+        # Сессия для HTTP-запросов создается при первом обращении
+        self._session = None
+        
+        # Загружаемые в данный момент страницы: хеш URL -> Future с содержимым
+        self._inflight = {}
+        
+        # Недавно полученные страницы (LRU): хеш URL -> содержимое
+        self._page_memory_cache = OrderedDict()
+        
         # Создаем базовые директории для кэша
         create_directory(CACHE_DIR)
         create_directory(DOCS_DIR)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+    
+    @property
+    def session(self):
+        """
+        Сессия для HTTP-запросов с ограниченным пулом соединений, общая для всех запросов
         
-    async def search_topic(self, query, session, max_results=10, format="json"):
+        Returns:
+            aiohttp.ClientSession: Сессия для HTTP-запросов
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_CONNECTION_LIMIT,
+                limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+            )
+        return self._session
+    
+    async def close(self):
+        """
+        Закрывает сессию для HTTP-запросов
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def search_topic(self, query, max_results=10, format="json"):
         """
         Выполняет поиск по запросу
         
         Args:
             query (str): Поисковый запрос
-            session (aiohttp.ClientSession): Сессия для HTTP-запросов
             max_results (int): Максимальное количество результатов
             format (str): Формат результатов поиска (json, html)
             
         Returns:
-            list: Список результатов поиска
+            list: Список результатов поиска или None, если поиск завершился ошибкой
+                  (пустой список означает, что по запросу ничего не найдено)
         """
         try:
-            # Ожидаем перед запросом в соответствии с ограничениями API
-            await self.rate_limiter.wait("searchxng")
-            
             # Формируем параметры запроса
             params = {
                 "q": query,
@@ -65,131 +432,326 @@ class SearchEngine:
             
             link = self.search_url + "?" + urlencode(params)
             
-            # Делаем запрос с базовой аутентификацией
+            # Делаем запрос с базовой аутентификацией, соблюдая ограничения API
             auth = aiohttp.BasicAuth(SEARCHXNG_BASIC_AUTH_LOGIN, SEARCHXNG_BASIC_AUTH_PASSWORD)
-            async with session.get(link, auth=auth) as response:
+            async with self.rate_limiter.slot("searchxng"), self.session.get(link, auth=auth) as response:
                 if response.status == HTTP_OK:
-                    result = await response.json()
+                    result = await response.json(loads=orjson.loads)
                     result_wrap = result['results'][:max_results]
                     logger.info(f"Найдено {len(result_wrap)} результатов для запроса: {query}")
                     return result_wrap
                 else:
                     error_text = await response.text()
                     logger.error(f"Ошибка при поиске ({response.status}): {error_text}")
-                    return []
+                    return None
         except Exception as e:
             logger.error(f"Произошла ошибка при поиске: {e}")
-            return []
+            return None
     
-    async def fetch_page_content(self, url, session):
+    async def _stream_to_temp_file(self, response):
         """
-        Получает содержимое страницы по URL, используя сервис r.jina.ai для преобразования в Markdown
+        Записывает тело ответа во временный файл по частям, не держа его целиком в памяти
+        до записи (со сжатием, если страницы кэшируются сжатыми). В кэш файл переносится
+        позже, только если эта загрузка победила (см. publish_page).
+        
+        Args:
+            response (aiohttp.ClientResponse): Ответ сервера
+            
+        Returns:
+            tuple: (содержимое страницы не больше MAX_PAGE_CONTENT_SIZE байт, путь к временному файлу,
+                хеш содержимого) или None, если содержимое слишком короткое
+        """
+        fd, tmp_path = create_page_temp_file()
+        size = 0
+        hasher = hash_page_content(b"")
+        
+        compressor = None
+        if tmp_path.endswith(COMPRESSED_PAGE_SUFFIX):
+            compressor = zstandard.ZstdCompressor(level=PAGE_CACHE_COMPRESSION_LEVEL).compressobj()
+        
+        completed = False
+        try:
+            with open(fd, "wb") as f:
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    hasher.update(chunk)
+                    if compressor is not None:
+                        chunk = compressor.compress(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+                    
+                    if size >= MAX_PAGE_CONTENT_SIZE:
+                        logger.warning(f"Страница больше {MAX_PAGE_CONTENT_SIZE} байт, сохранено только начало: {response.url}")
+                        break
+                
+                if compressor is not None:
+                    f.write(compressor.flush())
+            
+            if size <= MIN_PAGE_CONTENT_SIZE:
+                return None
+            
+            content = await asyncio.to_thread(read_cached_page, tmp_path)
+            completed = True
+            return content, tmp_path, hasher.hexdigest()
+        finally:
+            # Недокачанный, отброшенный или отмененный файл не должен оставаться на диске
+            if not completed:
+                with suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+    
+    async def fetch_page_content(self, url):
+        """
+        Получает содержимое страницы по URL, используя сервис r.jina.ai для преобразования в Markdown.
+        Одновременные запросы одной и той же страницы ожидают одну общую загрузку.
         
         Args:
             url (str): URL страницы
-            session (aiohttp.ClientSession): Сессия для HTTP-запросов
             
         Returns:
             str: Содержимое страницы в формате Markdown или None в случае ошибки
         """
+        # Генерируем хеш URL для кэширования
+        url_hash = generate_hash(url)
+        
+        # Страница недавно уже была получена - отдаем ее из памяти
+        content = self._page_memory_cache.get(url_hash)
+        if content is not None:
+            self._page_memory_cache.move_to_end(url_hash)
+            return content
+        
+        # Страница уже загружается - дожидаемся результата этой загрузки
+        inflight = self._inflight.get(url_hash)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url_hash] = future
+        
         try:
-            # Генерируем хеш URL для кэширования
-            url_hash = generate_hash(url)
-            cache_path = os.path.join(DOCS_DIR, f"{url_hash}.md")
+            content = await self._fetch_page_content(url, url_hash)
+            future.set_result(content)
             
-            # Проверяем, есть ли страница в кэше
-            if os.path.exists(cache_path):
-                logger.info(f"Загрузка страницы из кэша: {url}")
-                with open(cache_path, "r", encoding="utf-8", errors="ignore") as f:
-                    return f.read()
+            if content is not None:
+                self._page_memory_cache[url_hash] = content
+                if len(self._page_memory_cache) > PAGE_MEMORY_CACHE_SIZE:
+                    self._page_memory_cache.popitem(last=False)
             
-            # URL для r.jina.ai API
-            jina_url = f"https://r.jina.ai/{quote(url)}"
+            return content
+        finally:
+            # При отмене загрузки ожидающие получают None, как при ошибке
+            if not future.done():
+                future.set_result(None)
+            del self._inflight[url_hash]
+    
+    async def _fetch_page_content(self, url, url_hash):
+        """
+        Загружает содержимое страницы из кэша или через r.jina.ai. Если r.jina.ai
+        не ответил за PAGE_FALLBACK_HEDGE_DELAY секунд или вернул ошибку, параллельно
+        запускается прямое скачивание страницы, используется первый успешный результат
+        
+        Args:
+            url (str): URL страницы
+            url_hash (str): Хеш URL для кэширования
             
-            # Ожидаем перед запросом в соответствии с ограничениями API
-            await self.rate_limiter.wait("jina")
+        Returns:
+            str: Содержимое страницы в формате Markdown или None в случае ошибки
+        """
+        try:
+            cache_path = os.path.join(DOCS_DIR, f"{url_hash}{PAGE_CACHE_EXTENSION}")
             
-            logger.info(f"Загрузка и преобразование страницы через r.jina.ai: {url}")
+            # Проверяем, есть ли страница в кэше. Чтение с диска выполняется
+            # в отдельном потоке, чтобы не блокировать цикл событий
+            cached_content = await asyncio.to_thread(read_cached_page, cache_path)
+            if cached_content is not None:
+                logger.info(f"Загрузка страницы из кэша: {url}")
+                return cached_content
             
-            # Устанавливаем таймаут и заголовки
-            timeout = aiohttp.ClientTimeout(total=30)
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml"
-            }
+            # Недавно не удалось загрузить страницу - не тратим лимит запросов повторно
+            if await asyncio.to_thread(has_recent_failure, url_hash):
+                logger.info(f"Пропуск страницы, недавно завершившейся ошибкой загрузки: {url}")
+                return None
             
-            async with session.get(jina_url, headers=headers, timeout=timeout) as response:
-                if response.status == HTTP_OK:
-                    # r.jina.ai возвращает содержимое сразу в формате Markdown
-                    markdown_content = await response.text()
-                    
-                    # Проверяем, что получен действительный Markdown-контент
-                    if markdown_content and len(markdown_content) > 100:  # Минимальная длина для валидного контента
-                        # Сохраняем Markdown в кэш
-                        with open(cache_path, "w", encoding="utf-8", errors="ignore") as f:
-                            f.write(markdown_content)
-                        
-                        return markdown_content
-                    else:
-                        logger.warning(f"Получен пустой или слишком короткий Markdown от r.jina.ai для {url}")
-                else:
-                    logger.error(f"Ошибка при обращении к r.jina.ai для {url}: {response.status}")
+            # HTTP-статусы неудачных загрузок (None - ошибка без ответа сервера)
+            jina_status = None
+            direct_status = None
+            
+            # Результат победившей загрузки. Загрузки пишут только в свои временные файлы,
+            # в кэш сохраняется лишь победитель после того, как проигравший завершен
+            winner = None
+            
+            # Запрос выполняется в соответствии с ограничениями API
+            async with self.rate_limiter.slot("jina", url):
+                jina_task = asyncio.create_task(self._fetch_via_jina(url))
+                direct_task = None
+                
+                try:
+                    done, _ = await asyncio.wait({jina_task}, timeout=PAGE_FALLBACK_HEDGE_DELAY)
+                    if done:
+                        page = jina_task.result()
+                        jina_status = page[1]
+                        if page[0]:
+                            winner = page
                     
-                    # Попробуем запасной вариант - прямое скачивание и извлечение текста
-                    try:
-                        logger.info(f"Попытка прямого скачивания страницы: {url}")
-                        # Повторно ожидаем, но уже не для jina
-                        await asyncio.sleep(1)
+                    if winner is None:
+                        # r.jina.ai вернул ошибку или отвечает слишком долго - запускаем
+                        # прямое скачивание, не отменяя еще не завершившийся запрос к r.jina.ai
+                        direct_task = asyncio.create_task(self._fetch_direct(url))
+                        pending = {direct_task} if done else {jina_task, direct_task}
                         
-                        async with session.get(url, headers=headers, timeout=timeout) as direct_response:
-                            if direct_response.status == HTTP_OK:
-                                html_content = await direct_response.text()
-                                
-                                # Извлекаем текст и конвертируем в простой Markdown
-                                from bs4 import BeautifulSoup
-                                soup = BeautifulSoup(html_content, 'html.parser')
+                        while pending and winner is None:
+                            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            for task in done:
+                                page = task.result()
+                                if task is jina_task:
+                                    jina_status = page[1]
+                                else:
+                                    direct_status = page[1]
                                 
-                                # Удаляем скрипты и стили
-                                for script_or_style in soup(["script", "style"]):
-                                    script_or_style.extract()
-                                
-                                # Получаем текст и форматируем его как простой Markdown
-                                paragraphs = []
-                                
-                                # Обрабатываем заголовки
-                                for i in range(1, 7):
-                                    for header in soup.find_all(f'h{i}'):
-                                        paragraphs.append(f"{'#' * i} {header.get_text().strip()}\n")
-                                
-                                # Обрабатываем параграфы
-                                for p in soup.find_all('p'):
-                                    paragraphs.append(f"{p.get_text().strip()}\n\n")
-                                
-                                # Обрабатываем списки
-                                for ul in soup.find_all('ul'):
-                                    for li in ul.find_all('li'):
-                                        paragraphs.append(f"* {li.get_text().strip()}\n")
-                                    paragraphs.append("\n")
-                                
-                                # Собираем Markdown
-                                markdown_content = "".join(paragraphs)
-                                
-                                # Сохраняем Markdown в кэш
-                                with open(cache_path, "w", encoding="utf-8", errors="ignore") as f:
-                                    f.write(markdown_content)
-                                
-                                return markdown_content
-                    except Exception as direct_error:
-                        logger.error(f"Ошибка при прямом скачивании страницы {url}: {direct_error}")
-                    
+                                if page[0] and winner is None:
+                                    winner = page
+                finally:
+                    # Проигравший запрос отменяется и дожидается завершения, чтобы его
+                    # временный файл был удален до сохранения победителя
+                    tasks = [task for task in (jina_task, direct_task) if task is not None]
+                    for task in tasks:
+                        task.cancel()
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
+                    for page in results:
+                        if isinstance(page, tuple) and page is not winner:
+                            await asyncio.to_thread(discard_page, page)
+            
+            if winner is not None:
+                await asyncio.to_thread(publish_page, cache_path, winner)
+                return winner[0]
+            
+            # Ответ самого сайта точнее описывает доступность страницы
+            failed_status = direct_status if direct_status is not None else jina_status
+            await asyncio.to_thread(record_failure, url_hash, failed_status)
             return None
         except Exception as e:
             logger.error(f"Ошибка при загрузке страницы {url}: {e}")
+            await asyncio.to_thread(record_failure, url_hash, None)
             return None
     
+    async def _fetch_via_jina(self, url):
+        """
+        Загружает страницу через r.jina.ai, который возвращает содержимое сразу в формате Markdown.
+        Содержимое записывается во временный файл, в кэш его переносит publish_page
+        
+        Args:
+            url (str): URL страницы
+            
+        Returns:
+            tuple: (содержимое страницы или None, HTTP-статус или None при ошибке без ответа,
+                путь к временному файлу или None, хеш содержимого или None)
+        """
+        # URL для r.jina.ai API
+        jina_url = self._JINA_READER_URL + quote(url)
+        
+        logger.info(f"Загрузка и преобразование страницы через r.jina.ai: {url}")
+        
+        try:
+            async with self.session.get(jina_url, headers=self._PAGE_HEADERS, timeout=self._PAGE_TIMEOUT) as response:
+                if response.status != HTTP_OK:
+                    logger.error(f"Ошибка при обращении к r.jina.ai для {url}: {response.status}")
+                    return None, response.status, None, None
+                
+                # Содержимое записывается во временный файл по частям по мере загрузки
+                streamed = await self._stream_to_temp_file(response)
+                
+                # Проверяем, что получен действительный Markdown-контент
+                if streamed is None or not streamed[0]:
+                    if streamed is not None:
+                        discard_page((None, None, streamed[1], None))
+                    logger.warning(f"Получен пустой или слишком короткий Markdown от r.jina.ai для {url}")
+                    return None, response.status, None, None
+                
+                markdown_content, tmp_path, content_hash = streamed
+                return markdown_content, response.status, tmp_path, content_hash
+        except Exception as e:
+            logger.error(f"Ошибка при обращении к r.jina.ai для {url}: {e}")
+            return None, None, None, None
+    
+    async def _fetch_direct(self, url):
+        """
+        Запасной вариант - прямое скачивание страницы и извлечение текста.
+        В кэш результат сохраняет publish_page, если эта загрузка победила
+        
+        Args:
+            url (str): URL страницы
+            
+        Returns:
+            tuple: (содержимое страницы или None, HTTP-статус или None при ошибке без ответа, None, None)
+        """
+        logger.info(f"Попытка прямого скачивания страницы: {url}")
+        
+        try:
+            async with self.session.get(url, headers=self._PAGE_HEADERS, timeout=self._PAGE_TIMEOUT) as direct_response:
+                if direct_response.status != HTTP_OK:
+                    return None, direct_response.status, None, None
+                
+                html_content = await direct_response.text()
+                
+                # Извлекаем текст и конвертируем в простой Markdown.
+                # Разбор HTML выполняется в отдельном потоке, не блокируя цикл событий
+                markdown_content = await asyncio.to_thread(html_to_markdown, html_content)
+                if not markdown_content:
+                    return None, direct_response.status, None, None
+                
+                return markdown_content, direct_response.status, None, None
+        except Exception as direct_error:
+            logger.error(f"Ошибка при прямом скачивании страницы {url}: {direct_error}")
+            return None, None, None, None
+    
+    async def _handle_query(self, query, max_results, format):
+        """
+        Выполняет поиск по одному поисковому запросу
+        
+        Args:
+            query (str): Поисковый запрос
+            max_results (int): Максимальное количество результатов
+            format (str): Формат результатов поиска (json, html)
+            
+        Returns:
+            list: Список результатов поиска или None, если поиск завершился ошибкой
+        """
+        # На этом этапе мы только собираем результаты поиска без скрапинга
+        # Скрапинг будет выполнен позже только для топ-5 отранжированных результатов
+        return await self.search_topic(query, max_results=max_results, format=format)
+    
+    async def _handle_subtopic(self, subtopic, search_queries, max_results, format):
+        """
+        Выполняет поиск по всем поисковым запросам подзапроса параллельно
+        
+        Args:
+            subtopic (str): Подзапрос
+            search_queries (list): Список поисковых запросов подзапроса
+            max_results (int): Максимальное количество результатов для каждого запроса
+            format (str): Формат результатов поиска (json, html)
+            
+        Returns:
+            tuple: Результаты поиска по всем запросам в порядке запросов и
+                   количество запросов, завершившихся ошибкой
+        """
+        logger.info(f"Обработка подзапроса: {subtopic}")
+        
+        all_search_results = await asyncio.gather(
+            *(self._handle_query(query, max_results, format) for query in search_queries)
+        )
+        
+        subtopic_results = []
+        failed_queries = 0
+        for search_results in all_search_results:
+            if search_results is None:
+                failed_queries += 1
+            else:
+                subtopic_results.extend(search_results)
+        
+        return subtopic_results, failed_queries
+    
     async def process_search_queries(self, search_queries_dict, max_results_per_query=10, max_pages_per_query=3, format="json"):
         """
-        Обрабатывает поисковые запросы и собирает результаты
+        Обрабатывает поисковые запросы и собирает результаты. Запросы всех подзапросов
+        выполняются параллельно, темп обращений к поисковому сервису задает RateLimiter.
         
         Args:
             search_queries_dict (dict): Словарь с подзапросами и поисковыми запросами
@@ -198,35 +760,27 @@ class SearchEngine:
             format (str): Формат результатов поиска (json, html)
             
         Returns:
-            dict: Словарь с результатами поиска
+            tuple: Словарь с результатами поиска и количество поисковых запросов,
+                   завершившихся ошибкой
         """
-        results = {}
+        # gather возвращает результаты в порядке подзапросов
+        all_subtopic_results = await asyncio.gather(*(
+            self._handle_subtopic(subtopic, search_queries, max_results_per_query, format)
+            for subtopic, search_queries in search_queries_dict.items()
+        ))
         
-        async with aiohttp.ClientSession() as session:
-            # Обрабатываем каждый подзапрос
-            for subtopic, search_queries in search_queries_dict.items():
-                logger.info(f"Обработка подзапроса: {subtopic}")
-                
-                subtopic_results = []
-                
-                # Для каждого поискового запроса в подзапросе
-                for query in search_queries:
-                    # Выполняем поиск
-                    search_results = await self.search_topic(query, session, max_results=max_results_per_query, format=format)
-                    
-                    # На этом этапе мы только собираем результаты поиска без скрапинга
-                    # Скрапинг будет выполнен позже только для топ-5 отранжированных результатов
-                    for result in search_results:
-                        subtopic_results.append(result)
-                
-                # Сохраняем результаты для подзапроса
-                results[subtopic] = subtopic_results
+        search_results = {}
+        failed_queries = 0
+        for subtopic, (subtopic_results, subtopic_failed) in zip(search_queries_dict.keys(), all_subtopic_results):
+            search_results[subtopic] = subtopic_results
+            failed_queries += subtopic_failed
         
-        return results
+        return search_results, failed_queries
     
     async def scrape_ranked_results(self, ranked_results):
         """
-        Скрапит содержимое страниц для отранжированных результатов поиска
+        Скрапит содержимое страниц для отранжированных результатов поиска.
+        Страницы загружаются параллельно
         
         Args:
             ranked_results (list): Список отранжированных результатов поиска
@@ -234,33 +788,64 @@ class SearchEngine:
         Returns:
             list: Список отранжированных результатов с добавленным содержимым
         """
+        # Один и тот же URL может прийти из разных подзапросов: оставляем первый
+        # (с более высоким рейтингом), чтобы не загружать и не сохранять страницу дважды
+        seen_hashes = set()
+        unique_results = []
+        for result in ranked_results:
+            url = result.get("url")
+            if url:
+                url_hash = generate_hash(url)
+                if url_hash in seen_hashes:
+                    continue
+                seen_hashes.add(url_hash)
+            unique_results.append(result)
+        
+        if len(unique_results) < len(ranked_results):
+            logger.info(f"Пропущено {len(ranked_results) - len(unique_results)} повторяющихся URL")
+        ranked_results = unique_results
+        
         print(f"\nПолучение содержимого для {len(ranked_results)} лучших результатов...")
         
+        total = len(ranked_results)
+        completed = 0
+        
+        async def fetch_result_content(result):
+            nonlocal completed
+            url = result.get("url")
+            if not url:
+                return None
+            
+            # Получаем содержимое страницы
+            content = await self.fetch_page_content(url)
+            
+            completed += 1
+            print(f"[{completed}/{total}] Загружена страница: {result.get('title', '')[:50]}...", end="\r")
+            return content
+        
+        # Страницы загружаются параллельно, темп и количество одновременных
+        # запросов к r.jina.ai ограничивает RateLimiter. gather сохраняет порядок результатов
+        contents = await asyncio.gather(*(fetch_result_content(result) for result in ranked_results))
+        
         results_with_content = []
         
-        async with aiohttp.ClientSession() as session:
-            for i, result in enumerate(ranked_results, 1):
-                url = result.get("url")
-                title = result.get("title", "")
-                
-                if url:
-                    print(f"[{i}/{len(ranked_results)}] Загрузка страницы: {title[:50]}...", end="\r")
-                    
-                    # Получаем содержимое страницы
-                    content = await self.fetch_page_content(url, session)
-                    
-                    if content:
-                        # Добавляем содержимое к результату
-                        result_with_content = result.copy()
-                        result_with_content["content"] = content
-                        results_with_content.append(result_with_content)
-                    else:
-                        logger.warning(f"Не удалось получить содержимое для URL: {url}")
+        for result, content in zip(ranked_results, contents):
+            url = result.get("url")
+            if not url:
+                continue
+            
+            if content:
+                # Добавляем содержимое к результату
+                result_with_content = result.copy()
+                result_with_content["content"] = content
+                results_with_content.append(result_with_content)
+            else:
+                logger.warning(f"Не удалось получить содержимое для URL: {url}")
         
         print(f"\nПолучено содержимое для {len(results_with_content)} из {len(ranked_results)} результатов.")
         return results_with_content
         
-    def save_search_results_to_json(self, results, theme_name, cache_dir="cache"):
+    def save_search_results_to_json(self, results, theme_name, cache_dir="cache", search_queries_dict=None):
         """
         Сохраняет результаты поиска в JSON файл
         
@@ -268,6 +853,8 @@ class SearchEngine:
             results (dict): Словарь с результатами поиска
             theme_name (str): Название темы (для имени файла)
             cache_dir (str): Директория кэша
+            search_queries_dict (dict, optional): Поисковые запросы, по которым получены результаты;
+                их хеш сохраняется рядом с результатами для проверки при загрузке
             
         Returns:
             str: Путь к созданному файлу или None в случае ошибки
@@ -280,22 +867,27 @@ class SearchEngine:
             # Формируем имя файла
             file_path = os.path.join(search_results_dir, f"search_results.json")
             
-            # Подготавливаем данные для сохранения - удаляем большие поля
-            filtered_results = {}
+            # Сохраняем данные в JSON формате по одному подзапросу, не собирая
+            # копию всех результатов в памяти. Большие поля (контент) не сохраняются
+            with open(file_path, "wb") as f:
+                f.write(b"{")
+                for i, (subtopic, subtopic_results) in enumerate(results.items()):
+                    if i:
+                        f.write(b",")
+                    f.write(b"\n")
+                    f.write(orjson.dumps(str(subtopic)))
+                    f.write(b": ")
+                    write_json_array(f, (
+                        {k: v for k, v in result.items() if k != "content"}
+                        for result in subtopic_results
+                    ))
+                f.write(b"\n}")
             
-            for subtopic, subtopic_results in results.items():
-                filtered_subtopic_results = []
-                
-                for result in subtopic_results:
-                    # Создаем копию результата без контента
-                    filtered_result = {k: v for k, v in result.items() if k != "content"}
-                    filtered_subtopic_results.append(filtered_result)
-                
-                filtered_results[subtopic] = filtered_subtopic_results
-            
-            # Сохраняем данные в JSON формате
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(filtered_results, f, ensure_ascii=False, indent=4)
+            # Хеш записывается после результатов: если запись результатов не удалась,
+            # старый хеш не совпадет с новыми запросами и файл не будет переиспользован
+            if search_queries_dict is not None:
+                with open(os.path.join(search_results_dir, "search_results.hash"), "w", encoding="utf-8") as f:
+                    f.write(hash_search_queries(search_queries_dict))
             
             logger.info(f"Результаты поиска сохранены в файл: {file_path}")
             return file_path
@@ -303,9 +895,10 @@ class SearchEngine:
             logger.error(f"Ошибка при сохранении результатов поиска: {e}")
             return None
     
-    def save_scraped_content(self, ranked_results_with_content, theme_name, cache_dir="cache"):
+    async def save_scraped_content(self, ranked_results_with_content, theme_name, cache_dir="cache"):
         """
-        Сохраняет скрапленное содержимое страниц в отдельные файлы
+        Сохраняет скрапленное содержимое страниц в отдельные файлы.
+        Файлы записываются параллельно в пуле потоков, не блокируя цикл событий
         
         Args:
             ranked_results_with_content (list): Список отранжированных результатов с содержимым
@@ -318,9 +911,10 @@ class SearchEngine:
         try:
             # Создаем директорию для документов по теме
             theme_docs_dir = os.path.join(DOCS_DIR, theme_name)
-            os.makedirs(theme_docs_dir, exist_ok=True)
+            await asyncio.to_thread(os.makedirs, theme_docs_dir, exist_ok=True)
             
-            saved_count = 0
+            saved_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            writes = []
             
             for result in ranked_results_with_content:
                 url = result.get("url", "")
@@ -339,16 +933,16 @@ class SearchEngine:
                     metadata = f"""---
 title: {title}
 url: {url}
-date: {time.strftime("%Y-%m-%d %H:%M:%S")}
+date: {saved_at}
 ---
 
 """
                     
                     # Сохраняем содержимое с метаданными
-                    with open(file_path, "w", encoding="utf-8", errors="ignore") as f:
-                        f.write(metadata + content)
-                    
-                    saved_count += 1
+                    writes.append(asyncio.to_thread(write_document, file_path, metadata, content))
+            
+            await asyncio.gather(*writes)
+            saved_count = len(writes)
             
             logger.info(f"Сохранено {saved_count} документов по теме '{theme_name}' в {theme_docs_dir}")
             return True
@@ -357,28 +951,109 @@ date: {time.strftime("%Y-%m-%d %H:%M:%S")}
             return False
 
 
-async def run_search(search_queries_dict, theme_name):
+def get_search_engine():
+    """
+    Возвращает общий экземпляр поисковика, создавая его при первом вызове
+    
+    Returns:
+        SearchEngine: Экземпляр поисковика
+    """
+    global _search_engine
+    if _search_engine is None:
+        _search_engine = SearchEngine()
+    return _search_engine
+
+
+async def close_search_engine():
+    """
+    Закрывает HTTP-сессию общего экземпляра поисковика
+    """
+    if _search_engine is not None:
+        await _search_engine.close()
+
+
+def load_cached_search_results(search_queries_dict, theme_name, cache_dir="cache"):
+    """
+    Загружает сохраненные результаты поиска темы, если они не старше
+    SEARCH_RESULTS_CACHE_TTL_SECONDS и получены для тех же подзапросов и поисковых запросов
+    
+    Args:
+        search_queries_dict (dict): Словарь с подзапросами и поисковыми запросами
+        theme_name (str): Название темы
+        cache_dir (str): Директория кэша
+        
+    Returns:
+        dict: Словарь с результатами поиска или None, если сохраненных результатов нет или они устарели
+    """
+    if SEARCH_RESULTS_CACHE_TTL_SECONDS <= 0:
+        return None
+    
+    file_path = os.path.join(cache_dir, theme_name, "search_results.json")
+    hash_path = os.path.join(cache_dir, theme_name, "search_results.hash")
+    
+    try:
+        if os.stat(file_path).st_mtime < time.time() - SEARCH_RESULTS_CACHE_TTL_SECONDS:
+            return None
+        
+        # Поисковые запросы могли измениться при тех же подзапросах (новый промпт
+        # или модель планировщика) - тогда поиск выполняется заново
+        with open(hash_path, "r", encoding="utf-8") as f:
+            if f.read().strip() != hash_search_queries(search_queries_dict):
+                return None
+        
+        with open(file_path, "rb") as f:
+            search_results = orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать сохраненные результаты поиска {file_path}: {e}")
+        return None
+    
+    # Подзапросы могли измениться после перепланирования - тогда поиск выполняется заново
+    if set(search_results) != {str(subtopic) for subtopic in search_queries_dict}:
+        return None
+    
+    # Пустые результаты по всем подзапросам - признак сбоя поиска, а не ответ, который стоит переиспользовать
+    if not any(search_results.values()):
+        return None
+    
+    return search_results
+
+async def run_search(search_queries_dict, theme_name, force_refresh=False):
     """
-    Выполняет поиск и обработку результатов
+    Выполняет поиск и обработку результатов. Недавние результаты поиска
+    той же темы загружаются из кэша без запросов к поисковому сервису
     
     Args:
         search_queries_dict (dict): Словарь с подзапросами и поисковыми запросами
         theme_name (str): Название темы для кэширования
+        force_refresh (bool): Выполнить поиск заново, не используя сохраненные результаты
         
     Returns:
         dict: Словарь с результатами поиска
     """
-    search_engine = SearchEngine()
+    if not force_refresh:
+        search_results = await asyncio.to_thread(load_cached_search_results, search_queries_dict, theme_name)
+        if search_results is not None:
+            logger.info(f"Загрузка результатов поиска из кэша для темы: {theme_name}")
+            return search_results
+    
+    search_engine = get_search_engine()
     
     # Выполняем поиск по всем запросам и получаем результаты
-    search_results = await search_engine.process_search_queries(
+    search_results, failed_queries = await search_engine.process_search_queries(
         search_queries_dict,
         max_results_per_query=25,
         max_pages_per_query=1
     )
     
-    # Сохраняем результаты поиска в JSON
-    search_engine.save_search_results_to_json(search_results, theme_name)
+    # Неполные результаты не сохраняются, иначе сбой поиска переиспользовался бы весь срок жизни кэша
+    if failed_queries:
+        logger.warning(f"Результаты поиска для темы {theme_name} не сохранены: {failed_queries} запросов завершились ошибкой")
+        return search_results
+    
+    # Сохраняем результаты поиска в JSON в отдельном потоке, не блокируя цикл событий
+    await asyncio.to_thread(search_engine.save_search_results_to_json, search_results, theme_name, search_queries_dict=search_queries_dict)
     
     return search_results
 
@@ -394,12 +1069,12 @@ async def scrape_top_ranked_results(ranked_results, theme_name):
     Returns:
         list: Список отранжированных результатов с добавленным содержимым
     """
-    search_engine = SearchEngine()
+    search_engine = get_search_engine()
     
     # Скрапим содержимое для отранжированных результатов
     ranked_results_with_content = await search_engine.scrape_ranked_results(ranked_results)
     
     # Сохраняем скрапленное содержимое
-    search_engine.save_scraped_content(ranked_results_with_content, theme_name)
+    await search_engine.save_scraped_content(ranked_results_with_content, theme_name)
     
     return ranked_results_with_content 
\ No newline at end of file
@@ -3,10 +3,12 @@
 """
 import os
 import json
+import errno
+import time
 import shutil
 from datetime import datetime, timedelta
 
-from src.core.utils import logger, generate_hash, sanitize_filename, create_directory
+from src.core.utils import logger, generate_hash, sanitize_filename, create_directory, ensure_directory, scandir_walk
 from src.core.config import CACHE_DIR, DOCS_DIR, SUMMARIES_DIR
 from src.core.constants import CACHE_VERSION
 
@@ -69,35 +71,46 @@ class CacheManager:
             int: Количество удаленных файлов/директорий
         """
         total_removed = 0
-        now = datetime.now()
-        max_age = timedelta(days=30)
+        
+        # Файлы, измененные раньше этого момента, считаются устаревшими
+        cutoff = time.time() - timedelta(days=30).total_seconds()
+        
+        # Поддиректории в порядке обхода сверху вниз. Директории верхнего уровня
+        # (docs, summaries и т.д.) не удаляются, даже если они опустели
+        visited_dirs = []
         
         try:
             # Проверяем все файлы в директории кэша
-            for root, dirs, files in os.walk(self.cache_dir):
+            for root, dirs, files in scandir_walk(self.cache_dir):
+                if root != self.cache_dir:
+                    visited_dirs.extend(dir_entry.path for dir_entry in dirs)
+                
                 for file in files:
-                    file_path = os.path.join(root, file)
-                    file_stat = os.stat(file_path)
-                    file_time = datetime.fromtimestamp(file_stat.st_mtime)
+                    file_path = file.path
                     
                     # Если файл старше максимального возраста, удаляем его
-                    if now - file_time > max_age:
+                    if file.stat().st_mtime < cutoff:
                         try:
                             os.remove(file_path)
                             total_removed += 1
                             logger.debug(f"Удален устаревший файл кэша: {file_path}")
                         except Exception as e:
                             logger.error(f"Ошибка при удалении файла {file_path}: {e}")
-                
-                # Удаляем пустые директории
-                for dir_name in dirs:
-                    dir_path = os.path.join(root, dir_name)
-                    if not os.listdir(dir_path):
-                        try:
-                            os.rmdir(dir_path)
-                            logger.debug(f"Удалена пустая директория: {dir_path}")
-                        except Exception as e:
-                            logger.error(f"Ошибка при удалении директории {dir_path}: {e}")
+            
+            # Удаляем пустые директории после удаления файлов. В обратном порядке обхода
+            # вложенные директории удаляются раньше родительских, поэтому удаляются и
+            # директории, опустевшие после удаления вложенных. Непустую директорию
+            # os.rmdir не удаляет, отдельная проверка содержимого не нужна
+            for dir_path in reversed(visited_dirs):
+                try:
+                    os.rmdir(dir_path)
+                    logger.debug(f"Удалена пустая директория: {dir_path}")
+                except OSError as e:
+                    if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                        logger.error(f"Ошибка при удалении директории {dir_path}: {e}")
+            
+            # Сбрасываем кэш созданных директорий - часть из них только что удалена
+            ensure_directory.cache_clear()
             
             logger.info(f"Очистка кэша завершена. Удалено {total_removed} устаревших файлов.")
             return total_removed
@@ -121,9 +134,12 @@ class CacheManager:
             "categories": {}
         }
         
+        # Время последнего изменения в секундах, в datetime преобразуется один раз в конце
+        last_modified = None
+        
         try:
             # Собираем информацию о всех файлах в кэше
-            for root, _, files in os.walk(self.cache_dir):
+            for root, _, files in scandir_walk(self.cache_dir):
                 category = os.path.basename(root)
                 
                 if category not in info["categories"]:
@@ -133,23 +149,24 @@ class CacheManager:
                     }
                 
                 for file in files:
-                    file_path = os.path.join(root, file)
-                    file_stat = os.stat(file_path)
+                    file_stat = file.stat()
                     file_size = file_stat.st_size
-                    file_time = datetime.fromtimestamp(file_stat.st_mtime)
                     
                     # Обновляем общую информацию
                     info["total_size_bytes"] += file_size
                     info["total_files"] += 1
                     
                     # Обновляем информацию о последнем изменении
-                    if info["last_modified"] is None or file_time > info["last_modified"]:
-                        info["last_modified"] = file_time
+                    if last_modified is None or file_stat.st_mtime > last_modified:
+                        last_modified = file_stat.st_mtime
                     
                     # Обновляем информацию о категории
                     info["categories"][category]["size_bytes"] += file_size
                     info["categories"][category]["files_count"] += 1
             
+            if last_modified is not None:
+                info["last_modified"] = datetime.fromtimestamp(last_modified)
+            
             # Преобразуем размеры в человекочитаемый формат
             info["total_size_human"] = self._bytes_to_human_readable(info["total_size_bytes"])
             
@@ -5,12 +5,117 @@ import os
 import json
 import shutil
 import zipfile
+import tarfile
+import zlib
 import glob
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from src.core.utils import logger, create_directory
+try:
+    import zstandard
+except ImportError:  # Без zstandard кэш экспортируется только в ZIP
+    zstandard = None
+
+from src.core.utils import logger, ensure_directory, scandir_walk
 from src.core.config import CACHE_DIR
 
+# Уровень сжатия архива экспорта: максимальное сжатие почти не уменьшает
+# размер архива, но заметно дольше
+EXPORT_COMPRESSION_LEVEL = 3
+
+# Расширение архива экспорта в формате tar, сжатого zstd
+TAR_ZST_EXTENSION = ".tar.zst"
+
+# Размер блока при чтении файлов для сравнения с архивом
+FILE_READ_CHUNK_SIZE = 64 * 1024
+
+# Директория кэша считается темой, если в ней есть один из этих файлов
+_THEME_FILES = frozenset({"request.md", "answer.md"})
+
+# Файлы в этих форматах уже сжаты и сохраняются в архив без повторного сжатия
+_PRECOMPRESSED_EXTENSIONS = frozenset({".zst", ".zip", ".gz", ".br", ".png", ".jpg", ".jpeg", ".webp"})
+
+def remove_path(path):
+    """
+    Удаляет файл или директорию со всем содержимым. Отсутствующий путь
+    не считается ошибкой, поэтому отдельная проверка существования не нужна
+    
+    Args:
+        path (str): Путь к файлу или директории
+        
+    Returns:
+        Exception: Ошибка удаления или None в случае успеха
+    """
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            logger.debug(f"Удалена директория: {path}")
+        else:
+            os.remove(path)
+            logger.debug(f"Удален файл: {path}")
+        return None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        return e
+
+def is_same_as_archived(path, info):
+    """
+    Проверяет, совпадает ли существующий файл с файлом в архиве: по размеру,
+    а при совпадении размера - по контрольной сумме CRC-32 из архива
+    
+    Args:
+        path (str): Путь к файлу на диске
+        info (zipfile.ZipInfo): Описание файла в архиве
+        
+    Returns:
+        bool: True, если файл уже распакован и не изменился
+    """
+    try:
+        if os.path.getsize(path) != info.file_size:
+            return False
+        
+        crc = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(FILE_READ_CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+        return crc == info.CRC
+    except OSError:
+        return False
+
+def iter_export_files(source_dir, base_len, exclude):
+    """
+    Перечисляет файлы для экспорта, пропуская исключенные и скрытые директории
+    
+    Args:
+        source_dir (str): Нормализованный путь к экспортируемой директории
+        base_len (int): Длина префикса пути, который отбрасывается в именах файлов архива
+        exclude (frozenset): Имена директорий, которые не нужно экспортировать
+        
+    Yields:
+        tuple: (путь к файлу, имя файла в архиве)
+    """
+    # Файлы отдаются по мере чтения директорий, тип записи известен без отдельного stat
+    for root, dirs, files in scandir_walk(source_dir):
+        # Исключенные и скрытые директории не обходятся
+        dirs[:] = [d for d in dirs if d.name not in exclude and not d.name.startswith(".")]
+        
+        for file in files:
+            if file.is_file():
+                yield file.path, file.path[base_len:]
+
+def is_safe_tar_member(member):
+    """
+    Проверяет, что элемент tar-архива - обычный файл или директория внутри целевой директории
+    
+    Args:
+        member (tarfile.TarInfo): Элемент архива
+        
+    Returns:
+        bool: True, если элемент можно распаковать
+    """
+    return (member.isfile() or member.isdir()) and not os.path.isabs(member.name) and ".." not in member.name.split("/")
+
 class FileSystemManager:
     """
     Класс для управления файловой системой проекта
@@ -23,19 +128,39 @@ class FileSystemManager:
             cache_dir (str, optional): Путь к директории кэша. По умолчанию используется CACHE_DIR из config.py
         """
         self.cache_dir = cache_dir or CACHE_DIR
-        create_directory(self.cache_dir)
+        
+        # Директория создается один раз за процесс, повторные экземпляры не обращаются к файловой системе
+        try:
+            ensure_directory(self.cache_dir)
+        except OSError as e:
+            logger.error(f"Ошибка при создании директории {self.cache_dir}: {e}")
+        
+        # Результат list_themes: (mtime директории кэша в нс, темы, остальные директории)
+        self._themes_cache = None
     
-    def export_cache(self, export_path=None, theme_name=None):
+    def export_cache(self, export_path=None, theme_name=None, exclude=frozenset(), fmt="zip"):
         """
-        Экспортирует кэш в ZIP-архив
+        Экспортирует кэш в ZIP-архив или в tar-архив, сжатый zstd. Скрытые служебные
+        директории (например, записи о неудачных загрузках) в архив не попадают
         
         Args:
             export_path (str, optional): Путь для сохранения архива. По умолчанию текущая директория.
             theme_name (str, optional): Название темы для экспорта. Если не указано, экспортируется весь кэш.
+            exclude (frozenset, optional): Имена директорий, которые не нужно экспортировать
+            fmt (str, optional): Формат архива: "zip" (открывается любыми программами) или
+                "tar.zst" (меньше и быстрее для текстового кэша, требует zstandard)
             
         Returns:
             str: Путь к созданному архиву или None в случае ошибки
         """
+        if fmt not in ("zip", "tar.zst"):
+            logger.error(f"Неизвестный формат архива: {fmt}")
+            return None
+        
+        if fmt == "tar.zst" and zstandard is None:
+            logger.error("Для экспорта в формате tar.zst нужен пакет zstandard")
+            return None
+        
         try:
             # Если путь для экспорта не указан, используем текущую директорию
             if not export_path:
@@ -45,7 +170,7 @@ class FileSystemManager:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
             if theme_name:
-                archive_name = f"cache_{theme_name}_{timestamp}.zip"
+                archive_name = f"cache_{theme_name}_{timestamp}.{fmt}"
                 # Проверяем существование директории темы
                 theme_dir = os.path.join(self.cache_dir, theme_name)
                 if not os.path.exists(theme_dir):
@@ -53,20 +178,35 @@ class FileSystemManager:
                     return None
                 source_dir = theme_dir
             else:
-                archive_name = f"cache_full_{timestamp}.zip"
+                archive_name = f"cache_full_{timestamp}.{fmt}"
                 source_dir = self.cache_dir
             
             # Путь к архиву
             archive_path = os.path.join(export_path, archive_name)
             
+            # Пути в архиве задаются относительно этой директории. Все пути обхода начинаются
+            # с нее, поэтому относительный путь получается срезом, без os.path.relpath для каждого файла
+            source_dir = os.path.normpath(source_dir)
+            base_dir = source_dir if theme_name else os.path.dirname(source_dir)
+            base_len = len(base_dir) + 1 if base_dir else 0
+            
+            export_files = iter_export_files(source_dir, base_len, exclude)
+            
             # Создаем архив
-            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(source_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # Получаем относительный путь для сохранения структуры директорий
-                        arcname = os.path.relpath(file_path, source_dir if theme_name else os.path.dirname(self.cache_dir))
-                        zipf.write(file_path, arcname)
+            if fmt == "tar.zst":
+                # tar записывается потоком прямо в компрессор, без промежуточного файла на диске
+                with open(archive_path, "wb") as f, \
+                        zstandard.ZstdCompressor(level=EXPORT_COMPRESSION_LEVEL).stream_writer(f) as writer, \
+                        tarfile.open(fileobj=writer, mode="w|") as tar:
+                    for file_path, arcname in export_files:
+                        tar.add(file_path, arcname)
+            else:
+                with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=EXPORT_COMPRESSION_LEVEL) as zipf:
+                    for file_path, arcname in export_files:
+                        if os.path.splitext(file_path)[1].lower() in _PRECOMPRESSED_EXTENSIONS:
+                            zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+                        else:
+                            zipf.write(file_path, arcname)
             
             logger.info(f"Кэш успешно экспортирован в архив: {archive_path}")
             return archive_path
@@ -77,18 +217,24 @@ class FileSystemManager:
     
     def import_cache(self, archive_path, theme_name=None):
         """
-        Импортирует кэш из ZIP-архива
+        Импортирует кэш из ZIP-архива или tar-архива, сжатого zstd (.tar.zst)
         
         Args:
-            archive_path (str): Путь к ZIP-архиву
+            archive_path (str): Путь к архиву
             theme_name (str, optional): Название темы для импорта. Если не указано, импортируется весь кэш.
             
         Returns:
             bool: True в случае успеха, False в случае ошибки
         """
+        if archive_path.endswith(TAR_ZST_EXTENSION):
+            return self._import_tar_zst(archive_path, theme_name)
+        
         try:
-            # Проверяем существование архива
-            if not os.path.exists(archive_path):
+            # Открываем архив: отдельная проверка существования не нужна,
+            # отсутствие файла обнаруживается при открытии
+            try:
+                zipf = zipfile.ZipFile(archive_path, 'r')
+            except FileNotFoundError:
                 logger.error(f"Архив не найден: {archive_path}")
                 return False
             
@@ -98,12 +244,30 @@ class FileSystemManager:
             else:
                 target_dir = self.cache_dir
             
-            # Создаем директорию, если она не существует
-            create_directory(target_dir)
+            target_root = os.path.realpath(target_dir)
+            skipped = 0
+            
+            # Извлекаем архив. Файлы, которые уже есть на диске с тем же содержимым,
+            # не распаковываются повторно - повторный импорт того же архива почти ничего не пишет
+            with zipf:
+                # Создаем директорию, если она не существует (один раз за процесс)
+                ensure_directory(target_dir)
+                
+                for info in zipf.infolist():
+                    if not info.is_dir():
+                        # Небезопасные пути (абсолютные, с "..") проверяются и исправляются в extract
+                        dst = os.path.realpath(os.path.join(target_root, info.filename))
+                        if dst.startswith(target_root + os.sep) and is_same_as_archived(dst, info):
+                            skipped += 1
+                            continue
+                    
+                    zipf.extract(info, target_dir)
+            
+            if skipped:
+                logger.info(f"Пропущено {skipped} файлов, уже совпадающих с архивом")
             
-            # Извлекаем архив
-            with zipfile.ZipFile(archive_path, 'r') as zipf:
-                zipf.extractall(target_dir)
+            # Импорт мог добавить файлы запроса/ответа в существующие директории
+            self._themes_cache = None
             
             logger.info(f"Кэш успешно импортирован из архива: {archive_path}")
             return True
@@ -112,6 +276,51 @@ class FileSystemManager:
             logger.error(f"Ошибка при импорте кэша: {e}")
             return False
     
+    def _import_tar_zst(self, archive_path, theme_name=None):
+        """
+        Импортирует кэш из tar-архива, сжатого zstd. Архив распаковывается потоком
+        
+        Args:
+            archive_path (str): Путь к архиву .tar.zst
+            theme_name (str, optional): Название темы для импорта. Если не указано, импортируется весь кэш.
+            
+        Returns:
+            bool: True в случае успеха, False в случае ошибки
+        """
+        if zstandard is None:
+            logger.error("Для импорта архива tar.zst нужен пакет zstandard")
+            return False
+        
+        target_dir = os.path.join(self.cache_dir, theme_name) if theme_name else self.cache_dir
+        
+        try:
+            with open(archive_path, "rb") as f, \
+                    zstandard.ZstdDecompressor().stream_reader(f) as reader, \
+                    tarfile.open(fileobj=reader, mode="r|") as tar:
+                # Создаем директорию, если она не существует (один раз за процесс)
+                ensure_directory(target_dir)
+                
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(target_dir, filter="data")
+                else:
+                    # Python без фильтров распаковки: пропускаем ссылки и небезопасные пути
+                    for member in tar:
+                        if is_safe_tar_member(member):
+                            tar.extract(member, target_dir)
+            
+            # Импорт мог добавить файлы запроса/ответа в существующие директории
+            self._themes_cache = None
+            
+            logger.info(f"Кэш успешно импортирован из архива: {archive_path}")
+            return True
+            
+        except FileNotFoundError:
+            logger.error(f"Архив не найден: {archive_path}")
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при импорте кэша: {e}")
+            return False
+    
     def list_themes(self):
         """
         Возвращает список тем в кэше
@@ -120,33 +329,66 @@ class FileSystemManager:
             list: Список названий тем
         """
         try:
-            themes = []
+            # Время изменения директории кэша меняется при создании и удалении тем.
+            # Если оно не изменилось, повторно проверяются только директории, которые
+            # еще не были темами: в них мог появиться файл запроса или ответа
+            cache_mtime = os.stat(self.cache_dir).st_mtime_ns
+            if self._themes_cache is not None and self._themes_cache[0] == cache_mtime:
+                _, themes, other_dirs = self._themes_cache
+                new_themes = [name for name in other_dirs if self._has_theme_files(os.path.join(self.cache_dir, name))]
+                if new_themes:
+                    themes = themes + tuple(new_themes)
+                    other_dirs = tuple(name for name in other_dirs if name not in new_themes)
+                    self._themes_cache = (cache_mtime, themes, other_dirs)
+                return list(themes)
             
-            # Получаем список директорий в кэше
-            for item in os.listdir(self.cache_dir):
-                item_path = os.path.join(self.cache_dir, item)
-                
-                # Если это директория и содержит answers.md, считаем её темой
-                if os.path.isdir(item_path):
-                    # Проверяем наличие файлов запроса/ответа
-                    request_path = os.path.join(item_path, "request.md")
-                    answer_path = os.path.join(item_path, "answer.md")
+            themes = []
+            other_dirs = []
+            
+            # Получаем список директорий в кэше. Тип записи os.scandir известен
+            # из чтения директории, без отдельного stat для каждой записи
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
                     
-                    if os.path.exists(request_path) or os.path.exists(answer_path):
-                        themes.append(item)
+                    # Если директория содержит файл запроса или ответа, считаем её темой
+                    if self._has_theme_files(entry.path):
+                        themes.append(entry.name)
+                    else:
+                        other_dirs.append(entry.name)
             
+            self._themes_cache = (cache_mtime, tuple(themes), tuple(other_dirs))
             return themes
             
         except Exception as e:
             logger.error(f"Ошибка при получении списка тем: {e}")
             return []
     
-    def get_theme_info(self, theme_name):
+    def _has_theme_files(self, directory):
+        """
+        Проверяет, есть ли в директории файл запроса или ответа темы
+        
+        Args:
+            directory (str): Путь к директории
+            
+        Returns:
+            bool: True, если найден request.md или answer.md
+        """
+        try:
+            with os.scandir(directory) as entries:
+                return any(entry.name in _THEME_FILES for entry in entries)
+        except FileNotFoundError:
+            return False
+    
+    def get_theme_info(self, theme_name, load_request=True):
         """
         Возвращает информацию о конкретной теме
         
         Args:
             theme_name (str): Название темы
+            load_request (bool): Читать текст запроса из request.md. Для списка тем,
+                где нужны только название, дата и количество файлов, чтение можно пропустить
             
         Returns:
             dict: Информация о теме (запрос, дата создания, и т.д.) или None в случае ошибки
@@ -154,8 +396,10 @@ class FileSystemManager:
         try:
             theme_dir = os.path.join(self.cache_dir, theme_name)
             
-            # Проверяем существование директории темы
-            if not os.path.exists(theme_dir):
+            # Проверяем существование директории темы и получаем дату ее создания одним stat
+            try:
+                theme_stat = os.stat(theme_dir)
+            except FileNotFoundError:
                 logger.error(f"Директория темы не существует: {theme_dir}")
                 return None
             
@@ -169,24 +413,28 @@ class FileSystemManager:
                 "files_count": 0
             }
             
-            # Получаем дату создания директории
-            theme_stat = os.stat(theme_dir)
             info["created"] = datetime.fromtimestamp(theme_stat.st_ctime)
             
+            # Подсчитываем количество файлов за один обход, запоминая имена файлов
+            # верхнего уровня для проверки наличия запроса/ответа
+            theme_files = None
+            for root, _, files in scandir_walk(theme_dir):
+                if theme_files is None:
+                    theme_files = {file.name for file in files}
+                info["files_count"] += len(files)
+            theme_files = theme_files or set()
+            
             # Проверяем наличие файлов запроса/ответа
             request_path = os.path.join(theme_dir, "request.md")
-            answer_path = os.path.join(theme_dir, "answer.md")
             
-            if os.path.exists(request_path):
+            if load_request and "request.md" in theme_files:
                 with open(request_path, "r", encoding="utf-8") as f:
                     content = f.read()
                     # Извлекаем запрос из файла (убираем заголовок)
-                    if "# Запрос" in content:
-                        info["request"] = content.split("# Запрос")[1].strip()
-                    else:
-                        info["request"] = content.strip()
+                    _, marker, request = content.partition("# Запрос")
+                    info["request"] = (request if marker else content).strip()
             
-            if os.path.exists(answer_path):
+            if "answer.md" in theme_files:
                 info["answer"] = True
             
             # Проверяем наличие подзапросов
@@ -194,14 +442,13 @@ class FileSystemManager:
             if os.path.exists(subtopics_path):
                 info["has_subtopics"] = True
             
-            # Проверяем наличие саммари
+            # Проверяем наличие саммари: достаточно первой записи директории
             summaries_dir = os.path.join(self.cache_dir, "summaries", theme_name)
-            if os.path.exists(summaries_dir) and os.listdir(summaries_dir):
-                info["has_summaries"] = True
-            
-            # Подсчитываем количество файлов
-            for root, _, files in os.walk(theme_dir):
-                info["files_count"] += len(files)
+            try:
+                with os.scandir(summaries_dir) as entries:
+                    info["has_summaries"] = next(entries, None) is not None
+            except FileNotFoundError:
+                pass
             
             return info
             
@@ -232,15 +479,22 @@ class FileSystemManager:
                 os.path.join(self.cache_dir, f"subtopics_{theme_name}.md")  # Файл подзапросов
             ]
             
-            # Удаляем все существующие файлы и директории
-            for path in paths_to_check:
-                if os.path.exists(path):
-                    if os.path.isdir(path):
-                        shutil.rmtree(path)
-                        logger.debug(f"Удалена директория: {path}")
-                    else:
-                        os.remove(path)
-                        logger.debug(f"Удален файл: {path}")
+            # Удаляем все файлы и директории. Пути не пересекаются, а удаление
+            # в основном ожидает файловую систему, поэтому выполняется параллельно.
+            # Существование не проверяется заранее: отсутствующие пути remove_path пропускает
+            errors = []
+            with ThreadPoolExecutor(max_workers=len(paths_to_check)) as executor:
+                for path, error in zip(paths_to_check, executor.map(remove_path, paths_to_check)):
+                    if error is not None:
+                        errors.append(f"{path}: {error}")
+            
+            # Сбрасываем кэш созданных директорий и список тем - часть из них только что удалена
+            ensure_directory.cache_clear()
+            self._themes_cache = None
+            
+            if errors:
+                logger.error(f"Ошибка при удалении темы {theme_name}: {'; '.join(errors)}")
+                return False
             
             logger.info(f"Тема успешно удалена: {theme_name}")
             return True